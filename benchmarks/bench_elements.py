@@ -0,0 +1,55 @@
+"""Benchmark deriving material.elements from compositions, as repeated across a dataset.
+
+Usage: FLASK_ENV=development python benchmarks/bench_elements.py [num_records]
+"""
+import random
+import sys
+import time
+
+from mdf_connect_server.processor import validator
+
+
+# Datasets repeat a few hundred compositions across all their records
+NUM_COMPOSITIONS = 300
+SYMBOLS = sorted(validator.ELEMENT_SYMBOLS)
+
+
+def legacy_parse_elements(composition):
+    """The previous parser: character by character, after removing "and"."""
+    composition = composition.replace("and", "")
+    str_of_elem = ""
+    for char in list(composition):
+        if char.isupper():
+            str_of_elem += " " + char
+        elif char.islower():
+            str_of_elem += char
+    list_of_elem = list(set(str_of_elem.split()))
+    list_of_elem.sort()
+    return list_of_elem
+
+
+def make_compositions(num_records):
+    rng = random.Random(0)
+    formulas = ["".join("{}{}".format(rng.choice(SYMBOLS), rng.randint(1, 20))
+                        for i in range(rng.randint(2, 5)))
+                for i in range(NUM_COMPOSITIONS)]
+    return [rng.choice(formulas) for i in range(num_records)]
+
+
+def run(parse_func, compositions):
+    start = time.perf_counter()
+    for composition in compositions:
+        parse_func(composition)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    num_records = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    compositions = make_compositions(num_records)
+    validator._parse_elements.cache_clear()
+    legacy_time = run(legacy_parse_elements, compositions)
+    new_time = run(lambda c: list(validator._parse_elements(c)), compositions)
+    print("{} records, {} distinct compositions".format(num_records, NUM_COMPOSITIONS))
+    print("Legacy parser: {:8.3f} s".format(legacy_time))
+    print("Cached parser: {:8.3f} s ({})".format(new_time, validator._parse_elements.cache_info()))
+    print("Speedup: {:.1f}x".format(legacy_time / new_time))
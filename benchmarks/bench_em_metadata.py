@@ -0,0 +1,146 @@
+"""Benchmark electron microscopy metadata extraction on large synthetic DM3 and EMD files,
+loading only the metadata against loading the full data.
+
+Usage: FLASK_ENV=development python benchmarks/bench_em_metadata.py [size_mib]
+"""
+import os
+import struct
+import sys
+from tempfile import TemporaryDirectory
+import time
+import tracemalloc
+
+import hyperspy.api as hs
+import numpy as np
+
+from mdf_connect_server.processor import extractors
+
+
+# DM3 tag data encodings
+DM_LONG = 3
+DM_USHORT = 4
+DM_FLOAT = 6
+DM_ARRAY = 20
+# DM image data type of float32
+DM_IMAGE_FLOAT32 = 2
+# Written in chunks, to keep memory use out of the measurements
+WRITE_CHUNK_SIZE = 2**24
+FRAME_SHAPE = (1024, 1024)
+
+
+def legacy_extract_metadata(file_path):
+    """The previous load: the full data, only to read the metadata."""
+    hs_data = hs.load(file_path)
+    return (hs_data.metadata.as_dictionary(), hs_data.original_metadata.as_dictionary())
+
+
+def _dm_tag_name(name):
+    name = name.encode("latin-1")
+    return struct.pack(">h", len(name)) + name
+
+
+def _dm_group(name, tags):
+    """Encode a tag group of encoded tags."""
+    return (struct.pack(">b", 20) + _dm_tag_name(name) + struct.pack(">bbl", 0, 0, len(tags))
+            + b"".join(tags))
+
+
+def _dm_array_head(name, enc_type, length):
+    return (struct.pack(">b", 21) + _dm_tag_name(name) + b"%%%%"
+            + struct.pack(">llll", 3, DM_ARRAY, enc_type, length))
+
+
+def _dm_value(name, enc_type, fmt, value):
+    return (struct.pack(">b", 21) + _dm_tag_name(name) + b"%%%%"
+            + struct.pack(">ll", 1, enc_type) + struct.pack("<" + fmt, value))
+
+
+def _dm_string(name, value):
+    # Tag strings are arrays of UTF-16 characters
+    return (_dm_array_head(name, DM_USHORT, len(value))
+            + struct.pack("<{}H".format(len(value)), *[ord(c) for c in value]))
+
+
+def _dm_calibration(name, units):
+    return _dm_group(name, [
+        _dm_value("Origin", DM_FLOAT, "f", 0.0),
+        _dm_value("Scale", DM_FLOAT, "f", 1.0),
+        _dm_string("Units", units)
+    ])
+
+
+def write_dm3(path, shape):
+    """Write a DM3 file of a float32 image stack of zeros, in (frames, y, x) shape,
+    with the tags used by the hyperspy reader and the extractor.
+    """
+    num_values = int(np.prod(shape))
+    image_tags = _dm_group("ImageTags", [_dm_group("Microscope Info", [
+        _dm_value("Emission Current (µA)", DM_FLOAT, "f", 145.0),
+        _dm_string("Operation Mode", "IMAGING"),
+        _dm_string("Name", "Synthetic TEM")
+    ])])
+    calibrations = _dm_group("Calibrations", [
+        _dm_calibration("Brightness", "counts"),
+        _dm_group("Dimension", [_dm_calibration("", "nm") for dim in shape])
+    ])
+    # Dimensions are listed in (x, y, z) order
+    dimensions = _dm_group("Dimensions", [_dm_value("", DM_LONG, "l", dim)
+                                          for dim in reversed(shape)])
+    # Everything up to the image data, which is the last tag so it can be written in chunks
+    head = (
+        # Version, file size (unused by readers), and little-endian tag data
+        struct.pack(">lll", 3, 0, 1)
+        # Root group: ImageList, holding one unnamed image group
+        + struct.pack(">bbl", 0, 0, 1)
+        + struct.pack(">b", 20) + _dm_tag_name("ImageList") + struct.pack(">bbl", 0, 0, 1)
+        + struct.pack(">b", 20) + _dm_tag_name("") + struct.pack(">bbl", 0, 0, 3)
+        + _dm_string("Name", "synthetic")
+        + image_tags
+        + struct.pack(">b", 20) + _dm_tag_name("ImageData") + struct.pack(">bbl", 0, 0, 4)
+        + calibrations
+        + _dm_value("DataType", DM_LONG, "l", DM_IMAGE_FLOAT32)
+        + dimensions
+        + _dm_array_head("Data", DM_FLOAT, num_values))
+    with open(path, "wb") as f:
+        f.write(head)
+        remaining = num_values * 4
+        while remaining:
+            chunk = min(remaining, WRITE_CHUNK_SIZE)
+            f.write(bytes(chunk))
+            remaining -= chunk
+        # End of file marker
+        f.write(bytes(8))
+
+
+def write_emd(path, shape):
+    """Write an EMD file of a float32 image stack of zeros, in (frames, y, x) shape."""
+    hs.signals.Signal2D(np.zeros(shape, dtype="float32")).save(path, overwrite=True)
+
+
+def run(extract_func, file_path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = extract_func(file_path)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+if __name__ == "__main__":
+    size_mib = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    num_frames = max(1, size_mib * 2**20 // (FRAME_SHAPE[0] * FRAME_SHAPE[1] * 4))
+    shape = (num_frames,) + FRAME_SHAPE
+    with TemporaryDirectory() as tmp_dir:
+        print("{:>6} {:>10} {:>24} {:>24}  {}".format("format", "MiB", "full load (s / MiB peak)",
+                                                      "metadata (s / MiB peak)", "shape"))
+        for ext, writer in ((".dm3", write_dm3), (".emd", write_emd)):
+            file_path = os.path.join(tmp_dir, "synthetic" + ext)
+            writer(file_path, shape)
+            legacy_time, legacy_peak, legacy_res = run(legacy_extract_metadata, file_path)
+            new_time, new_peak, new_res = run(
+                lambda path: extractors.extract_electron_microscopy([path]), file_path)
+            new_shape = new_res[0]["image"]["shape"] if new_res else None
+            print("{:>6} {:>10.0f} {:>12.3f} / {:>9.1f} {:>12.3f} / {:>9.1f}  {}"
+                  .format(ext, os.path.getsize(file_path) / 2**20, legacy_time,
+                          legacy_peak / 2**20, new_time, new_peak / 2**20, new_shape))
@@ -0,0 +1,75 @@
+"""Benchmark Excel extraction of multi-sheet workbooks, comparing time and peak memory
+of loading whole sheets with pandas against streaming rows.
+
+Usage: FLASK_ENV=development python benchmarks/bench_excel.py [rows_per_sheet] [num_sheets]
+"""
+import os
+import sys
+from tempfile import TemporaryDirectory
+import time
+import tracemalloc
+
+import openpyxl
+import pandas as pd
+
+from mdf_connect_server.processor import extractors
+
+
+MAPPING = {
+    "material": {
+        "composition": "formula"
+    },
+    "custom": {
+        "energy": "energy",
+        "label": "label"
+    }
+}
+FORMULAS = ["Al2O3", "NaCl", "Fe2O3", "SiO2"]
+
+
+def legacy_extract_excel(file_path, mapping):
+    """Every sheet loaded whole by pandas (the previous extractor read only the first)."""
+    for df in pd.read_excel(file_path, sheet_name=None, na_values=extractors.NA_VALUES).values():
+        yield from extractors._extract_pandas(df, mapping)
+
+
+def streamed_extract_excel(file_path, mapping):
+    return extractors.extract_excel([file_path], {"extractors": {"excel": {"mapping": mapping}}})
+
+
+def write_workbook(path, rows_per_sheet, num_sheets):
+    workbook = openpyxl.Workbook(write_only=True)
+    for sheet_num in range(num_sheets):
+        sheet = workbook.create_sheet("sheet{}".format(sheet_num))
+        sheet.append(["formula", "energy", "label", "extra"])
+        for i in range(rows_per_sheet):
+            sheet.append([FORMULAS[i % len(FORMULAS)], i * 0.5, "row{}".format(i), i])
+    workbook.save(path)
+
+
+def run(extract_func, file_path):
+    """Time extraction, then trace its peak memory. Records are counted and dropped,
+    so the peak is the memory used to read the workbook.
+    """
+    start = time.perf_counter()
+    num_records = sum(1 for record in extract_func(file_path, MAPPING))
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    sum(1 for record in extract_func(file_path, MAPPING))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, num_records
+
+
+if __name__ == "__main__":
+    rows_per_sheet = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    num_sheets = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    with TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "data.xlsx")
+        write_workbook(file_path, rows_per_sheet, num_sheets)
+        legacy_time, legacy_peak, legacy_records = run(legacy_extract_excel, file_path)
+        new_time, new_peak, new_records = run(streamed_extract_excel, file_path)
+    assert new_records == legacy_records == rows_per_sheet * num_sheets
+    print("{} sheets of {} rows".format(num_sheets, rows_per_sheet))
+    print("Whole sheets: {:8.3f} s, peak {:8.1f} MiB".format(legacy_time, legacy_peak / 2**20))
+    print("Streamed:     {:8.3f} s, peak {:8.1f} MiB".format(new_time, new_peak / 2**20))
@@ -0,0 +1,67 @@
+"""Benchmark file grouping on a synthetic VASP/CIF/CSV directory.
+
+Usage: FLASK_ENV=development python benchmarks/bench_grouping.py [num_files]
+"""
+import os
+import sys
+import time
+
+from mdf_connect_server import CONFIG
+from mdf_connect_server.processor.start_extractors import group_files
+
+
+def legacy_group_files(files, config):
+    """The previous grouping: every file against every pattern, then list.remove()."""
+    files = list(files)
+    groups = []
+    for format_rules in config.get("known_formats", {}).values():
+        format_groups = {}
+        for f in files:
+            fname = os.path.basename(f).lower().strip()
+            for format_name in format_rules["files"]:
+                if format_name in fname:
+                    pre_post_pattern = fname.replace(format_name, "")
+                    if not format_groups.get(pre_post_pattern):
+                        format_groups[pre_post_pattern] = []
+                    format_groups[pre_post_pattern].append(f)
+                    break
+        for g in format_groups.values():
+            for f in g:
+                files.remove(f)
+            groups.append({"files": g, "extractors": format_rules["extractors"],
+                           "params": format_rules["params"]})
+    groups.extend([{"files": [f], "extractors": [], "params": {}} for f in files])
+    return groups
+
+
+def make_files(num_files):
+    """Make a synthetic single-directory listing of VASP runs, CIFs, CSVs, and other files."""
+    vasp_names = ["OUTCAR", "INCAR", "POSCAR", "CONTCAR", "KPOINTS", "DOSCAR", "CHGCAR"]
+    files = []
+    i = 0
+    while len(files) < num_files:
+        files.extend("/data/run_{}_{}".format(i, name) for name in vasp_names)
+        files.append("/data/structure_{}.cif".format(i))
+        files.append("/data/table_{}.csv".format(i))
+        files.append("/data/image_{}.tif".format(i))
+        files.append("/data/notes_{}.txt".format(i))
+        i += 1
+    return files[:num_files]
+
+
+def run(group_func, files):
+    start = time.perf_counter()
+    groups = group_func(files, CONFIG["GROUPING_RULES"])
+    return time.perf_counter() - start, groups
+
+
+if __name__ == "__main__":
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    files = make_files(num_files)
+    legacy_time, legacy_groups = run(legacy_group_files, files)
+    new_time, new_groups = run(group_files, files)
+    assert new_groups == legacy_groups
+    print("{} files, {} groups".format(num_files, len(new_groups)))
+    print("Legacy grouping:  {:8.3f} s".format(legacy_time))
+    print("Indexed grouping: {:8.3f} s".format(new_time))
+    print("Speedup:          {:8.1f}x".format(legacy_time / new_time))
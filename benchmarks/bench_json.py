@@ -0,0 +1,107 @@
+"""Benchmark JSON extraction of a large top-level array of records, through extract_group()
+and into batches as an extractor pool worker sends them (without validation), comparing
+time and peak memory of loading the file whole against streaming the records.
+
+Usage: FLASK_ENV=development python benchmarks/bench_json.py [num_records]
+"""
+import json
+import os
+import sys
+from tempfile import TemporaryDirectory
+import time
+import tracemalloc
+
+from mdf_connect_server import CONFIG
+from mdf_connect_server.processor import extractors
+
+
+MAPPING = {
+    "material.composition": "formula",
+    "custom.energy": "results.energy",
+    "custom.converged": "results.converged"
+}
+NA_VALUES = ["na"]
+
+
+def legacy_extract_json(group, params=None):
+    """The previous extractor: the whole file with json.load(), returning all records."""
+    with open(group[0]) as f:
+        return extractors._extract_json(json.load(f), MAPPING, na_values=NA_VALUES)
+
+
+def legacy_extract(group_info, params):
+    """The previous worker: every record of the group, then batches."""
+    extractors.ALL_EXTRACTORS["json"] = legacy_extract_json
+    try:
+        records = list(extractors.extract_group(group_info, params))
+    finally:
+        extractors.ALL_EXTRACTORS["json"] = extractors.extract_json
+    for batch in extractors.batch_records(records):
+        pass
+    return len(records)
+
+
+def stream_extract(group_info, params):
+    """The worker: batches sent as they fill."""
+    num_records = 0
+    records = []
+    for record in extractors.extract_group(group_info, params):
+        num_records += 1
+        records.append(record)
+        if len(records) >= CONFIG["EXTRACTOR_BATCH_SIZE"]:
+            for batch in extractors.batch_records(records):
+                pass
+            records = []
+    for batch in extractors.batch_records(records):
+        pass
+    return num_records
+
+
+def make_record(i):
+    return {
+        "formula": ["Al2O3", "NaCl", "Fe2O3", "SiO2"][i % 4],
+        "results": {
+            "energy": -1.5 * i if i % 10 else "na",
+            "converged": bool(i % 3),
+            "forces": [[0.01 * i, 0.02, -0.03]] * 8
+        },
+        "notes": "unmapped text " * 10
+    }
+
+
+def run(extract, group_info, params):
+    """Extract and batch the records. Returns the time, the traced peak memory,
+    and the number of records.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    num_records = extract(group_info, params)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, num_records
+
+
+if __name__ == "__main__":
+    num_records = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "records.json")
+        with open(file_path, "w") as f:
+            f.write("[" + ",\n".join(json.dumps(make_record(i)) for i in range(num_records))
+                    + "]")
+        group_info = {"files": [file_path], "extractors": ["json"], "params": {}}
+        params = {
+            "extractors": {
+                "json": {"mapping": MAPPING, "na_values": NA_VALUES},
+                "file": {"globus_host": "globus://endpoint/", "http_host": "https://example.com",
+                         "local_path": tmp_dir + "/"}
+            }
+        }
+        legacy_time, legacy_peak, legacy_count = run(legacy_extract, group_info, params)
+        new_time, new_peak, new_count = run(stream_extract, group_info, params)
+        file_size = os.path.getsize(file_path)
+    assert legacy_count == new_count == num_records
+    print("{} records, {:.1f} MiB, batches of {}".format(
+        num_records, file_size / 2**20, CONFIG["EXTRACTOR_BATCH_SIZE"]))
+    print("json.load: {:8.3f} s, peak {:8.1f} MiB".format(legacy_time, legacy_peak / 2**20))
+    print("Streamed:  {:8.3f} s, peak {:8.1f} MiB".format(new_time, new_peak / 2**20))
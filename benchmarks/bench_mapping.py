@@ -0,0 +1,158 @@
+"""Microbenchmark the per-record cost of applying mappings, comparing the previous
+interpretation of the mapping for every record against compiled mapping plans.
+
+Usage: FLASK_ENV=development python benchmarks/bench_mapping.py [num_records]
+"""
+import re
+import sys
+import time
+
+import pandas as pd
+
+from mdf_connect_server.processor import extractors
+
+
+MAPPING = {
+    "material": {
+        "composition": "sample.formula"
+    },
+    "custom": {
+        "energy": "results.energy.value",
+        "converged": "results.converged",
+        "label": "label"
+    },
+    "mdf.tags.first": "tags"
+}
+FILENAME_MAPPING = {
+    "material.composition": "^[A-Z][A-Za-z0-9]*",
+    "custom.step": "step[0-9]+",
+    "custom.ext": "\\..{3,4}$"
+}
+FORMULAS = ["Al2O3", "NaCl", "Fe2O3", "SiO2"]
+
+
+def _legacy_set(record, mdf_path, value):
+    fields = mdf_path.split(".")
+    last_field = fields.pop()
+    current_field = record
+    for field in fields:
+        if current_field.get(field) is None:
+            current_field[field] = {}
+        current_field = current_field[field]
+    current_field[last_field] = value
+
+
+def legacy_map_json(documents, mapping):
+    """The previous mapping: flattened and split again for every document."""
+    records = []
+    for data in documents:
+        record = {}
+        for mdf_path, json_path in extractors._flatten_struct(mapping):
+            try:
+                value = data
+                for field in json_path.split("."):
+                    value = value[field]
+            except KeyError:
+                value = None
+            if value is not None:
+                _legacy_set(record, mdf_path, value)
+        if record:
+            records.append(record)
+    return records
+
+
+def compiled_map_json(documents, mapping):
+    return list(extractors._map_json_documents(documents, mapping))
+
+
+def legacy_map_rows(df, mapping):
+    """The previous row assembly: output paths walked field by field for every value."""
+    columns = {str(col): col for col in df.columns}
+    plan = []
+    for mdf_path, column in extractors._flatten_struct(mapping):
+        if column in columns:
+            series = df[columns[column]]
+            plan.append((mdf_path, series.tolist(), series.notna().to_numpy()))
+    records = []
+    for index in range(len(df.index)):
+        record = {}
+        for mdf_path, values, present in plan:
+            if present[index] and values[index] is not None:
+                _legacy_set(record, mdf_path, values[index])
+        if record:
+            records.append(record)
+    return records
+
+
+def compiled_map_rows(df, mapping):
+    return extractors._extract_pandas(df, mapping)
+
+
+def legacy_map_filenames(filenames, mapping):
+    """The previous filename mapping: uncompiled patterns searched for every file."""
+    records = []
+    for filename in filenames:
+        record = {}
+        for mdf_path, pattern in extractors._flatten_struct(mapping):
+            match = re.search(pattern, filename)
+            if match:
+                _legacy_set(record, mdf_path, match.group())
+        if record:
+            records.append(record)
+    return records
+
+
+def compiled_map_filenames(filenames, mapping):
+    return extractors.extract_filename(filenames, {"extractors": {"filename": {
+        "mapping": mapping}}})
+
+
+def make_document(i):
+    return {
+        "sample": {"formula": FORMULAS[i % len(FORMULAS)]},
+        "results": {"energy": {"value": -1.5 * i, "unit": "eV"}, "converged": bool(i % 3)},
+        "label": "record{}".format(i),
+        "tags": "synthetic"
+    }
+
+
+def run(legacy_func, compiled_func, data, mapping, num_records):
+    """Time both functions, best of three, and check they agree.
+    Returns the per-record times in microseconds.
+    """
+    times = []
+    for func in (legacy_func, compiled_func):
+        best = None
+        for i in range(3):
+            start = time.perf_counter()
+            func(data, mapping)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best / num_records * 10**6)
+    assert legacy_func(data, mapping) == compiled_func(data, mapping)
+    return times
+
+
+if __name__ == "__main__":
+    num_records = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    documents = [make_document(i) for i in range(num_records)]
+    df = pd.DataFrame({
+        "sample.formula": [document["sample"]["formula"] for document in documents],
+        "results.energy.value": [document["results"]["energy"]["value"]
+                                 for document in documents],
+        "results.converged": [document["results"]["converged"] for document in documents],
+        "label": [document["label"] for document in documents],
+        "tags": [document["tags"] for document in documents]
+    })
+    filenames = ["{}_step{}.data".format(FORMULAS[i % len(FORMULAS)], i)
+                 for i in range(num_records)]
+
+    print("{} records, microseconds per record".format(num_records))
+    print("                 Legacy  Compiled")
+    for name, legacy_func, compiled_func, data, mapping in [
+            ("JSON/YAML/XML", legacy_map_json, compiled_map_json, documents, MAPPING),
+            ("CSV/Excel rows", legacy_map_rows, compiled_map_rows, df, MAPPING),
+            ("Filenames", legacy_map_filenames, compiled_map_filenames, filenames,
+             FILENAME_MAPPING)]:
+        legacy_time, compiled_time = run(legacy_func, compiled_func, data, mapping, num_records)
+        print("{:15s} {:7.2f}  {:7.2f}".format(name, legacy_time, compiled_time))
@@ -0,0 +1,112 @@
+"""Benchmark moving records from extractor workers to the parent process.
+
+Usage: FLASK_ENV=development python benchmarks/bench_record_transport.py [num_records]
+"""
+import json
+import multiprocessing
+from queue import Empty
+import sys
+import time
+
+from mdf_connect_server import CONFIG
+from mdf_connect_server.processor.extractors import batch_records
+
+
+NUM_WORKERS = 10
+# Records extracted from each group
+GROUP_SIZE = 100
+
+
+def make_record(i):
+    return {
+        "material": {
+            "composition": "Al2O3",
+            "elements": ["Al", "O"]
+        },
+        "crystal_structure": {
+            "space_group_number": 167,
+            "number_of_atoms": 30,
+            "volume": 255.03 + i
+        },
+        "files": [{
+            "data_type": "ASCII text",
+            "filename": "run_{}.cif".format(i),
+            "length": 1000 + i,
+            "mime_type": "text/plain",
+            "sha512": "f" * 128
+        }]
+    }
+
+
+def make_groups(num_records):
+    return [[make_record(i) for i in range(start, min(start + GROUP_SIZE, num_records))]
+            for start in range(0, num_records, GROUP_SIZE)]
+
+
+def legacy_worker(groups, output_queue):
+    """The previous transport: one JSON string per record."""
+    for group in groups:
+        for record in group:
+            output_queue.put(json.dumps(record))
+
+
+def batched_worker(groups, output_queue):
+    """Batches of records, then an end-of-stream sentinel."""
+    for group in groups:
+        for batch in batch_records(group):
+            output_queue.put(("records", batch))
+    output_queue.put(("done", None))
+
+
+def legacy_consume(output_queue, workers):
+    """The previous completion check: poll the queue, then join every worker."""
+    num_records = 0
+    while True:
+        try:
+            json.loads(output_queue.get(timeout=1))
+            num_records += 1
+        except Empty:
+            if any([t.is_alive() for t in workers]):
+                [t.join(timeout=1) for t in workers]
+            else:
+                break
+    return num_records
+
+
+def batched_consume(output_queue, workers):
+    num_records = 0
+    num_done = 0
+    while num_done < len(workers):
+        kind, payload = output_queue.get()
+        if kind == "records":
+            num_records += len(json.loads(payload))
+        else:
+            num_done += 1
+    [t.join() for t in workers]
+    return num_records
+
+
+def run(worker_func, consume_func, groups):
+    output_queue = multiprocessing.Queue()
+    start = time.perf_counter()
+    workers = [multiprocessing.Process(target=worker_func,
+                                       args=(groups[i::NUM_WORKERS], output_queue))
+               for i in range(NUM_WORKERS)]
+    [t.start() for t in workers]
+    num_records = consume_func(output_queue, workers)
+    elapsed = time.perf_counter() - start
+    assert num_records == sum(len(group) for group in groups)
+    return num_records / elapsed, elapsed
+
+
+if __name__ == "__main__":
+    num_records = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    groups = make_groups(num_records)
+    legacy_rate, legacy_time = run(legacy_worker, legacy_consume, groups)
+    batched_rate, batched_time = run(batched_worker, batched_consume, groups)
+    print("{} records, {} workers, batches of {}".format(num_records, NUM_WORKERS,
+                                                         CONFIG["EXTRACTOR_BATCH_SIZE"]))
+    print("Per-record transport: {:10.0f} records/s ({:.2f} s)".format(legacy_rate, legacy_time))
+    print("Batched transport:    {:10.0f} records/s ({:.2f} s)"
+          .format(batched_rate, batched_time))
+    print("Speedup:              {:10.1f}x".format(batched_rate / legacy_rate))
@@ -0,0 +1,66 @@
+"""Simulate extraction of a dataset on the extractor pool's workers, comparing the time to
+finish all groups when groups are dispatched in directory-walk order against
+most expensive first (by estimate_group_cost()).
+Actual group times are the estimates with random error.
+
+Usage: FLASK_ENV=development python benchmarks/bench_scheduling.py [num_groups] [num_workers]
+"""
+import heapq
+import random
+import sys
+
+from mdf_connect_server.processor import extractors
+
+
+MIB = 2**20
+
+
+def make_groups(num_groups):
+    """Many small structure and CSV files, with a large micrograph and VASP run
+    found last by the directory walk.
+    """
+    rng = random.Random(0)
+    groups = []
+    for i in range(num_groups):
+        if i % 2:
+            groups.append({"files": ["run{}/POSCAR".format(i)],
+                           "sizes": [rng.randint(1, 50) * 1024],
+                           "extractors": ["crystal_structure"], "params": {}})
+        else:
+            groups.append({"files": ["table{}.csv".format(i)],
+                           "sizes": [rng.randint(1, 500) * 1024],
+                           "extractors": [], "params": {}})
+    groups.extend([
+        {"files": ["micrographs/big.dm4"], "sizes": [40 * 1024 * MIB], "extractors": [],
+         "params": {}},
+        {"files": ["vasp/OUTCAR", "vasp/vasprun.xml"], "sizes": [300 * MIB, 600 * MIB],
+         "extractors": ["pif", "crystal_structure"], "params": {}}
+    ])
+    params = {"extractors": {"csv": {"mapping": {"material.composition": "formula"}}}}
+    for group_info in groups:
+        group_info["cost"] = extractors.estimate_group_cost(group_info, params)
+        group_info["actual"] = group_info["cost"]["time"] * rng.uniform(0.5, 2)
+    return groups
+
+
+def simulate(groups, num_workers):
+    """Dispatch groups in order to the first idle worker. Returns the time to finish."""
+    workers = [0.0] * num_workers
+    for group_info in groups:
+        start = heapq.heappop(workers)
+        heapq.heappush(workers, start + group_info["actual"])
+    return max(workers)
+
+
+if __name__ == "__main__":
+    num_groups = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    groups = make_groups(num_groups)
+    walk_time = simulate(groups, num_workers)
+    cost_time = simulate(sorted(groups, key=lambda g: g["cost"]["time"], reverse=True),
+                         num_workers)
+    total = sum(group_info["actual"] for group_info in groups)
+    print("{} groups on {} workers, {:.0f} s of work ({:.0f} s if evenly spread)"
+          .format(len(groups), num_workers, total, total / num_workers))
+    print("Walk order:           {:8.0f} s".format(walk_time))
+    print("Most expensive first: {:8.0f} s".format(cost_time))
@@ -0,0 +1,65 @@
+"""Benchmark record validation with and without the compiled schema registry.
+
+Usage: FLASK_ENV=development python benchmarks/bench_schema_registry.py [num_records]
+"""
+import json
+import os
+import sys
+import time
+
+import jsonschema
+
+from mdf_connect_server import CONFIG
+from mdf_connect_server.schema_registry import validate_schema
+
+
+RECORD = {
+    "mdf": {
+        "source_name": "foo_bar_dataset",
+        "source_id": "foo_bar_dataset_v1",
+        "scroll_id": 1,
+        "ingest_date": "2018-01-01T00:00:00.000000Z",
+        "resource_type": "record",
+        "version": 1,
+        "acl": ["public"]
+    },
+    "files": [{
+        "data_type": "ASCII text",
+        "filename": "foo.bar",
+        "length": 100
+    }],
+    "material": {
+        "composition": "Al2O3",
+        "elements": ["Al", "O"]
+    }
+}
+
+
+def validate_uncached(record, schema_dir):
+    """The previous per-record behavior: load and resolve the schema every time."""
+    with open(os.path.join(schema_dir, "record.json")) as schema_file:
+        schema = json.load(schema_file)
+    resolver = jsonschema.RefResolver(base_uri="file://{}/".format(schema_dir),
+                                      referrer=schema)
+    jsonschema.validate(record, schema, resolver=resolver)
+
+
+def validate_registry(record, schema_dir):
+    validate_schema(record, "record", schema_dir)
+
+
+def run(validate_func, num_records, schema_dir):
+    start = time.perf_counter()
+    for i in range(num_records):
+        validate_func(RECORD, schema_dir)
+    return num_records / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    num_records = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    schema_dir = CONFIG["SCHEMA_PATH"]
+    before = run(validate_uncached, num_records, schema_dir)
+    after = run(validate_registry, num_records, schema_dir)
+    print("Uncached validation: {:10.1f} records/s".format(before))
+    print("Schema registry:     {:10.1f} records/s".format(after))
+    print("Speedup:             {:10.1f}x".format(after / before))
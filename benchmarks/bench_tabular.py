@@ -0,0 +1,80 @@
+"""Benchmark tabular (CSV/Excel) record mapping, comparing time and peak memory.
+
+Usage: FLASK_ENV=development python benchmarks/bench_tabular.py [num_rows]
+"""
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from mdf_connect_server.processor import extractors
+
+
+MAPPING = {
+    "material": {
+        "composition": "formula"
+    },
+    "custom": {
+        "energy": "energy",
+        "volume": "volume",
+        "converged": "converged",
+        "label": "label"
+    }
+}
+
+
+def legacy_extract_pandas(df, mapping):
+    """The previous mapping: whole-DataFrame JSON round trip, then per-row path lookups."""
+    csv_len = len(df.index)
+    df_json = json.loads(df.to_json())
+
+    records = []
+    for index in range(csv_len):
+        new_map = {}
+        for path, value in extractors._flatten_struct(mapping):
+            new_map[path] = value + "." + str(index)
+        records.extend(extractors._extract_json(df_json, new_map))
+    return records
+
+
+def make_df(num_rows):
+    rng = np.random.RandomState(0)
+    energy = rng.normal(size=num_rows)
+    energy[::17] = np.nan
+    df = pd.DataFrame({
+        "formula": rng.choice(["Al2O3", "NaCl", "Fe2O3", "SiO2"], size=num_rows),
+        "energy": energy,
+        "volume": rng.uniform(10, 100, size=num_rows),
+        "converged": rng.choice([True, False], size=num_rows),
+        "label": ["row{}".format(i) for i in range(num_rows)]
+    })
+    # Unmapped columns still cost the legacy path
+    for i in range(10):
+        df["extra{}".format(i)] = rng.normal(size=num_rows)
+    return df
+
+
+def run(extract_func, df):
+    tracemalloc.start()
+    start = time.perf_counter()
+    records = extract_func(df, MAPPING)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, records
+
+
+if __name__ == "__main__":
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    df = make_df(num_rows)
+    legacy_time, legacy_peak, legacy_records = run(legacy_extract_pandas, df)
+    new_time, new_peak, new_records = run(extractors._extract_pandas, df)
+    assert new_records == legacy_records
+    print("{} rows".format(num_rows))
+    print("Legacy mapping:   {:8.3f} s, peak {:8.1f} MiB".format(legacy_time, legacy_peak / 2**20))
+    print("Columnar mapping: {:8.3f} s, peak {:8.1f} MiB".format(new_time, new_peak / 2**20))
+    print("Speedup: {:.1f}x, memory reduction: {:.1f}x".format(legacy_time / new_time,
+                                                               legacy_peak / new_peak))
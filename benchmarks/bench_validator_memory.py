@@ -0,0 +1,99 @@
+"""Benchmark Validator memory use and speed as the number of records grows.
+
+Usage: FLASK_ENV=development python benchmarks/bench_validator_memory.py [num_records]
+"""
+import json
+import sys
+import time
+import tracemalloc
+
+from mdf_connect_server import CONFIG
+from mdf_connect_server.processor import Validator
+
+
+DATASET = {
+    "dc": {
+        "creators": [{
+            "creatorName": "Footon, Bartholomew",
+            "familyName": "Footon",
+            "givenName": "Bartholomew"
+        }],
+        "publicationYear": "2018",
+        "publisher": "Materials Data Facility",
+        "resourceType": {
+            "resourceType": "Dataset",
+            "resourceTypeGeneral": "Dataset"
+        },
+        "titles": [{
+            "title": "Foo Bar Dataset"
+        }]
+    },
+    "mdf": {
+        "source_name": "foo_bar_dataset",
+        "source_id": "foo_bar_dataset_v1",
+        "acl": ["public"]
+    }
+}
+
+
+def make_record(i):
+    return {
+        "files": [{
+            "data_type": "ASCII text",
+            "filename": "run_{}.csv".format(i),
+            "globus": "globus://endpoint/data/run_{}.csv".format(i),
+            "length": 1000 + i,
+            "mime_type": "text/plain",
+            "sha512": "f" * 128,
+            "url": None
+        }],
+        "material": {
+            "composition": "Al2O3"
+        },
+        "custom": {
+            "energy": -1.5 * i,
+            "converged": True,
+            "note": None
+        }
+    }
+
+
+class LegacyValidator(Validator):
+    """The previous record path: on top of the null-stripping copy and validation,
+    a full json.dumps() only to check for NaN, and every files block kept in memory.
+    """
+    def start_dataset(self, ds_md, validation_info=None):
+        self.indexed_files = []
+        return super().start_dataset(ds_md, validation_info)
+
+    def validate_record(self, rc_md):
+        json.dumps(rc_md, allow_nan=False)
+        res = super().validate_record(rc_md)
+        if res["success"]:
+            self.indexed_files += res["record"]["files"]
+        return res
+
+
+def run(validator_class, num_records):
+    vald = validator_class(schema_path=CONFIG["SCHEMA_PATH"])
+    assert vald.start_dataset(json.loads(json.dumps(DATASET)))["success"]
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(num_records):
+        assert vald.add_record(make_record(i))["success"]
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert sum(1 for record in vald.get_finished_dataset()) == num_records + 1
+    return elapsed, current, peak
+
+
+if __name__ == "__main__":
+    max_records = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print("{:>10} {:>24} {:>24}".format("records", "legacy (s / MiB held)",
+                                        "single pass (s / MiB held)"))
+    for num_records in (max_records // 10, max_records // 2, max_records):
+        legacy_time, legacy_mem, legacy_peak = run(LegacyValidator, num_records)
+        new_time, new_mem, new_peak = run(Validator, num_records)
+        print("{:>10} {:>12.2f} / {:>9.2f} {:>12.2f} / {:>9.2f}"
+              .format(num_records, legacy_time, legacy_mem / 2**20, new_time, new_mem / 2**20))
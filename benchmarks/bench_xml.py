@@ -0,0 +1,90 @@
+"""Benchmark XML extraction of a large instrument export, comparing time and peak memory
+of xmltodict on the whole file against streaming the repeated elements.
+Each extraction runs in its own process, to measure its peak RSS.
+
+Usage: FLASK_ENV=development python benchmarks/bench_xml.py [size_mib]
+"""
+import multiprocessing
+import os
+import resource
+import sys
+from tempfile import TemporaryDirectory
+import time
+
+from mdf_connect_server.processor import extractors
+
+
+MAPPING = {
+    "material.composition": "sample.formula",
+    "custom.energy": "result.energy.#text",
+    "custom.step": "@step"
+}
+ITEM_PATH = "export.measurements.measurement"
+ITEM_XML = ('  <measurement step="{0}">\n'
+            '    <sample><formula>{1}</formula><mass unit="mg">{2}</mass></sample>\n'
+            '    <result><energy unit="eV">{3}</energy><converged>true</converged></result>\n'
+            '    <log>{4}</log>\n'
+            '  </measurement>\n')
+FORMULAS = ["Al2O3", "NaCl", "Fe2O3", "SiO2"]
+
+
+def write_export(path, size):
+    """Write an XML export of at least size bytes."""
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<export>\n'
+                '<header><instrument>synthetic</instrument></header>\n<measurements>\n')
+        step = 0
+        while f.tell() < size:
+            f.write("".join(ITEM_XML.format(i, FORMULAS[i % len(FORMULAS)], i * 0.01, -1.5 * i,
+                                            "unmapped log line " * 5)
+                            for i in range(step, step + 1000)))
+            step += 1000
+        f.write("</measurements>\n</export>\n")
+
+
+def legacy_extract(file_path):
+    """The whole file with xmltodict. Repeated elements cannot be mapped to records this way,
+    so only the header is mapped.
+    """
+    params = {"extractors": {"xml": {"mapping": {"custom.instrument": "export.header.instrument"}}}}
+    return sum(1 for record in extractors.extract_xml([file_path], params))
+
+
+def stream_extract(file_path):
+    """One record per element, counted and dropped, so the peak is the memory used to read
+    the file.
+    """
+    params = {"extractors": {"xml": {"mapping": MAPPING, "item_path": ITEM_PATH}}}
+    return sum(1 for record in extractors.extract_xml([file_path], params))
+
+
+def extract(extract_func, file_path, results):
+    start = time.perf_counter()
+    num_records = extract_func(file_path)
+    elapsed = time.perf_counter() - start
+    # Peak RSS in KiB on Linux
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, num_records))
+
+
+def run(extract_func, file_path):
+    results = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=extract, args=(extract_func, file_path, results))
+    proc.start()
+    result = results.get()
+    proc.join()
+    return result
+
+
+if __name__ == "__main__":
+    size_mib = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    with TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "export.xml")
+        write_export(file_path, size_mib * 2**20)
+        new_time, new_rss, new_records = run(stream_extract, file_path)
+        legacy_time, legacy_rss, legacy_records = run(legacy_extract, file_path)
+        file_size = os.path.getsize(file_path)
+    print("{:.0f} MiB, {} elements".format(file_size / 2**20, new_records))
+    print("xmltodict: {:8.3f} s, peak RSS {:8.1f} MiB, {} record(s)"
+          .format(legacy_time, legacy_rss / 2**10, legacy_records))
+    print("Streamed:  {:8.3f} s, peak RSS {:8.1f} MiB, {} record(s)"
+          .format(new_time, new_rss / 2**10, new_records))
@@ -0,0 +1,77 @@
+"""Benchmark YAML extraction of a large multi-document simulation log, comparing the
+pure-Python loader on the whole stream against lazy loading with the libyaml loader.
+
+Usage: FLASK_ENV=development python benchmarks/bench_yaml.py [num_documents]
+"""
+import os
+import sys
+from tempfile import TemporaryDirectory
+import time
+import tracemalloc
+
+import yaml
+
+from mdf_connect_server.processor import extractors
+
+
+MAPPING = {
+    "material.composition": "system.formula",
+    "custom.energy": "step.energy",
+    "custom.converged": "step.converged"
+}
+DOCUMENT = """---
+system:
+  formula: {formula}
+  cell: [[4.0, 0.0, 0.0], [0.0, 4.0, 0.0], [0.0, 0.0, 4.0]]
+step:
+  index: {index}
+  energy: {energy}
+  converged: {converged}
+  forces:
+    - [0.01, -0.02, 0.03]
+    - [0.04, -0.05, 0.06]
+"""
+
+
+def legacy_extract_yaml(file_path):
+    """All documents loaded at once with the pure-Python loader
+    (the previous extractor used safe_load(), which only allows one document).
+    """
+    with open(file_path) as f:
+        documents = list(yaml.load_all(f, Loader=yaml.SafeLoader))
+    return sum(1 for record in extractors._map_json_documents(documents, MAPPING))
+
+
+def lazy_extract_yaml(file_path):
+    params = {"extractors": {"yaml": {"mapping": MAPPING}}}
+    return sum(1 for record in extractors.extract_yaml([file_path], params))
+
+
+def run(extract_func, file_path):
+    """Time extraction, then trace its peak memory. Records are counted and dropped."""
+    start = time.perf_counter()
+    num_records = extract_func(file_path)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    extract_func(file_path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, num_records
+
+
+if __name__ == "__main__":
+    num_documents = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "log.yaml")
+        with open(file_path, "w") as f:
+            for i in range(num_documents):
+                f.write(DOCUMENT.format(formula=["Al2O3", "NaCl"][i % 2], index=i,
+                                        energy=-1.5 * i, converged=str(bool(i % 3)).lower()))
+        legacy_time, legacy_peak, legacy_records = run(legacy_extract_yaml, file_path)
+        new_time, new_peak, new_records = run(lazy_extract_yaml, file_path)
+    assert legacy_records == new_records == num_documents
+    print("{} documents, loader {}".format(num_documents, extractors.YAML_LOADER.__name__))
+    print("Python, all at once: {:8.3f} s, peak {:8.1f} MiB"
+          .format(legacy_time, legacy_peak / 2**20))
+    print("Lazy:                {:8.3f} s, peak {:8.1f} MiB".format(new_time, new_peak / 2**20))
+    print("Speedup: {:.1f}x".format(legacy_time / new_time))
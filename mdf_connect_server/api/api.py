@@ -157,12 +157,8 @@ def accept_submission():
                 "subject": tag
             })
 
-    with open(os.path.join(CONFIG["SCHEMA_PATH"], "connect_submission.json")) as schema_file:
-        schema = json.load(schema_file)
-    resolver = jsonschema.RefResolver(base_uri="file://{}/".format(CONFIG["SCHEMA_PATH"]),
-                                      referrer=schema)
     try:
-        jsonschema.validate(metadata, schema, resolver=resolver)
+        utils.validate_schema(metadata, "connect_submission")
     except jsonschema.ValidationError as e:
         return (jsonify({
             "success": False,
@@ -736,12 +732,8 @@ def metadata_update(source_id):
     if not new_entry.get("mdf"):
         new_entry["mdf"] = {}
     new_entry["mdf"]["acl"] = dataset_acl
-    with open(os.path.join(CONFIG["SCHEMA_PATH"], "dataset.json")) as schema_file:
-        schema = json.load(schema_file)
-    resolver = jsonschema.RefResolver(base_uri="file://{}/".format(CONFIG["SCHEMA_PATH"]),
-                                      referrer=schema)
     try:
-        jsonschema.validate(new_entry, schema, resolver=resolver)
+        utils.validate_schema(new_entry, "dataset")
     except jsonschema.ValidationError as e:
         return (jsonify({
             "success": False,
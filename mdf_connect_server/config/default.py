@@ -5,6 +5,7 @@ DEFAULT = {
     "LOCAL_PATH": os.path.expanduser("~/data/"),
     "FEEDSTOCK_PATH": os.path.expanduser("~/feedstock/"),
     "SERVICE_DATA": os.path.expanduser("~/integrations/"),
+    "EXTRACTION_CACHE_PATH": os.path.expanduser("~/extraction_cache/"),
     "CURATION_DATA": os.path.expanduser("~/curation/"),
 
     "SCHEMA_PATH": os.path.abspath(os.path.join(os.path.dirname(__file__), "schemas", "schemas")),
@@ -18,8 +19,23 @@ DEFAULT = {
     "PROCESSOR_SLEEP_TIME": 40,  # Seconds
 
     "NUM_EXTRACTORS": 10,
+    "NUM_WALKERS": 4,
     "NUM_SUBMITTERS": 5,
+    "NUM_POPULATORS": 2,
     "EXTRACTOR_ERROR_FILE": "extractor_errors.log",
+    "FILE_HASH_THREADS": 4,
+    "EXTRACTOR_TIMEOUT": 600,  # Seconds per extractor call
+    # Timeouts for extractors that need longer, keyed by extractor name
+    "EXTRACTOR_TIMEOUTS": {
+        "electron_microscopy": 1800
+    },
+    "EXTRACTOR_MAX_RSS": 4096,  # MiB per extractor worker
+    # MiB of estimated memory for groups that need more than a worker's share of the budget,
+    # running at the same time (a larger group runs without other such groups)
+    "EXTRACTOR_MEMORY_BUDGET": 6144,
+    "EXTRACTOR_MAX_TASKS": 500,  # Groups extracted before an extractor worker is replaced
+    "EXTRACTOR_BATCH_SIZE": 1000,  # Records sent from an extractor worker at a time
+    "EXTRACTION_CACHE_SIZE": 10240,  # MiB of cached extractor results, 0 to disable the cache
 
     "CANCEL_WAIT_TIME": 60,  # Seconds
 
@@ -31,6 +47,7 @@ DEFAULT = {
                             " inconvenience."),
 
     "NUM_CURATION_RECORDS": 3,
+    "FEEDSTOCK_BLOCK_SIZE": 1000,  # Records in each compressed feedstock block
 
     "SCHEMA_NULLS": ["url"],  # Just url from files
 
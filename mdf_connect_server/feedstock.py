@@ -0,0 +1,206 @@
+from bisect import bisect_right
+import gzip
+from itertools import islice
+import json
+import os
+
+from mdf_connect_server import CONFIG
+
+
+# Feedstock is written once, as a series of independently gzipped blocks of JSON Lines
+# (together a valid multi-member gzip file), with the dataset entry in its own last block.
+# The sidecar index holds the position of every block, so readers can seek to any entry.
+# Entry 0 is always the dataset, and entries 1 onwards are the records, in scroll_id order.
+FEEDSTOCK_FORMAT = "gzip-blocks"
+FEEDSTOCK_FORMAT_VERSION = 1
+FEEDSTOCK_COMPRESSLEVEL = 6
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def get_index_path(feedstock_file):
+    """Get the path to the offset index of a feedstock file."""
+    return feedstock_file + ".idx"
+
+
+class FeedstockWriter:
+    """Writes framed, compressed feedstock and its offset index.
+
+    Flow:
+        writer = FeedstockWriter(feedstock_file)
+        for record in records:
+            writer.write(record)
+        writer.close(dataset)
+    The feedstock is written to a partial file, which is moved into place
+    along with the index by close().
+    """
+    def __init__(self, feedstock_file, block_size=None):
+        """Open the feedstock file.
+
+        Arguments:
+        feedstock_file (str): The path to write the feedstock to.
+        block_size (int): The number of records in each compressed block.
+                Default CONFIG["FEEDSTOCK_BLOCK_SIZE"].
+        """
+        self.feedstock_file = feedstock_file
+        self.num_records = 0
+        self.__block_size = block_size or CONFIG["FEEDSTOCK_BLOCK_SIZE"]
+        self.__lines = []
+        # [offset, length, first entry, number of entries] for each record block
+        self.__blocks = []
+        self.__offset = 0
+        os.makedirs(os.path.dirname(os.path.abspath(feedstock_file)), exist_ok=True)
+        self.__file = open(feedstock_file + ".part", "wb")
+
+    def write(self, entry):
+        """Add a record to the feedstock.
+
+        Arguments:
+        entry (dict): The record.
+        """
+        self.__lines.append(json.dumps(entry))
+        self.num_records += 1
+        if len(self.__lines) >= self.__block_size:
+            self.__flush()
+
+    def close(self, dataset):
+        """Finish the feedstock with the dataset entry, and write the index.
+
+        Arguments:
+        dataset (dict): The dataset entry.
+        """
+        self.__flush()
+        dataset_block = self.__write_block([json.dumps(dataset)])
+        self.__file.close()
+        index = {
+            "format": FEEDSTOCK_FORMAT,
+            "version": FEEDSTOCK_FORMAT_VERSION,
+            "num_records": self.num_records,
+            "dataset": dataset_block,
+            "blocks": self.__blocks
+        }
+        # Index first, so the feedstock is never seen without it
+        index_path = get_index_path(self.feedstock_file)
+        with open(index_path + ".part", "w") as f:
+            json.dump(index, f)
+        os.replace(index_path + ".part", index_path)
+        os.replace(self.feedstock_file + ".part", self.feedstock_file)
+
+    def discard(self):
+        """Abandon the feedstock, removing anything written."""
+        self.__file.close()
+        os.remove(self.feedstock_file + ".part")
+
+    def __flush(self):
+        if self.__lines:
+            first_entry = self.num_records - len(self.__lines) + 1
+            offset, length = self.__write_block(self.__lines)
+            self.__blocks.append([offset, length, first_entry, len(self.__lines)])
+            self.__lines = []
+
+    def __write_block(self, lines):
+        data = gzip.compress(("\n".join(lines) + "\n").encode("utf-8"),
+                             compresslevel=FEEDSTOCK_COMPRESSLEVEL)
+        offset = self.__offset
+        self.__file.write(data)
+        self.__offset += len(data)
+        return [offset, len(data)]
+
+
+def read_feedstock_index(feedstock_file):
+    """Read the offset index of a feedstock file.
+
+    Arguments:
+    feedstock_file (str): The path to the feedstock.
+
+    Returns:
+    dict: The index, or None if the feedstock is plain JSON Lines.
+
+    Raises:
+    ValueError: If the feedstock is compressed, but the index is missing or in an unknown format.
+    """
+    with open(feedstock_file, "rb") as f:
+        if f.read(len(GZIP_MAGIC)) != GZIP_MAGIC:
+            return None
+    try:
+        with open(get_index_path(feedstock_file)) as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        raise ValueError("Feedstock '{}' has no index".format(feedstock_file))
+    if index.get("format") != FEEDSTOCK_FORMAT or index.get("version") != FEEDSTOCK_FORMAT_VERSION:
+        raise ValueError("Unknown feedstock format {} version {}"
+                         .format(index.get("format"), index.get("version")))
+    return index
+
+
+def read_feedstock(feedstock_file, start=0, stop=None):
+    """Read entries from feedstock, either framed and compressed (with an index)
+    or plain JSON Lines.
+
+    Arguments:
+    feedstock_file (str): The path to the feedstock.
+    start (int): The first entry to read. Entry 0 is the dataset, the records follow.
+            Default 0.
+    stop (int): The entry to stop before. Default None, to read to the end.
+
+    Yields:
+    dict: The entries.
+    """
+    index = read_feedstock_index(feedstock_file)
+    if index is None:
+        with open(feedstock_file) as f:
+            for line in islice(f, start, stop):
+                yield json.loads(line)
+        return
+
+    num_entries = index["num_records"] + 1
+    stop = num_entries if stop is None else min(stop, num_entries)
+    if start >= stop:
+        return
+    with open(feedstock_file, "rb") as f:
+        if start == 0:
+            yield json.loads(_read_block(f, *index["dataset"]))
+            start = 1
+        # Blocks are in entry order, so seek to the block holding the start entry
+        blocks = index["blocks"]
+        block_num = bisect_right([block[2] for block in blocks], start) - 1
+        while start < stop and block_num < len(blocks):
+            offset, length, first_entry, block_entries = blocks[block_num]
+            lines = _read_block(f, offset, length).splitlines()
+            for line in lines[start - first_entry:stop - first_entry]:
+                yield json.loads(line)
+            start = first_entry + block_entries
+            block_num += 1
+
+
+def _read_block(f, offset, length):
+    f.seek(offset)
+    return gzip.decompress(f.read(length)).decode("utf-8")
+
+
+def feedstock_shards(feedstock_file, num_shards):
+    """Split feedstock into ranges of entries, on block boundaries,
+    which can be read independently with read_feedstock().
+
+    Arguments:
+    feedstock_file (str): The path to the feedstock.
+    num_shards (int): The maximum number of shards.
+
+    Returns:
+    list of tuple: The (start, stop) of each shard. Plain JSON Lines feedstock
+            cannot be split, and is one shard.
+    """
+    index = read_feedstock_index(feedstock_file)
+    if index is None or not index["blocks"]:
+        return [(0, None)]
+    blocks = index["blocks"]
+    num_shards = max(1, min(num_shards, len(blocks)))
+    # Shards start on the block boundaries closest to even splits
+    starts = [0] + [blocks[len(blocks) * i // num_shards][2] for i in range(1, num_shards)]
+    return list(zip(starts, starts[1:] + [None]))
+
+
+def remove_feedstock(feedstock_file):
+    """Delete a feedstock file and its index, if any."""
+    for path in (feedstock_file, get_index_path(feedstock_file)):
+        if os.path.exists(path):
+            os.remove(path)
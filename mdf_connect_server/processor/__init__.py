@@ -2,5 +2,14 @@
 # NOTE: flake8 complains about these imports going unused; this is fine
 from .extractors import run_extractors
 from .validator import Validator
+from .extractor_pool import ExtractorPool
 from .start_extractors import start_extractors
-from .processor import processor
+
+
+def processor():
+    """Start the submission processor (see processor.processor()).
+    The processor module is only imported here, so extractor workers, which import this package,
+    do not load utils and the submission dependencies (boto3, citrination_client, and others).
+    """
+    from .processor import processor as start_processor
+    start_processor()
@@ -0,0 +1,140 @@
+import gzip
+from hashlib import sha512
+import json
+import logging
+import os
+from tempfile import NamedTemporaryFile
+
+
+logger = logging.getLogger(__name__)
+
+# Check the cache size after writing this fraction of the size limit
+CACHE_CHECK_FRACTION = 0.01
+# Evict down to this fraction of the size limit, so eviction does not run on every write
+CACHE_EVICT_FRACTION = 0.9
+
+
+class ExtractionCache:
+    """On-disk cache of extractor results, addressed by the content of the files extracted,
+    so identical files are only extracted once, within a dataset and across versions of it.
+
+    Every extractor worker has its own ExtractionCache on the same directory.
+    Entries are gzipped JSON files, named by their key. The least recently used entries
+    (by modification time, updated on every hit) are evicted once the cache grows past
+    its size limit. Each worker checks the size after writing a fraction of the limit,
+    so the cache can briefly overshoot the limit by that much per worker.
+    """
+    def __init__(self, cache_dir, max_size):
+        """Set up the cache.
+
+        Arguments:
+        cache_dir (str): The directory to keep the cache in. Created if needed.
+        max_size (int): The size limit for the cache, in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__written = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(extractor_name, extractor_version, files, params):
+        """Make the cache key for an extractor run.
+
+        Arguments:
+        extractor_name (str): The extractor.
+        extractor_version (int): The version of the extractor.
+        files (list of tuple): The (filename, sha512) of each file given to the extractor,
+                in group order. Some readers select a format by filename (e.g. POSCAR,
+                vasprun.xml), so identical contents with different names are different inputs.
+        params (dict): The extractor's effective parameters.
+
+        Returns:
+        str: The key.
+        """
+        key_data = json.dumps([extractor_name, extractor_version, files, params],
+                              sort_keys=True)
+        return sha512(key_data.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Look up an extractor result.
+
+        Arguments:
+        key (str): The key, from make_key().
+
+        Returns:
+        tuple: The results.
+            bool: True if the result was cached.
+            The extractor result, if cached. Otherwise None.
+        """
+        path = self.__get_path(key)
+        try:
+            with gzip.open(path, "rt") as f:
+                result = json.load(f)
+            # Mark as recently used
+            os.utime(path)
+        # Missing, evicted by another worker, or partially written before a crash
+        except (OSError, EOFError, ValueError):
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, result
+
+    def put(self, key, result):
+        """Cache an extractor result.
+        Results that cannot be serialized to JSON are not cached.
+
+        Arguments:
+        key (str): The key, from make_key().
+        result: The extractor result.
+        """
+        try:
+            data = gzip.compress(json.dumps(result, allow_nan=False).encode("utf-8"))
+        except (TypeError, ValueError) as e:
+            logger.debug("Extractor result not cacheable: {}".format(repr(e)))
+            return
+        path = self.__get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write atomically, as other workers may read the entry at any time
+        with NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+            f.write(data)
+        os.replace(f.name, path)
+        self.__written += len(data)
+        if self.__written >= self.max_size * CACHE_CHECK_FRACTION:
+            self.evict()
+
+    def evict(self):
+        """Evict the least recently used entries, if the cache is over its size limit.
+
+        Returns:
+        int: The size of the cache afterwards, in bytes.
+        """
+        self.__written = 0
+        entries = []
+        total_size = 0
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+        if total_size > self.max_size:
+            entries.sort()
+            for mtime, size, path in entries:
+                if total_size <= self.max_size * CACHE_EVICT_FRACTION:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+        return total_size
+
+    def __get_path(self, key):
+        # Spread entries over subdirectories, to keep directories small
+        return os.path.join(self.cache_dir, key[:2], key + ".json.gz")
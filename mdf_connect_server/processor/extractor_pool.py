@@ -0,0 +1,521 @@
+from collections import deque
+import heapq
+from itertools import count
+import json
+import logging
+import multiprocessing
+import os
+from queue import Empty
+import signal
+import threading
+import time
+
+from mdf_connect_server import CONFIG
+from mdf_connect_server.processor.extractors import (EXTRACTOR_COUNTERS, get_rss,
+                                                     merge_extractor_stats, run_extractors)
+
+
+logger = logging.getLogger(__name__)
+
+# Extractor workers and submission drivers are forked from a forkserver that has
+# already imported the extractors and their heavy backends, so new processes start warm
+# (and are never forked from the threaded processor itself)
+MP_CONTEXT = multiprocessing.get_context("forkserver")
+PRELOAD_MODULES = [
+    "mdf_connect_server.processor.extractors",
+    "mdf_connect_server.processor.validator",
+    "ase.io",
+    "pymatgen",
+    "pymatgen.io.ase",
+    "pandas",
+    "PIL.Image",
+    "pycalphad",
+    "hyperspy.api",
+    "pif_ingestor.manager",
+    "pypif.pif",
+    "pypif_sdk.interop.mdf"
+]
+# Seconds between worker life-checks
+POOL_POLL_TIME = 1
+# Seconds without a sign of life from the scheduler before submissions give up on the pool
+POOL_TIMEOUT = 60
+
+
+class ExtractorPool:
+    """A long-lived pool of extractor workers, shared by all submissions.
+    Submissions talk to the pool through an ExtractorPoolHandle (from open()).
+    A scheduler thread hands queued groups to idle workers round-robin across
+    submissions, so one large dataset cannot starve the others, and routes each
+    submission's records back to that submission's result queue.
+    Each submission's groups are dispatched most expensive first (by the "cost" estimated
+    for each group), so the slowest groups do not start last and run alone.
+    Groups estimated to need more than a worker's share of CONFIG["EXTRACTOR_MEMORY_BUDGET"]
+    only start while all such groups running fit in the budget, and smaller groups
+    go ahead of them in the meantime.
+    Workers stuck on one extractor past its timeout, or over the memory limit, are stopped
+    and replaced, and their group is reported to the submission as skipped.
+    Workers only send a group's records once it is extracted, so skipped groups have none.
+    """
+    def __init__(self, num_workers=None):
+        """Create the pool. Call start() before use.
+
+        Arguments:
+        num_workers (int): The number of extractor workers.
+                           Default CONFIG["NUM_EXTRACTORS"].
+        """
+        self.__num_workers = num_workers or CONFIG["NUM_EXTRACTORS"]
+        # Messages from submission handles and workers, read by the scheduler
+        self.__inbound = MP_CONTEXT.Queue()
+        # Result queues for open submissions, keyed by token (see open())
+        # Written by open(), read by the scheduler thread
+        self.__result_queues = {}
+        self.__open_numbers = count()
+        # Scheduler state, only touched by the scheduler thread
+        self.__workers = {}
+        self.__next_worker_id = 0
+        self.__submissions = {}
+        self.__rotation = deque()
+        # Order of arrival, to dispatch groups of equal cost first come, first served
+        self.__group_numbers = count()
+        # When the scheduler thread last ran (time.time()), shared with submission handles
+        self.__heartbeat = MP_CONTEXT.Value("d", time.time(), lock=False)
+        self.__scheduler = None
+
+    def start(self):
+        """Start the workers and the scheduler thread."""
+        MP_CONTEXT.set_forkserver_preload(PRELOAD_MODULES)
+        for i in range(self.__num_workers):
+            self.__start_worker()
+        self.__scheduler = threading.Thread(target=self.__schedule, name="extractor-scheduler",
+                                            daemon=True)
+        self.__scheduler.start()
+        logger.info("Extractor pool started with {} workers".format(self.__num_workers))
+
+    def shutdown(self):
+        """Stop the scheduler thread and the workers.
+        Submissions still in progress are abandoned.
+        """
+        if self.__scheduler is not None:
+            self.__inbound.put(("shutdown", None, None))
+            self.__scheduler.join()
+            self.__scheduler = None
+        for worker in self.__workers.values():
+            worker["tasks"].put(None)
+        for worker in self.__workers.values():
+            worker["process"].join(timeout=5)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+                worker["process"].join()
+        self.__workers = {}
+        logger.info("Extractor pool shut down")
+
+    def open(self, source_id):
+        """Register a submission with the pool.
+        Must be called in the pool's process, before the submission starts extracting.
+        Each call gets a new token, so a resubmission with the same source_id
+        is never confused with an earlier one.
+
+        Arguments:
+        source_id (str): The source_id of the submission.
+
+        Returns:
+        ExtractorPoolHandle: The submission's connection to the pool.
+                             Can be passed to a child process.
+                             Its token identifies the submission to close().
+        """
+        token = "{}#{}".format(source_id, next(self.__open_numbers))
+        result_queue = MP_CONTEXT.Queue()
+        self.__result_queues[token] = result_queue
+        return ExtractorPoolHandle(source_id, token, self.__inbound, result_queue,
+                                   self.__heartbeat)
+
+    def close(self, token):
+        """Drop a submission from the pool (ex. when its driver died).
+        Its queued groups are discarded, and results from groups in progress are ignored.
+
+        Arguments:
+        token (str): The token of the submission's handle (from open()).
+        """
+        self.__result_queues.pop(token, None)
+        self.__inbound.put(("cancel", token, None))
+
+    def __start_worker(self):
+        # Worker IDs are never reused, so messages from a replaced worker can be ignored
+        worker_id = self.__next_worker_id
+        self.__next_worker_id += 1
+        tasks = MP_CONTEXT.Queue()
+        process = MP_CONTEXT.Process(target=run_extractors, args=(worker_id, tasks, self.__inbound),
+                                     name="extractor-{}".format(worker_id), daemon=True)
+        process.start()
+        self.__workers[worker_id] = {
+            "process": process,
+            "tasks": tasks,
+            # Token of the submission and group being extracted, or None when idle
+            "current": None,
+            "group": None,
+            # Extractor running on the group, and when it started
+            "extractor": None,
+            "extractor_start": None,
+            # Whether the group is extracted and its records are being sent
+            "sending": False,
+            # Estimated memory of the group, counted against the memory budget
+            # (0 for groups within a worker's share)
+            "memory": 0,
+            # Tokens of the submissions the worker has params for
+            "known": set()
+        }
+
+    def __replace_worker(self, worker_id, stop=False):
+        """Start a new worker in place of one that stopped, or that must be stopped."""
+        process = self.__workers.pop(worker_id)["process"]
+        if stop:
+            process.terminate()
+        process.join(timeout=5)
+        if process.is_alive():
+            # Process.kill() is Python 3.7+
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+        self.__start_worker()
+
+    def __schedule(self):
+        """Scheduler thread: track submissions, dispatch groups, and route results."""
+        last_check = time.monotonic()
+        while True:
+            self.__heartbeat.value = time.time()
+            try:
+                kind, token, payload = self.__inbound.get(timeout=POOL_POLL_TIME)
+            except Empty:
+                pass
+            else:
+                if kind == "shutdown":
+                    return
+                try:
+                    self.__handle(kind, token, payload)
+                except Exception as e:
+                    logger.error("{}: Extractor pool error handling '{}': {}"
+                                 .format(token, kind, repr(e)))
+            try:
+                if time.monotonic() - last_check >= POOL_POLL_TIME:
+                    self.__check_workers()
+                    last_check = time.monotonic()
+                self.__dispatch()
+            except Exception as e:
+                logger.error("Extractor pool scheduling error: {}".format(repr(e)))
+
+    def __handle(self, kind, token, payload):
+        if kind == "start":
+            self.__submissions[token] = {
+                "params": payload,
+                "results": self.__result_queues.get(token),
+                # Heaps of queued groups, most expensive first (see __queue_group())
+                "pending": [],
+                "large": [],
+                "outstanding": 0,
+                "input_done": False,
+                "cancelled": False,
+                # Extractor counters, summed over all groups
+                "stats": {}
+            }
+            if self.__submissions[token]["results"] is None:
+                logger.error("{}: Submission was not opened with the extractor pool"
+                             .format(token))
+                self.__submissions[token]["cancelled"] = True
+            return
+        elif kind == "extractor":
+            worker_id, extractor_name = payload
+            worker = self.__workers.get(worker_id)
+            if worker is not None and worker["current"] == token:
+                worker["extractor"] = extractor_name
+                worker["extractor_start"] = time.monotonic()
+            return
+        elif kind == "sending":
+            worker = self.__workers.get(payload)
+            if worker is not None and worker["current"] == token:
+                worker["sending"] = True
+            return
+        elif kind == "records":
+            worker_id, payload = payload
+            # Records from workers that were already replaced were written off with their group
+            if worker_id not in self.__workers:
+                return
+        elif kind in ("done", "retire"):
+            worker_id, stats = payload
+            # Groups from workers that were already replaced were written off
+            if worker_id not in self.__workers:
+                return
+            self.__finish_task(self.__workers[worker_id])
+            if kind == "retire":
+                logger.debug("Recycling extractor worker {}".format(worker_id))
+                self.__replace_worker(worker_id)
+
+        submission = self.__submissions.get(token)
+        if submission is None:
+            return
+
+        if kind in ("records", "invalid"):
+            if not submission["cancelled"]:
+                submission["results"].put((kind, payload))
+                # The submission stops reading at the first invalid record
+                if kind == "invalid":
+                    self.__cancel(token)
+        elif kind == "group":
+            if not submission["cancelled"]:
+                self.__queue_group(token, payload)
+        elif kind in ("done", "retire"):
+            merge_extractor_stats(submission["stats"], stats)
+            submission["outstanding"] -= 1
+            self.__check_finished(token)
+        elif kind == "input_done":
+            submission["input_done"] = True
+            self.__check_finished(token)
+        elif kind == "cancel":
+            self.__cancel(token)
+
+    def __cancel(self, token):
+        """Discard a submission's queued groups, and drop all further messages for it."""
+        submission = self.__submissions[token]
+        submission["cancelled"] = True
+        submission["outstanding"] -= len(submission["pending"]) + len(submission["large"])
+        submission["pending"].clear()
+        submission["large"].clear()
+        self.__check_finished(token)
+
+    def __queue_group(self, token, group_info):
+        """Queue a group by its estimated cost.
+        Groups needing more than a worker's share of the memory budget are queued separately,
+        as they can only start when they fit in the budget.
+        """
+        submission = self.__submissions[token]
+        cost = group_info.get("cost") or {}
+        # Workers over the memory limit are stopped, so no group uses more
+        memory = min(cost.get("memory", 0), CONFIG["EXTRACTOR_MAX_RSS"] * 2**20)
+        large = memory > CONFIG["EXTRACTOR_MEMORY_BUDGET"] * 2**20 / self.__num_workers
+        if not (submission["pending"] or submission["large"]):
+            self.__rotation.append(token)
+        heapq.heappush(submission["large"] if large else submission["pending"],
+                       (-cost.get("time", 0), next(self.__group_numbers),
+                        memory if large else 0, group_info))
+        submission["outstanding"] += 1
+
+    def __finish_task(self, worker):
+        """Mark a worker idle."""
+        worker["current"] = None
+        worker["group"] = None
+        worker["extractor"] = None
+        worker["extractor_start"] = None
+        worker["sending"] = False
+        worker["memory"] = 0
+
+    def __check_finished(self, token):
+        """Finish a submission once its input is done and no groups remain."""
+        submission = self.__submissions[token]
+        if submission["outstanding"] > 0 or not (submission["input_done"]
+                                                 or submission["cancelled"]):
+            return
+        if not submission["cancelled"]:
+            submission["results"].put(("finished", submission["stats"]))
+        elif submission["results"] is not None:
+            # Nothing may read the rest of the results, so do not wait to flush them on exit
+            submission["results"].cancel_join_thread()
+        del self.__submissions[token]
+        self.__result_queues.pop(token, None)
+        for worker in self.__workers.values():
+            if token in worker["known"]:
+                worker["tasks"].put(("forget", token, None))
+                worker["known"].discard(token)
+        logger.debug("{}: Extraction finished in pool".format(token))
+
+    def __next_group(self):
+        """Take the next group, round-robin across submissions with queued groups.
+        Each submission's most expensive group is taken, unless it needs more memory
+        than is left in the budget, in which case its most expensive smaller group is taken.
+
+        Returns:
+        tuple: (token, group_info, memory counted against the budget),
+                or None if no queued group can start.
+        """
+        budget = CONFIG["EXTRACTOR_MEMORY_BUDGET"] * 2**20
+        memory_used = sum(worker["memory"] for worker in self.__workers.values())
+        for i in range(len(self.__rotation)):
+            token = self.__rotation.popleft()
+            submission = self.__submissions.get(token)
+            if not submission or not (submission["pending"] or submission["large"]):
+                continue
+            queue = submission["pending"]
+            large = submission["large"]
+            # A large group runs alone if it is over the whole budget
+            if (large and (not memory_used or memory_used + large[0][2] <= budget)
+                    and (not queue or large[0] < queue[0])):
+                queue = large
+            if not queue:
+                # Only large groups are queued, waiting for memory
+                self.__rotation.append(token)
+                continue
+            cost, number, memory, group_info = heapq.heappop(queue)
+            if submission["pending"] or submission["large"]:
+                self.__rotation.append(token)
+            return token, group_info, memory
+        return None
+
+    def __dispatch(self):
+        """Hand queued groups to idle workers."""
+        for worker in self.__workers.values():
+            if worker["current"] is not None:
+                continue
+            task = self.__next_group()
+            if task is None:
+                return
+            token, group_info, memory = task
+            if token not in worker["known"]:
+                worker["tasks"].put(("params", token,
+                                     self.__submissions[token]["params"]))
+                worker["known"].add(token)
+            worker["tasks"].put(("group", token, group_info))
+            worker["current"] = token
+            worker["group"] = group_info
+            worker["memory"] = memory
+
+    def __check_workers(self):
+        """Stop workers stuck on an extractor or over the memory limit, and replace
+        workers that died. The groups they were extracting are skipped.
+        """
+        for worker_id, worker in list(self.__workers.items()):
+            process = worker["process"]
+            if not process.is_alive():
+                # Workers that stop themselves exit cleanly, and are replaced on "retire"
+                if process.exitcode == 0:
+                    continue
+                reason = "Extractor worker died (exit code {})".format(process.exitcode)
+            # Workers sending records have finished extracting the group
+            elif worker["current"] is None or worker["sending"]:
+                continue
+            elif (worker["extractor"] is not None
+                    and time.monotonic() - worker["extractor_start"]
+                    > CONFIG["EXTRACTOR_TIMEOUTS"].get(worker["extractor"],
+                                                       CONFIG["EXTRACTOR_TIMEOUT"])):
+                reason = "Extractor '{}' timed out after {} seconds".format(
+                            worker["extractor"],
+                            CONFIG["EXTRACTOR_TIMEOUTS"].get(worker["extractor"],
+                                                             CONFIG["EXTRACTOR_TIMEOUT"]))
+            elif get_rss(process.pid) > CONFIG["EXTRACTOR_MAX_RSS"] * 2**20:
+                reason = "Extractor '{}' exceeded the {} MiB memory limit".format(
+                            worker["extractor"], CONFIG["EXTRACTOR_MAX_RSS"])
+            else:
+                continue
+            self.__skip_group(worker, reason)
+            self.__replace_worker(worker_id, stop=True)
+
+    def __skip_group(self, worker, reason):
+        """Record the worker's group as skipped, and release the worker."""
+        token = worker["current"]
+        group_info = worker["group"]
+        extractor_name = worker["extractor"]
+        extractor_start = worker["extractor_start"]
+        sending = worker["sending"]
+        self.__finish_task(worker)
+        submission = self.__submissions.get(token)
+        if submission is None:
+            return
+        # Some of the group's records were already sent, so it cannot be skipped
+        if sending:
+            logger.error("{}: Lost records of group {}: {}"
+                         .format(token, group_info["files"], reason))
+            if not submission["cancelled"]:
+                submission["results"].put(("invalid", {
+                    "success": False,
+                    "error": "Unable to extract records",
+                    "details": "{} while sending the records of {}".format(
+                                    reason, group_info["files"])
+                }))
+                self.__cancel(token)
+            submission["outstanding"] -= 1
+            self.__check_finished(token)
+            return
+        logger.error("{}: Skipped group {}: {}".format(token, group_info["files"], reason))
+        # The worker's counters for the group are lost, so count the stopped call here
+        if extractor_name is not None:
+            stats = dict.fromkeys(EXTRACTOR_COUNTERS, 0)
+            stats["calls"] = stats["exceptions"] = 1
+            stats["time_ms"] = int((time.monotonic() - extractor_start) * 1000)
+            merge_extractor_stats(submission["stats"], {"extractors": {extractor_name: stats}})
+        if not submission["cancelled"]:
+            submission["results"].put(("skipped", {
+                "files": group_info["files"],
+                "reason": reason
+            }))
+        submission["outstanding"] -= 1
+        self.__check_finished(token)
+
+
+class ExtractorPoolHandle:
+    """One submission's connection to an ExtractorPool."""
+    def __init__(self, source_id, token, inbound_queue, result_queue, heartbeat):
+        self.source_id = source_id
+        # Identifies this submission to the pool (see ExtractorPool.open())
+        self.token = token
+        # Groups the pool could not extract, as {"files": [...], "reason": str}
+        self.skipped = []
+        # Extractor counters for the submission (see extract_group()), set when finished
+        self.stats = {}
+        # The validation error for the first invalid record, or the pool error, if any
+        self.error = None
+        self.__inbound = inbound_queue
+        self.__results = result_queue
+        self.__heartbeat = heartbeat
+
+    def begin(self, extract_params):
+        """Start extraction for the submission.
+
+        Arguments:
+        extract_params (dict): Parameters for extraction, sent once to each worker.
+        """
+        self.__inbound.put(("start", self.token, extract_params))
+
+    def add_group(self, group_info):
+        """Queue a group for extraction."""
+        self.__inbound.put(("group", self.token, group_info))
+
+    def end_input(self):
+        """Mark that all groups have been queued."""
+        self.__inbound.put(("input_done", self.token, None))
+
+    def cancel(self):
+        """Stop extraction. Queued groups are discarded."""
+        self.__inbound.put(("cancel", self.token, None))
+
+    def results(self):
+        """Yield the extracted and validated records until all groups are finished,
+        a record is invalid, or the pool stops responding.
+        Groups that were skipped are collected in self.skipped,
+        the extractor counters are stored in self.stats,
+        and the validation error for an invalid record (or an error if the pool stopped
+        responding) is stored in self.error.
+
+        Yields:
+        dict: A normalized record, for Validator.add_validated_record().
+        """
+        while True:
+            try:
+                kind, payload = self.__results.get(timeout=POOL_POLL_TIME)
+            except Empty:
+                if time.time() - self.__heartbeat.value <= POOL_TIMEOUT:
+                    continue
+                self.error = {
+                    "success": False,
+                    "error": "The extractor pool stopped responding",
+                    "details": "No sign of life from the pool for over {} seconds"
+                               .format(POOL_TIMEOUT)
+                }
+                # Nothing will read further messages to the pool
+                self.__inbound.cancel_join_thread()
+                return
+            if kind == "records":
+                yield from json.loads(payload)
+            elif kind == "invalid":
+                self.error = payload
+                return
+            elif kind == "skipped":
+                self.skipped.append(payload)
+            elif kind == "finished":
+                self.stats = payload
+                return
@@ -1,46 +1,80 @@
+from collections import OrderedDict
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from functools import lru_cache
+from hashlib import sha512
+import importlib
+from itertools import chain, islice
+import json
+import logging
+from operator import itemgetter
 import os
+import re
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+import time
+import urllib
+from uuid import uuid4
+from xml.etree import ElementTree
+
+import magic
+import mdf_toolbox
+import xmltodict
+import yaml
+
+from mdf_connect_server import CONFIG
+from mdf_connect_server.processor.extraction_cache import ExtractionCache
+from mdf_connect_server.processor.validator import Validator
+
 # pycalphad and hyperspy imports require this env var set
+# Heavy extractor libraries are only imported on first use, after this is set
+# (see _import_backend())
 os.environ["MPLBACKEND"] = "agg"
-# pycalphad and hyperspy run into dlopen static TLS errors, so retry imports when failing
-try:
-    import pycalphad  # noqa: E402
-except ImportError:
-    import pycalphad
-try:
-    import hyperspy.api as hs  # noqa: E402
-except ImportError:
-    import hyperspy.api as hs  # noqa: E402
-
-from hashlib import sha512  # noqa: E402
-import json  # noqa: E402
-import logging  # noqa: E402
-# import os  # noqa: E402
-from queue import Empty  # noqa: E402
-import re  # noqa: E402
-import urllib  # noqa: E402
-
-# E402: module level import not at top of file
-import ase.io  # noqa: E402
-from bson import ObjectId  # noqa: E402
-import magic  # noqa: E402
-import mdf_toolbox  # noqa: E402
-import pandas as pd  # noqa: E402
-from PIL import Image  # noqa: E402
-import pymatgen  # noqa: E402
-from pymatgen.io.ase import AseAtomsAdaptor as ase_to_pmg  # noqa: E402
-from pif_ingestor.manager import IngesterManager  # noqa: E402
-from pypif.obj import System  # noqa: E402
-from pypif.pif import dump as pif_dump  # noqa: E402
-from pypif_sdk.util import citrination as cit_utils  # noqa: E402
-from pypif_sdk.interop.mdf import _to_user_defined as pif_to_feedstock  # noqa: E402
-from pypif_sdk.interop.datacite import add_datacite as add_dc  # noqa: E402
-import xmltodict  # noqa: E402
-import yaml  # noqa: E402
-
-from mdf_connect_server import CONFIG  # noqa: E402
 
 # Additional NaN values for Pandas
 NA_VALUES = ["", " "]
+# Rows of an Excel sheet converted to records at a time
+EXCEL_BATCH_SIZE = 10000
+# Characters of a JSON file read at a time when streaming top-level arrays
+JSON_READ_SIZE = 1024 * 1024
+JSON_WHITESPACE = " \t\n\r"
+# Extensions of JSON Lines files, read one document per line
+JSON_LINES_EXTENSIONS = [".jsonl", ".ndjson"]
+# The libyaml-based safe loader if PyYAML was built with it, otherwise the Python one
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+# Compiled mappings kept by each worker, which are reused by every group of a submission
+# (see _compile_mapping())
+MAPPING_CACHE_SIZE = 256
+
+# Bytes read at a time when fingerprinting files (the first block is also used by libmagic)
+FILE_BLOCK_SIZE = 1024 * 1024
+# Groups with more than one file of at least this size are hashed on a thread pool
+LARGE_FILE_SIZE = 64 * 1024 * 1024
+# Leading bytes of each file kept for the extractor dispatch plan
+FILE_HEADER_SIZE = 16
+
+# Filename patterns pymatgen reads structures from (see pymatgen Structure.from_file())
+PYMATGEN_STRUCTURE_FILES = ["*.cif*", "*.mcif*", "*poscar*", "*contcar*", "*.vasp", "*chgcar*",
+                            "*locpot*", "vasprun*.xml*", "*.cssr*", "*.json*", "*.mson*",
+                            "*.yaml*", "*.xsf"]
+# Default symmetry tolerances for space groups (same as pymatgen's)
+SYMPREC = 0.01  # Angstroms
+ANGLE_TOLERANCE = 5  # Degrees
+# Space groups of recently analyzed structures, keyed by _structure_key()
+SPACE_GROUP_CACHE_SIZE = 1024
+_space_group_cache = OrderedDict()
+
+# Most PIFs in each PIF archive file (see _archive_pifs())
+PIF_ARCHIVE_SIZE = 1000
+# PIF archive filenames, with the number of PIFs for utils.citrine_upload()
+PIF_ARCHIVE_NAME = "pifs_{count}_{uid}.json"
+
+# Characters of a group's record batches held in memory by a worker until the group
+# is extracted, before they spill to a temporary file (see run_extractors())
+GROUP_SPOOL_SIZE = 64 * 2**20
+# Records of a streamed extractor result kept to cache it once read;
+# longer streams are not cached (see _stream_records())
+CACHE_STREAM_RECORDS = 10000
 
 # Create new logger (extractors are multi-process)
 logger = logging.getLogger(__name__)
@@ -52,156 +86,430 @@ logfile_handler = logging.FileHandler(CONFIG["EXTRACTOR_ERROR_FILE"], mode='a')
 logfile_handler.setFormatter(logfile_formatter)
 logger.addHandler(logfile_handler)
 
+# Counters kept for each extractor (see extract_group())
+EXTRACTOR_COUNTERS = ["calls", "successes", "exceptions", "time_ms", "bytes_read", "records",
+                      "cache_hits", "cache_misses"]
+
 # Log debug messages for all extractor events. Extremely spammy.
 SUPER_DEBUG = False
 
 # List of extractors at bottom
 
 
-def run_extractors(input_queue, output_queue, queue_done, extract_params):
-    """Extract data files.
+def run_extractors(worker_id, task_queue, result_queue):
+    """Extractor pool worker. Extracts groups of files, and normalizes and validates
+    the records, until told to stop.
+    Tasks are tuples of (kind, token, payload), where token is the submission's token
+    (see ExtractorPool.open()) and kind is one of:
+        "params": payload is the extract_params for the submission.
+        "group": payload is a group_info to extract.
+        "forget": the submission is finished, and its params can be dropped.
+    None stops the worker.
+    The worker also stops itself after CONFIG["EXTRACTOR_MAX_TASKS"] groups, or once its memory
+    use passes CONFIG["EXTRACTOR_MAX_RSS"], to contain leaks in the extractor libraries.
 
-    Returns:
-    list of dict: The metadata extractd from the file.
-                  Will be empty if no selected extractor can extract data.
+    Arguments:
+    worker_id (int): The ID of this worker in the pool.
+    task_queue (multiprocessing.Queue): The queue to read tasks from.
+    result_queue (multiprocessing.Queue): The queue to send results to.
+        Each extractor run is announced as ("extractor", token, (worker_id, name)),
+        validated records are sent in batches as ("records", token, (worker_id, batch))
+        (see batch_records()) once the whole group is extracted,
+        after ("sending", token, worker_id), or the first invalid record's error (or an error
+        raised while extracting the group) as ("invalid", token, validation_result),
+        and each finished group as ("done", token, (worker_id, stats)),
+        or ("retire", token, (worker_id, stats)) if the worker is stopping itself,
+        where stats are the group's counters from extract_group().
     """
-    source_id = extract_params.get("dataset", {}).get("mdf", {}).get("source_id", "unknown")
+    # extract_params and record Validators, keyed by token
+    all_params = {}
+    validators = {}
+    num_groups = 0
+    if CONFIG["EXTRACTION_CACHE_PATH"] and CONFIG["EXTRACTION_CACHE_SIZE"]:
+        cache = ExtractionCache(CONFIG["EXTRACTION_CACHE_PATH"],
+                                CONFIG["EXTRACTION_CACHE_SIZE"] * 2**20)
+    else:
+        cache = None
     try:
-        # Extract each group from the queue
-        # Exit loop when queue_done is True and no groups remain
         while True:
-            # Fetch group from queue
-            try:
-                group_info = input_queue.get(timeout=5)
-            # No group fetched
-            except Empty:
-                # Queue is permanently depleted, stop processing
-                if queue_done.value:
-                    break
-                # Queue is still active, try again
-                else:
-                    continue
-
-            # Process fetched group
-            single_record = {}
-            multi_records = []
-            for extractor_name in (group_info["extractors"] or ALL_EXTRACTORS.keys()):
-                try:
-                    specific_params = mdf_toolbox.dict_merge(extract_params or {},
-                                                             group_info["params"])
-                    extractor_res = ALL_EXTRACTORS[extractor_name](group=group_info["files"],
-                                                                   params=specific_params)
-                except Exception as e:
-                    logger.warn(("{} Extractor {} failed with "
-                                 "exception {}").format(source_id, extractor_name, repr(e)))
-                else:
-                    # If a list of one record was returned, treat as single record
-                    # Eliminates [{}] from cluttering feedstock
-                    # Filters one-record results from extractors that always return lists
-                    if isinstance(extractor_res, list) and len(extractor_res) == 1:
-                        extractor_res = extractor_res[0]
-                    # Only process actual results
-                    if extractor_res:
-                        # If a single record was returned, merge with others
-                        if isinstance(extractor_res, dict):
-                            single_record = mdf_toolbox.dict_merge(single_record, extractor_res)
-                        # If multiple records were returned, add to list
-                        elif isinstance(extractor_res, list):
-                            # Only add records with data
-                            [multi_records.append(rec) for rec in extractor_res if rec]
-                        # Else, panic
+            task = task_queue.get()
+            if task is None:
+                break
+            kind, token, payload = task
+            if kind == "params":
+                all_params[token] = payload
+                validators[token] = Validator(schema_path=CONFIG["SCHEMA_PATH"])
+                validators[token].start_records(payload["dataset"],
+                                                payload.get("validation_info"))
+            elif kind == "forget":
+                all_params.pop(token, None)
+                validators.pop(token, None)
+            elif kind == "group":
+                def announce(extractor_name):
+                    result_queue.put(("extractor", token, (worker_id, extractor_name)))
+                stats = {}
+                # Batches are held until the group is extracted, so a group the pool stops
+                # sends no records; they spill to disk past GROUP_SPOOL_SIZE
+                with SpooledTemporaryFile(max_size=GROUP_SPOOL_SIZE, mode="w+") as spool:
+                    try:
+                        records = []
+                        for record in extract_group(payload, all_params[token], stats,
+                                                    announce, cache):
+                            rc_res = validators[token].validate_record(record)
+                            # One invalid record fails the whole submission
+                            if not rc_res["success"]:
+                                result_queue.put(("invalid", token, rc_res))
+                                break
+                            records.append(rc_res["record"])
+                            if len(records) >= CONFIG["EXTRACTOR_BATCH_SIZE"]:
+                                _spool_batches(spool, records)
+                                records = []
                         else:
-                            raise TypeError(("Extractor '{p}' returned "
-                                             "type '{t}'!").format(p=extractor_name,
-                                                                   t=type(extractor_res)))
-                        logger.debug("{}: {} extractd {}".format(source_id, extractor_name,
-                                                                 group_info["files"]))
-                    elif SUPER_DEBUG:
-                        logger.debug("{}: {} could not extract {}".format(source_id, extractor_name,
-                                                                          group_info))
-            # Merge the single_record into all multi_records if both exist
-            if single_record and multi_records:
-                records = [mdf_toolbox.dict_merge(r, single_record) for r in multi_records if r]
-            # Else, if single_record exists, make it a list
-            elif single_record:
-                records = [single_record]
-            # Otherwise, use the list of records if it exists
-            elif multi_records:
-                records = multi_records
-            # If nothing exists, make a blank list
-            else:
-                records = []
-
-            # Push records to output queue
-            # Get the file info
-            try:
-                file_info = _extract_file_info(group=group_info["files"], params=extract_params)
-            except Exception as e:
-                logger.warning("{}: File info extractor failed: {}".format(source_id, repr(e)))
-            for record in records:
-                # TODO: Should files be handled differently?
-                record = mdf_toolbox.dict_merge(record, file_info)
-                output_queue.put(json.dumps(record))
-    except Exception as e:
-        logger.error("{}: Extractor error: {}".format(source_id, str(e)))
+                            _spool_batches(spool, records)
+                            result_queue.put(("sending", token, worker_id))
+                            spool.seek(0)
+                            for batch in spool:
+                                result_queue.put(("records", token, (worker_id, batch[:-1])))
+                    except Exception as e:
+                        logger.error("{}: Extractor error: {}".format(token, repr(e)))
+                        # The group's records would be lost, so the submission fails
+                        result_queue.put(("invalid", token, {
+                            "success": False,
+                            "error": "Unable to extract records",
+                            "details": repr(e)
+                        }))
+                num_groups += 1
+                if (num_groups >= CONFIG["EXTRACTOR_MAX_TASKS"]
+                        or get_rss() > CONFIG["EXTRACTOR_MAX_RSS"] * 2**20):
+                    result_queue.put(("retire", token, (worker_id, stats)))
+                    break
+                result_queue.put(("done", token, (worker_id, stats)))
     # Log all exceptions!
     except BaseException as e:
-        logger.error("{}: Extractor BaseException: {}".format(source_id, str(e)))
+        logger.error("Extractor worker {} BaseException: {}".format(worker_id, repr(e)))
+        # A non-zero exit code tells the pool the group was lost
+        raise
     return
 
 
+def _spool_batches(spool, records):
+    """Write records to a group's spool file, one batch (see batch_records()) per line."""
+    for batch in batch_records(records):
+        spool.write(batch)
+        spool.write("\n")
+
+
+def batch_records(records, batch_size=None):
+    """Serialize records for transport, many records to a message.
+
+    Arguments:
+    records (list of dict): The records to send.
+    batch_size (int): The maximum number of records in a batch.
+                      Default CONFIG["EXTRACTOR_BATCH_SIZE"].
+
+    Yields:
+    str: A batch of records, as a compact JSON array.
+    """
+    batch_size = batch_size or CONFIG["EXTRACTOR_BATCH_SIZE"]
+    for i in range(0, len(records), batch_size):
+        yield json.dumps(records[i:i+batch_size], separators=(",", ":"))
+
+
+def merge_extractor_stats(total, stats):
+    """Add counters from extract_group() into a running total.
+
+    Arguments:
+    total (dict): The running total. Modified in place.
+    stats (dict): The counters to add.
+
+    Returns:
+    dict: The total.
+    """
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            merge_extractor_stats(total.setdefault(key, {}), value)
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def get_rss(pid="self"):
+    """Get the resident set size of a process. Linux only.
+
+    Arguments:
+    pid (int or str): The process ID. Default "self", for the current process.
+
+    Returns:
+    int: The RSS, in bytes. Zero if it cannot be read.
+    """
+    try:
+        with open("/proc/{}/statm".format(pid)) as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def extract_group(group_info, extract_params, stats=None, announce=None, cache=None):
+    """Extract one group of files.
+
+    Arguments:
+    group_info (dict): The group, as produced by group_tree().
+    extract_params (dict): Parameters for extraction.
+    stats (dict): Counters to add to, as produced by this function. Default None.
+        invocations (int): Extractor invocations possible.
+        skipped (int): Invocations skipped by the dispatch plan.
+        extractors (dict): For each extractor run, the EXTRACTOR_COUNTERS:
+            calls, successes (calls returning data), exceptions, time_ms (wall time),
+            bytes_read (size of the files given to the extractor), records (emitted),
+            and cache_hits and cache_misses (results found and not found in the cache,
+            where hits are not calls).
+    announce (function): Called with each extractor name before the extractor runs.
+                         Default None.
+    cache (ExtractionCache): The cache of extractor results to use. Default None, for none.
+
+    Yields:
+    dict: The records extracted from the group, as they are read.
+          There are none if no selected extractor can extract data.
+    """
+    source_id = extract_params.get("dataset", {}).get("mdf", {}).get("source_id", "unknown")
+    if stats is None:
+        stats = {}
+
+    # Fingerprint the files once, for the files block and the dispatch plan
+    try:
+        fingerprints = _fingerprint_group(group_info["files"], group_info.get("sizes"))
+        file_info = _extract_file_info(group=group_info["files"], params=extract_params,
+                                       fingerprints=fingerprints)
+        group_size = sum(fingerprint["length"] for fingerprint, header in fingerprints)
+    except Exception as e:
+        logger.warning("{}: File info extractor failed: {}".format(source_id, repr(e)))
+        fingerprints = None
+        file_info = {}
+        group_size = 0
+
+    # The content addresses of the files, for the extraction cache
+    if cache is not None and fingerprints is not None:
+        cache_files = [(os.path.basename(file_path), fingerprint["sha512"])
+                       for file_path, (fingerprint, header) in zip(group_info["files"],
+                                                                   fingerprints)]
+    else:
+        cache_files = None
+
+    specific_params = mdf_toolbox.dict_merge(extract_params or {}, group_info["params"])
+    extractor_names = _plan_extractors(group_info["extractors"], group_info["files"],
+                                       fingerprints, specific_params)
+    num_planned = len(group_info["extractors"] or ALL_EXTRACTORS)
+    stats["invocations"] = stats.get("invocations", 0) + num_planned
+    stats["skipped"] = stats.get("skipped", 0) + num_planned - len(extractor_names)
+    # Only extractors' own parameters affect cached results
+    extractor_params = specific_params.get("extractors") or {}
+    single_record = {}
+    # The (extractor name, records) of extractors with many records, as lists or streams
+    # of records, which are read once every extractor has run (see _stream_records())
+    multi_results = []
+    for extractor_name in extractor_names:
+        extractor_stats = stats.setdefault("extractors", {}).setdefault(
+                                extractor_name, dict.fromkeys(EXTRACTOR_COUNTERS, 0))
+        start_time = time.perf_counter()
+        cache_key = None
+        cached = False
+        try:
+            if cache_files is not None and EXTRACTOR_VERSIONS.get(extractor_name) is not None:
+                cache_key = cache.make_key(extractor_name, EXTRACTOR_VERSIONS[extractor_name],
+                                           cache_files, extractor_params.get(extractor_name))
+                cached, extractor_res = cache.get(cache_key)
+            if cached:
+                extractor_stats["cache_hits"] += 1
+            else:
+                if announce is not None:
+                    announce(extractor_name)
+                extractor_stats["calls"] += 1
+                extractor_stats["bytes_read"] += group_size
+                extractor_res = ALL_EXTRACTORS[extractor_name](group=group_info["files"],
+                                                               params=specific_params)
+                if isinstance(extractor_res, Iterator):
+                    # Read ahead only far enough to tell one record from many
+                    peeked = list(islice(extractor_res, 2))
+                    if len(peeked) < 2:
+                        extractor_res = peeked
+                    else:
+                        extractor_res = _stream_records(chain(peeked, extractor_res),
+                                                        source_id, extractor_name,
+                                                        extractor_stats, cache, cache_key)
+                if cache_key is not None:
+                    extractor_stats["cache_misses"] += 1
+                    # Streams are cached once read
+                    if not isinstance(extractor_res, Iterator):
+                        cache.put(cache_key, extractor_res)
+        except Exception as e:
+            extractor_stats["exceptions"] += 1
+            logger.warning(("{} Extractor {} failed with "
+                            "exception {}").format(source_id, extractor_name, repr(e)))
+        else:
+            # If a list of one record was returned, treat as single record
+            # Eliminates [{}] from cluttering feedstock
+            # Filters one-record results from extractors that always return lists
+            if isinstance(extractor_res, list) and len(extractor_res) == 1:
+                extractor_res = extractor_res[0]
+            # Only process actual results
+            if extractor_res:
+                # If a single record was returned, merge with others
+                if isinstance(extractor_res, dict):
+                    single_record = mdf_toolbox.dict_merge(single_record, extractor_res)
+                    extractor_stats["records"] += 1
+                # If multiple records were returned, add to list
+                elif isinstance(extractor_res, list):
+                    # Only add records with data
+                    new_records = [rec for rec in extractor_res if rec]
+                    multi_results.append((extractor_name, new_records))
+                    extractor_stats["records"] += len(new_records)
+                # Streamed records are counted as they are read
+                elif isinstance(extractor_res, Iterator):
+                    multi_results.append((extractor_name, extractor_res))
+                # Else, panic
+                else:
+                    raise TypeError(("Extractor '{p}' returned "
+                                     "type '{t}'!").format(p=extractor_name,
+                                                           t=type(extractor_res)))
+                if not cached:
+                    extractor_stats["successes"] += 1
+                logger.debug("{}: {} extractd {}".format(source_id, extractor_name,
+                                                         group_info["files"]))
+            elif SUPER_DEBUG:
+                logger.debug("{}: {} could not extract {}".format(source_id, extractor_name,
+                                                                  group_info))
+        finally:
+            extractor_stats["time_ms"] += int((time.perf_counter() - start_time) * 1000)
+    # Merge the single_record into all multi_records if both exist
+    # TODO: Should files be handled differently?
+    num_records = 0
+    for extractor_name, records in multi_results:
+        # Streams are read from here, so the pool times the extractor being read
+        if announce is not None and isinstance(records, Iterator):
+            announce(extractor_name)
+        for record in records:
+            num_records += 1
+            if single_record:
+                record = mdf_toolbox.dict_merge(record, single_record)
+            yield mdf_toolbox.dict_merge(record, file_info)
+    # Else, if single_record exists, it is the only record
+    if not num_records and single_record:
+        yield mdf_toolbox.dict_merge(single_record, file_info)
+
+
+def _stream_records(records, source_id, extractor_name, extractor_stats, cache=None,
+                    cache_key=None):
+    """Read the records of an extractor that streams them, keeping its counters.
+    An exception ends the stream, and is counted like one from calling the extractor,
+    but the records already read are kept.
+    Streams of no more than CACHE_STREAM_RECORDS records are cached once read.
+
+    Arguments:
+    records (iterator of dict): The extractor's records.
+    source_id (str): The source_id, for logging.
+    extractor_name (str): The name of the extractor.
+    extractor_stats (dict): The extractor's counters (see extract_group()).
+    cache (ExtractionCache): The cache to put the records in. Default None, for none.
+    cache_key (str): The cache key of the extractor's result. Default None, for none.
+
+    Yields:
+    dict: The records with data.
+    """
+    to_cache = [] if cache_key is not None else None
+    while True:
+        start_time = time.perf_counter()
+        try:
+            record = next(records)
+        except StopIteration:
+            break
+        except Exception as e:
+            extractor_stats["exceptions"] += 1
+            logger.warning(("{} Extractor {} failed with "
+                            "exception {}").format(source_id, extractor_name, repr(e)))
+            to_cache = None
+            break
+        finally:
+            extractor_stats["time_ms"] += int((time.perf_counter() - start_time) * 1000)
+        if to_cache is not None:
+            to_cache.append(record)
+            if len(to_cache) > CACHE_STREAM_RECORDS:
+                to_cache = None
+        if record:
+            extractor_stats["records"] += 1
+            yield record
+    if to_cache is not None:
+        cache.put(cache_key, to_cache)
+
+
 def extract_crystal_structure(group, params=None):
     """Extractor for the crystal_structure block.
     Will also populate material block.
+    The record comes from the first file in the group with a valid crystal structure.
 
     Arguments:
     group (list of str): The paths to grouped files.
-    params (dict): N/A
+    params (dict):
+        extractors (dict):
+            crystal_structure (dict):
+                symprec (float): The distance tolerance for the space group, in Angstroms.
+                        Default SYMPREC.
+                angle_tolerance (float): The angle tolerance for the space group, in degrees.
+                        Default ANGLE_TOLERANCE.
 
     Returns:
     dict: The record extractd.
     """
-    record = {}
+    ase_formats = _import_backend("ase.io.formats")
+    pymatgen = _import_backend("pymatgen")
+    ase_to_pmg = _import_backend("pymatgen.io.ase").AseAtomsAdaptor
+    try:
+        cs_params = params["extractors"]["crystal_structure"] or {}
+    except (KeyError, TypeError):
+        cs_params = {}
+    symprec = cs_params.get("symprec", SYMPREC)
+    angle_tolerance = cs_params.get("angle_tolerance", ANGLE_TOLERANCE)
 
     for data_file in group:
-        material = {}
-        crystal_structure = {}
-        # Attempt to read the file
-        try:
-            # Read with ASE
-            ase_res = ase.io.read(data_file)
-            # Check data read, validate crystal structure
-            if not ase_res or not all(ase_res.get_pbc()):
-                raise ValueError("No valid data")
-            else:
-                # Convert ASE Atoms to Pymatgen Structure
-                pmg_s = ase_to_pmg.get_structure(ase_res)
-        # ASE failed to read file
-        except Exception:
+        # Only try the readers for the file's format
+        pmg_s = None
+        for reader, file_format in _choose_structure_readers(data_file, ase_formats):
             try:
-                # Read with Pymatgen
-                pmg_s = pymatgen.Structure.from_file(data_file)
+                if reader == "ase":
+                    ase_res = ase_formats.read(data_file, format=file_format)
+                    # Check data read, validate crystal structure
+                    if not ase_res or not all(ase_res.get_pbc()):
+                        continue
+                    # Convert ASE Atoms to Pymatgen Structure
+                    pmg_s = ase_to_pmg.get_structure(ase_res)
+                else:
+                    pmg_s = pymatgen.Structure.from_file(data_file)
+                break
+            # Reader failed to read file
             except Exception:
-                # Can't read file
                 continue
-
-        # Extract material block
-        material["composition"] = pmg_s.formula.replace(" ", "")
-        # Extract crystal_structure block
-        crystal_structure["space_group_number"] = pmg_s.get_space_group_info()[1]
-        crystal_structure["number_of_atoms"] = float(pmg_s.composition.num_atoms)
-        crystal_structure["volume"] = float(pmg_s.volume)
-        crystal_structure["stoichiometry"] = pmg_s.composition.anonymized_formula
-
-        # Add to record
-        record = mdf_toolbox.dict_merge(record, {
-                                                "material": material,
-                                                "crystal_structure": crystal_structure
-                                            })
-    return record
+        if pmg_s is None:
+            # Can't read file
+            continue
+
+        # Later files could not add to the record, so are not read
+        return {
+            # Extract material block
+            "material": {
+                "composition": pmg_s.formula.replace(" ", "")
+            },
+            # Extract crystal_structure block
+            "crystal_structure": {
+                "space_group_number": _get_space_group_number(pmg_s, symprec, angle_tolerance),
+                "number_of_atoms": float(pmg_s.composition.num_atoms),
+                "volume": float(pmg_s.volume),
+                "stoichiometry": pmg_s.composition.anonymized_formula
+            }
+        }
+    return {}
 
 
 def extract_tdb(group, params=None):
+    pycalphad = _import_backend("pycalphad")
     record = {}
 
     for data_file in group:
@@ -241,12 +549,20 @@ def extract_pif(group, params=None):
     if not params:
         return {}
 
+    System = _import_backend("pypif.obj").System
+    pif_dumps = _import_backend("pypif.pif").dumps
+    cit_utils = _import_backend("pypif_sdk.util.citrination")
+    pif_to_feedstock = _import_backend("pypif_sdk.interop.mdf")._to_user_defined
+    # Same as pypif_sdk.interop.datacite.add_datacite(), with the DataCite PIF translated once
+    pif_merge = _import_backend("pypif_sdk.func.update_funcs").merge
+
     # Setup
-    dc_md = params["dataset"]["dc"]
+    dc_pif = _get_datacite_pif(json.dumps(params["dataset"]["dc"], sort_keys=True))
     cit_path = os.path.join(params["service_data"], "citrine")
     os.makedirs(cit_path, exist_ok=True)
-    cit_manager = IngesterManager()
+    cit_manager = _get_ingester_manager()
     mdf_records = []
+    cit_pifs = []
 
     try:
         raw_pifs = cit_manager.run_extensions(group, include=params.get("include", None),
@@ -276,24 +592,70 @@ def extract_pif(group, params=None):
         if mdf_pif:
             mdf_records.append(mdf_pif)
 
-        pif_name = (pif.uid or str(ObjectId())) + ".pif"
-        pif_path = os.path.join(cit_path, pif_name)
         try:
-            with open(pif_path, 'w') as pif_file:
-                pif_dump(add_dc(pif, dc_md), pif_file)
+            cit_pifs.append(pif_dumps(pif_merge(pif, dc_pif)))
         except Exception as e:
-            logger.warn("Could not save PIF: {}".format(repr(e)))
-            try:
-                os.remove(pif_path)
-            except FileNotFoundError:
-                pass
+            logger.warning("Could not save PIF: {}".format(repr(e)))
+    try:
+        _archive_pifs(cit_path, cit_pifs)
+    except Exception as e:
+        logger.warning("Could not save PIFs: {}".format(repr(e)))
 
     return mdf_records
 
 
+@lru_cache(maxsize=1)
+def _get_ingester_manager():
+    """Get this worker's pif-ingestor IngesterManager.
+    Creating a manager discovers all the ingester plugins, so only one is made.
+
+    Returns:
+    IngesterManager: The manager.
+    """
+    return _import_backend("pif_ingestor.manager").IngesterManager()
+
+
+@lru_cache(maxsize=16)
+def _get_datacite_pif(dc_json):
+    """Translate a dataset's DataCite block into a PIF, once per submission.
+
+    Arguments:
+    dc_json (str): The DataCite block, as JSON with sorted keys.
+
+    Returns:
+    System: The PIF, to merge into each extracted PIF.
+    """
+    datacite_to_pif = _import_backend("pypif_sdk.interop.datacite").datacite_to_pif
+    return datacite_to_pif(json.loads(dc_json))
+
+
+def _archive_pifs(cit_path, pifs):
+    """Write PIFs to archives in a Citrine data directory, instead of writing a file for every PIF.
+    Archives are JSON lists of at most PIF_ARCHIVE_SIZE PIFs, named with their count
+    (PIF_ARCHIVE_NAME), which utils.citrine_upload() uploads as one file each.
+    Each archive is written to a temporary file and moved into place,
+    so the directory only ever holds complete archives.
+
+    Arguments:
+    cit_path (str): The Citrine data directory.
+    pifs (list of str): The serialized PIFs.
+    """
+    for i in range(0, len(pifs), PIF_ARCHIVE_SIZE):
+        archive_pifs = pifs[i:i+PIF_ARCHIVE_SIZE]
+        # Unique across workers, including replaced workers
+        archive_name = PIF_ARCHIVE_NAME.format(count=len(archive_pifs), uid=uuid4().hex)
+        with NamedTemporaryFile("w", dir=cit_path, prefix=".", suffix=".tmp",
+                                delete=False) as archive_file:
+            archive_file.write("[" + ",".join(archive_pifs) + "]")
+        os.replace(archive_file.name, os.path.join(cit_path, archive_name))
+
+
 def extract_json(group, params=None):
     """Extractor for JSON.
     Will populate blocks according to mapping.
+    Top-level arrays are read one element at a time, and JSON Lines files
+    (JSON_LINES_EXTENSIONS) one line at a time, so files are never loaded whole,
+    and records are streamed as they are read.
 
     Arguments:
     group (list of str): The paths to grouped files.
@@ -304,24 +666,40 @@ def extract_json(group, params=None):
                 na_values (list of str): Values to treat as N/A. Default None.
 
     Returns:
-    dict: The record(s) extractd.
+    iterator of dict: The record(s) extractd, or an empty dict without a mapping.
     """
     try:
         mapping = params["extractors"]["json"]["mapping"]
         na_values = params["extractors"]["json"].get("na_values", None)
     except (KeyError, AttributeError):
         return {}
+    return _stream_json(group, mapping, na_values)
 
-    records = []
+
+def _stream_json(group, mapping, na_values=None):
+    """Read and map the documents of JSON files, one at a time.
+    Unreadable or invalid files are skipped, after any records read before the error.
+
+    Arguments:
+    group (list of str): The paths to the files.
+    mapping (dict): The mapping of mdf_fields: json_fields
+    na_values (list of str): Values to treat as N/A. Default None.
+
+    Yields:
+    dict: The records.
+    """
     for file_path in group:
+        if os.path.splitext(file_path)[1].lower() in JSON_LINES_EXTENSIONS:
+            read_documents = _iter_json_lines
+        else:
+            read_documents = _iter_json_documents
         try:
             with open(file_path) as f:
-                file_json = json.load(f)
-        except Exception:
+                yield from _map_json_documents(read_documents(f), mapping,
+                                               na_values=na_values)
+        # Unreadable or invalid files
+        except (OSError, ValueError):
             pass
-        else:
-            records.extend(_extract_json(file_json, mapping, na_values=na_values))
-    return records
 
 
 def extract_csv(group, params=None):
@@ -345,6 +723,7 @@ def extract_csv(group, params=None):
         mapping = csv_params["mapping"]
     except (KeyError, AttributeError):
         return {}
+    pd = _import_backend("pandas")
 
     records = []
     for file_path in group:
@@ -361,6 +740,7 @@ def extract_csv(group, params=None):
 def extract_yaml(group, params=None):
     """Extractor for YAML files.
     Will populate blocks according to mapping.
+    Every document in the file is extracted, one at a time, with libyaml if available.
 
     Arguments:
     group (list of str): The paths to grouped files.
@@ -368,26 +748,39 @@ def extract_yaml(group, params=None):
         extractors (dict):
             yaml (dict):
                 mapping (dict): The mapping of mdf_fields: yaml_fields
+                na_values (list of str): Values to treat as N/A. Default None.
 
     Returns:
-    list of dict: The record(s) extractd.
+    iterator of dict: The record(s) extractd, or an empty dict without a mapping.
     """
     try:
         mapping = params["extractors"]["yaml"]["mapping"]
         na_values = params["extractors"]["yaml"].get("na_values", None)
     except (KeyError, AttributeError):
         return {}
+    return _stream_yaml(group, mapping, na_values)
 
-    records = []
+
+def _stream_yaml(group, mapping, na_values=None):
+    """Read and map the documents of YAML files, one at a time.
+    Unreadable or invalid files are skipped, after any records read before the error.
+
+    Arguments:
+    group (list of str): The paths to the files.
+    mapping (dict): The mapping of mdf_fields: yaml_fields
+    na_values (list of str): Values to treat as N/A. Default None.
+
+    Yields:
+    dict: The records.
+    """
     for file_path in group:
         try:
             with open(file_path) as f:
-                file_json = yaml.safe_load(f)
-        except Exception:
+                yield from _map_json_documents(_iter_yaml_documents(f), mapping,
+                                               na_values=na_values)
+        # Unreadable or invalid files
+        except (OSError, ValueError, yaml.YAMLError):
             pass
-        else:
-            records.extend(_extract_json(file_json, mapping, na_values=na_values))
-    return records
 
 
 def extract_xml(group, params=None):
@@ -400,62 +793,110 @@ def extract_xml(group, params=None):
         extractors (dict):
             xml (dict):
                 mapping (dict): The mapping of mdf_fields: xml_fields
+                na_values (list of str): Values to treat as N/A. Default None.
+                item_path (str): The dotted path of a repeated element, to stream the file
+                        and extract one record from each element at the path,
+                        with xml_fields relative to the element.
+                        Default None, to extract one record from the whole file.
 
     Returns:
-    list of dict: The record(s) extractd.
+    iterator of dict: The record(s) extractd, or an empty dict without a mapping.
     """
     try:
         mapping = params["extractors"]["xml"]["mapping"]
         na_values = params["extractors"]["xml"].get("na_values", None)
+        item_path = params["extractors"]["xml"].get("item_path", None)
     except (KeyError, AttributeError):
         return {}
+    return _stream_xml(group, mapping, na_values, item_path)
 
-    records = []
+
+def _stream_xml(group, mapping, na_values=None, item_path=None):
+    """Read and map XML files, one element at a time with an item_path.
+    Unreadable or invalid files are skipped, after any records read before the error.
+
+    Arguments:
+    group (list of str): The paths to the files.
+    mapping (dict): The mapping of mdf_fields: xml_fields
+    na_values (list of str): Values to treat as N/A. Default None.
+    item_path (str): The dotted path of the repeated element. Default None, for whole files.
+
+    Yields:
+    dict: The records.
+    """
     for file_path in group:
+        if item_path:
+            try:
+                yield from _map_json_documents(_iter_xml_items(file_path, item_path), mapping,
+                                               na_values=na_values)
+            except (OSError, ValueError, ElementTree.ParseError):
+                pass
+            continue
         try:
             with open(file_path) as f:
                 file_json = xmltodict.parse(f.read())
         except Exception:
             pass
         else:
-            records.extend(_extract_json(file_json, mapping, na_values=na_values))
-    return records
+            yield from _extract_json(file_json, mapping, na_values=na_values)
 
 
 def extract_excel(group, params=None):
     """Extractor for MS Excel files.
-    Will populate blocks according to mapping.
+    Will populate blocks according to mapping, for every sheet.
+    Workbooks are read a batch of rows at a time, not loaded whole,
+    and records are streamed as they are read.
 
     Arguments:
     group (list of str): The paths to grouped files.
     params (dict):
         extractors (dict):
             excel (dict):
-                mapping (dict): The mapping of mdf_fields: excel_headers
+                mapping (dict): The mapping of mdf_fields: excel_headers,
+                        for sheets without their own mapping in sheets.
+                sheets (dict): The mappings of specific sheets, by sheet name.
+                        Sheets mapped to None are not read.
                 na_values (list of str): Values to treat as N/A. Default NA_VALUES
 
     Returns:
-    list of dict: The record(s) extractd.
+    iterator of dict: The record(s) extractd, or an empty dict without a mapping.
     """
     try:
         excel_params = params["extractors"]["excel"]
-        mapping = excel_params["mapping"]
+        mapping = excel_params.get("mapping")
+        sheet_mappings = excel_params.get("sheets") or {}
     except (KeyError, AttributeError):
         return {}
+    if not mapping and not sheet_mappings:
+        return {}
+    na_values = excel_params.get("na_values", NA_VALUES)
 
-    records = []
+    return _stream_excel(group, mapping, sheet_mappings, na_values)
+
+
+def _stream_excel(group, mapping, sheet_mappings, na_values):
+    """Read and map the rows of Excel files, a batch at a time.
+    Files that cannot be read as workbooks are skipped, after any records read before the error.
+
+    Arguments:
+    group (list of str): The paths to the files.
+    mapping (dict): The mapping for sheets without their own, or None.
+    sheet_mappings (dict): The mappings of specific sheets, by sheet name.
+    na_values (list of str): Values to treat as N/A.
+
+    Yields:
+    dict: The records.
+    """
     for file_path in group:
         try:
-            df = pd.read_excel(file_path, na_values=excel_params.get("na_values", NA_VALUES))
+            yield from _extract_excel(file_path, mapping, sheet_mappings, na_values)
         except Exception:
             pass
-        else:
-            records.extend(_extract_pandas(df, mapping))
-    return records
 
 
 def extract_image(group, params=None):
     """Extract an image."""
+    Image = _import_backend("PIL.Image")
     records = []
     for file_path in group:
         try:
@@ -474,14 +915,56 @@ def extract_image(group, params=None):
     return records
 
 
+def _get_em_shape(raw_data, hs_data):
+    """Get the shape of an electron microscopy image, without reading the image data.
+
+    Arguments:
+    raw_data (dict): The original metadata of the file.
+    hs_data (hyperspy.signal.BaseSignal): The signal, which can be lazy.
+
+    Returns:
+    list of int: The shape, in MDF order (y, x, z, ..., channels), or None if unknown.
+    """
+    try:
+        # DigitalMicrograph tags list dimensions in (x, y, z, ...) order
+        base_shape = [int(dim) for dim in raw_data["ImageList"]["TagGroup0"]
+                                                  ["ImageData"]["Dimensions"].values()]
+    except Exception:
+        # Other formats: the data shape, in (..., z, y, x) order,
+        # which lazy signals know from the file header
+        try:
+            base_shape = [int(dim) for dim in reversed(hs_data.data.shape)]
+        except Exception:
+            return None
+    # Reverse X and Y order to match MDF schema (y, x, z, ..., channels)
+    if len(base_shape) >= 2:
+        shape = [base_shape[1], base_shape[0]] + base_shape[2:]
+    # If 1 dimension, don't need to swap
+    else:
+        shape = base_shape
+    return shape or None
+
+
 def extract_electron_microscopy(group, params=None):
-    """Extract an electron microscopy image with hyperspy library."""
+    """Extract an electron microscopy image with hyperspy library.
+    Files are loaded lazily, so only the metadata is read, with a full load
+    only if the lazy load fails or does not give the image shape.
+    """
+    hs = _import_backend("hyperspy.api")
     records = []
     for file_path in group:
         try:
-            hs_data = hs.load(file_path)
+            try:
+                hs_data = hs.load(file_path, lazy=True)
+                raw_data = hs_data.original_metadata.as_dictionary()
+                shape = _get_em_shape(raw_data, hs_data)
+            except Exception:
+                shape = None
+            if shape is None:
+                hs_data = hs.load(file_path)
+                raw_data = hs_data.original_metadata.as_dictionary()
+                shape = _get_em_shape(raw_data, hs_data)
             data = hs_data.metadata.as_dictionary()
-            raw_data = hs_data.original_metadata.as_dictionary()
         except Exception:
             pass
         else:
@@ -564,23 +1047,8 @@ def extract_electron_microscopy(group, params=None):
                 pass
 
             # Image metadata
-            try:
-                shape = []
-                base_shape = [int(dim) for dim in raw_data["ImageList"]["TagGroup0"]
-                                                          ["ImageData"]["Dimensions"].values()]
-                # Reverse X and Y order to match MDF schema (y, x, z, ..., channels)
-                if len(base_shape) >= 2:
-                    shape.append(base_shape[1])
-                    shape.append(base_shape[0])
-                    shape.extend(base_shape[2:])
-                # If 1 dimension, don't need to swap
-                elif len(base_shape) > 0:
-                    shape = base_shape
-
-                if shape:
-                    image["shape"] = shape
-            except Exception:
-                pass
+            if shape:
+                image["shape"] = shape
 
             # Remove None/empty values
             for key, val in list(em.items()):
@@ -616,23 +1084,15 @@ def extract_filename(group, params=None):
     except (KeyError, AttributeError):
         return {}
 
+    plan = _compile_mapping(mapping, "regex")
     records = []
     for file_path in group:
         record = {}
         filename = os.path.basename(file_path)
-        for mdf_path, pattern in _flatten_struct(mapping):
-            match = re.search(pattern, filename)
+        for pattern, setter in plan:
+            match = pattern.search(filename)
             if match:
-                fields = mdf_path.split(".")
-                last_field = fields.pop()
-                current_field = record
-                # Create all missing fields
-                for field in fields:
-                    if current_field.get(field) is None:
-                        current_field[field] = {}
-                    current_field = current_field[field]
-                # Add value to end
-                current_field[last_field] = match.group()
+                setter(record, match.group())
         if record:
             records.append(record)
     return records
@@ -652,8 +1112,302 @@ ALL_EXTRACTORS = {
     "filename": extract_filename
 }
 
+# The version of each extractor's output, part of the extraction cache key
+# Bump an extractor's version when its output changes, to stop using old cached results
+# Extractors with a version of None are never cached:
+#   pif writes integration data as it runs, and filename extracts from the paths, not contents
+EXTRACTOR_VERSIONS = {
+    "crystal_structure": 1,
+    "tdb": 1,
+    "pif": None,
+    "json": 3,
+    "csv": 1,
+    "yaml": 3,
+    "xml": 2,
+    "excel": 3,
+    "image": 1,
+    "electron_microscopy": 2,
+    "filename": None
+}
+
+# libmagic MIME types (or prefixes) of text-based files
+TEXT_MIME_TYPES = ["text/", "application/json", "application/xml", "application/csv",
+                   "application/x-yaml"]
+# libmagic MIME types of compressed files, which some readers decompress transparently
+COMPRESSED_MIME_TYPES = ["application/gzip", "application/x-gzip", "application/x-bzip2",
+                         "application/x-xz"]
+
+# The files each extractor can plausibly handle, used to skip pointless extraction attempts
+# on groups without a configured extractor list.
+#   extensions (list of str): Lowercase file extensions the extractor reads.
+#   mime_types (list of str): libmagic MIME types (or prefixes) the extractor reads.
+#   headers (list of bytes): Leading bytes (magic numbers) of files the extractor reads.
+#   mapping (bool or list of str): If set, the extractor does nothing without a user-supplied
+#       mapping, in its "mapping" parameter if True, or else in any of the parameters listed.
+# A group is plausible when any file matches any extension, MIME type, or header.
+# An extractor with no extensions, MIME types, or headers accepts every file.
+EXTRACTOR_SIGNATURES = {
+    "crystal_structure": {
+        "extensions": [".traj", ".nc"],
+        "mime_types": TEXT_MIME_TYPES + COMPRESSED_MIME_TYPES,
+        "headers": [b"- of UlmASE-Trajectory"[:FILE_HEADER_SIZE], b"CDF"]
+    },
+    "tdb": {
+        # pycalphad selects its reader by extension
+        "extensions": [".tdb", ".dat", ".xml"]
+    },
+    "pif": {
+        "mime_types": TEXT_MIME_TYPES + COMPRESSED_MIME_TYPES
+    },
+    "json": {
+        # libmagic reports JSON Lines files as application/x-ndjson
+        "extensions": JSON_LINES_EXTENSIONS,
+        "mime_types": TEXT_MIME_TYPES + ["application/x-ndjson"],
+        "mapping": True
+    },
+    "csv": {
+        "mime_types": TEXT_MIME_TYPES,
+        "mapping": True
+    },
+    "yaml": {
+        "mime_types": TEXT_MIME_TYPES,
+        "mapping": True
+    },
+    "xml": {
+        "mime_types": TEXT_MIME_TYPES,
+        "mapping": True
+    },
+    "excel": {
+        "extensions": [".xls", ".xlsx", ".xlsm", ".xlsb", ".ods"],
+        "mime_types": ["application/vnd.ms-excel", "application/vnd.openxmlformats",
+                       "application/vnd.oasis.opendocument.spreadsheet"],
+        "mapping": ["mapping", "sheets"]
+    },
+    "image": {
+        "extensions": [".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff", ".webp"],
+        "mime_types": ["image/"],
+        "headers": [b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"BM", b"II*\x00", b"MM\x00*"]
+    },
+    "electron_microscopy": {
+        # hyperspy selects its reader by extension
+        "extensions": [".dm3", ".dm4", ".emd", ".hspy", ".hdf5", ".h5", ".ser", ".emi",
+                       ".msa", ".ems", ".mas", ".emsa", ".tif", ".tiff", ".blo", ".mrc",
+                       ".rpl", ".bcf", ".unf", ".sur", ".pro", ".spx", ".spc", ".spd",
+                       ".img", ".dens", ".prz", ".zspy"]
+    },
+    "filename": {
+        "mapping": True
+    }
+}
+# Extensions claimed by any extractor's signature, for estimate_group_cost()
+SIGNATURE_EXTENSIONS = {ext for signature in EXTRACTOR_SIGNATURES.values()
+                        for ext in signature.get("extensions", [])}
+
+# Rough costs of each extractor, used to dispatch the most expensive groups first,
+# and to keep groups needing a lot of memory from running at the same time
+# (see estimate_group_cost()). Extractors not listed cost nothing.
+#   time (float): Seconds per call.
+#   time_per_mib (float): Seconds per MiB of the files read.
+#   memory_ratio (float): Bytes of memory used per byte of the largest file read.
+#       Readers that load whole files use several times the file size, streaming readers little.
+EXTRACTOR_COSTS = {
+    "crystal_structure": {"time": 0.5, "time_per_mib": 2, "memory_ratio": 20},
+    "tdb": {"time": 1, "time_per_mib": 5, "memory_ratio": 20},
+    "pif": {"time": 2, "time_per_mib": 2, "memory_ratio": 20},
+    # Top-level arrays are streamed, other documents are read whole
+    "json": {"time": 0.01, "time_per_mib": 0.1, "memory_ratio": 5},
+    "csv": {"time": 0.05, "time_per_mib": 0.5, "memory_ratio": 10},
+    "yaml": {"time": 0.05, "time_per_mib": 1, "memory_ratio": 1},
+    # Streamed with item_path, otherwise read whole
+    "xml": {"time": 0.05, "time_per_mib": 1, "memory_ratio": 10},
+    "excel": {"time": 0.5, "time_per_mib": 2, "memory_ratio": 1},
+    # Only the header is read
+    "image": {"time": 0.01, "time_per_mib": 0, "memory_ratio": 0},
+    # Loaded lazily where hyperspy can, otherwise whole
+    "electron_microscopy": {"time": 1, "time_per_mib": 0.01, "memory_ratio": 0.5}
+}
+# Seconds per MiB to fingerprint every file of a group
+FINGERPRINT_TIME_PER_MIB = 0.002
+
+
+def _import_backend(module_name):
+    """Import an extractor's backend library on first use.
+    The scientific libraries are slow to import, so they are not imported with this module.
+
+    Arguments:
+    module_name (str): The module to import (ex. "hyperspy.api").
+
+    Returns:
+    module: The module.
+    """
+    try:
+        return importlib.import_module(module_name)
+    # pycalphad and hyperspy run into dlopen static TLS errors, so retry imports when failing
+    except ImportError:
+        return importlib.import_module(module_name)
+
+
+def _choose_structure_readers(data_file, ase_formats):
+    """Choose the readers that can read a crystal structure file, from its format,
+    so files are not parsed by readers that cannot handle them.
+
+    Arguments:
+    data_file (str): The path to the file.
+    ase_formats (module): ase.io.formats.
+
+    Returns:
+    list of tuple: The (reader, format) to try, in order. The reader is "ase" or "pymatgen",
+            and the format is ASE's name for the format, or None for pymatgen.
+    """
+    readers = []
+    try:
+        # Detected from the name, or the first bytes of the file
+        readers.append(("ase", ase_formats.filetype(data_file)))
+    except Exception:
+        pass
+    file_name = os.path.basename(data_file).lower()
+    if any(fnmatch(file_name, pattern) for pattern in PYMATGEN_STRUCTURE_FILES):
+        readers.append(("pymatgen", None))
+    return readers
+
+
+def _structure_key(pmg_s, symprec):
+    """Make a canonical hash of a structure for the space group cache, from the lattice,
+    species, and fractional coordinates (in any site order), rounded to the tolerance.
+
+    Arguments:
+    pmg_s (pymatgen.Structure): The structure.
+    symprec (float): The distance tolerance, in Angstroms.
+
+    Returns:
+    str: The hash.
+    """
+    lattice = [int(round(x / symprec)) for x in pmg_s.lattice.matrix.flatten()]
+    # Fractional coordinates rounded to about the same distance
+    frac_symprec = symprec / max(pmg_s.lattice.abc)
+    sites = sorted((site.species_string,
+                    tuple(int(round((x % 1.0) / frac_symprec)) for x in site.frac_coords))
+                   for site in pmg_s)
+    return sha512(repr((lattice, sites)).encode("utf-8")).hexdigest()
+
+
+def _get_space_group_number(pmg_s, symprec, angle_tolerance):
+    """Find the space group of a structure with spglib, reusing the results
+    for the same structure (ex. the same cell in several files of a calculation).
+
+    Arguments:
+    pmg_s (pymatgen.Structure): The structure.
+    symprec (float): The distance tolerance, in Angstroms.
+    angle_tolerance (float): The angle tolerance, in degrees.
+
+    Returns:
+    int: The space group number.
+    """
+    key = (_structure_key(pmg_s, symprec), symprec, angle_tolerance)
+    if key in _space_group_cache:
+        _space_group_cache.move_to_end(key)
+    else:
+        _space_group_cache[key] = pmg_s.get_space_group_info(
+                                        symprec=symprec, angle_tolerance=angle_tolerance)[1]
+        if len(_space_group_cache) > SPACE_GROUP_CACHE_SIZE:
+            _space_group_cache.popitem(last=False)
+    return _space_group_cache[key]
+
+
+def _plan_extractors(extractor_names, group, fingerprints, params):
+    """Choose the extractors that can plausibly handle a group.
+    Extractors that require a mapping are skipped when none is supplied, and extractors
+    not configured for the group are skipped when no file matches their signature.
+
+    Arguments:
+    extractor_names (list of str): The extractors configured for the group,
+            or an empty list for none.
+    group (list of str): The paths to grouped files.
+    fingerprints (list of tuple): The results of _fingerprint_group() for the group,
+            or None if unavailable.
+    params (dict): The extraction parameters for the group.
 
-def _extract_file_info(group, params=None):
+    Returns:
+    list of str: The extractors to run, in order.
+    """
+    configured = bool(extractor_names)
+    extractor_params = (params or {}).get("extractors") or {}
+    planned = []
+    for extractor_name in (extractor_names or ALL_EXTRACTORS.keys()):
+        signature = EXTRACTOR_SIGNATURES.get(extractor_name, {})
+        if signature.get("mapping"):
+            mapping_params = (["mapping"] if signature["mapping"] is True
+                              else signature["mapping"])
+            try:
+                if not any(extractor_params[extractor_name].get(mapping_param)
+                           for mapping_param in mapping_params):
+                    continue
+            except (KeyError, TypeError, AttributeError):
+                continue
+        if configured or fingerprints is None:
+            planned.append(extractor_name)
+            continue
+        extensions = signature.get("extensions", [])
+        mime_types = signature.get("mime_types", [])
+        headers = signature.get("headers", [])
+        if not (extensions or mime_types or headers):
+            planned.append(extractor_name)
+            continue
+        for file_path, (fingerprint, header) in zip(group, fingerprints):
+            if (os.path.splitext(file_path)[1].lower() in extensions
+                    or any(fingerprint["mime_type"].startswith(mt) for mt in mime_types)
+                    or any(header.startswith(hd) for hd in headers)):
+                planned.append(extractor_name)
+                break
+    return planned
+
+
+def estimate_group_cost(group_info, extract_params=None):
+    """Estimate the time and memory needed to extract a group, from its file sizes
+    and the EXTRACTOR_COSTS of the extractors expected to run.
+    Without the files' contents, extractors not configured for the group are expected
+    to read files with extensions in their signature, and extractors that recognize files
+    by content to read all files with no extension in any signature.
+
+    Arguments:
+    group_info (dict): The group, as produced by group_tree().
+    extract_params (dict): Parameters for extraction. Default None.
+
+    Returns:
+    dict: The estimates.
+        time (float): The seconds to extract the group.
+        memory (int): The bytes of memory needed at peak.
+    """
+    group = group_info["files"]
+    sizes = group_info.get("sizes") or [0] * len(group)
+    specific_params = mdf_toolbox.dict_merge(extract_params or {}, group_info["params"])
+    configured = bool(group_info["extractors"])
+    extensions = [os.path.splitext(file_path)[1].lower() for file_path in group]
+
+    seconds = FINGERPRINT_TIME_PER_MIB * sum(sizes) / 2**20
+    memory = 0
+    for extractor_name in _plan_extractors(group_info["extractors"], group, None,
+                                           specific_params):
+        cost = EXTRACTOR_COSTS.get(extractor_name)
+        if cost is None:
+            continue
+        signature = EXTRACTOR_SIGNATURES.get(extractor_name, {})
+        by_content = (signature.get("mime_types") or signature.get("headers")
+                      or not signature.get("extensions"))
+        read_sizes = [size for size, ext in zip(sizes, extensions)
+                      if configured or ext in signature.get("extensions", [])
+                      or (by_content and ext not in SIGNATURE_EXTENSIONS)]
+        if not read_sizes:
+            continue
+        seconds += cost["time"] + cost["time_per_mib"] * sum(read_sizes) / 2**20
+        memory = max(memory, int(cost["memory_ratio"] * max(read_sizes)))
+    return {
+        "time": seconds,
+        "memory": memory
+    }
+
+
+def _extract_file_info(group, params=None, fingerprints=None):
     """File information extractor.
     Populates the "files" block.
 
@@ -665,6 +1419,8 @@ def _extract_file_info(group, params=None):
                 globus_endpoint (str): Data file endpoint.
                 http_host (str): Data file HTTP host.
                 local_path (str): The path to the root of the files on the current machine.
+    fingerprints (list of tuple): The results of _fingerprint_group() for the group,
+            if already computed. Default None, to fingerprint the files.
 
     Returns:
     list of dict: The record(s) extractd.
@@ -684,76 +1440,407 @@ def _extract_file_info(group, params=None):
     except Exception:
         raise ValueError("File info local_path missing")
 
+    if fingerprints is None:
+        fingerprints = _fingerprint_group(group)
+
     files = []
-    for file_path in group:
+    for file_path, (fingerprint, header) in zip(group, fingerprints):
         host_file = file_path.replace(local_path, host_path)
-        with open(file_path, "rb") as f:
-            md = {
-                "globus": "globus://{}{}".format(host_endpoint, host_file),
-                "data_type": magic.from_file(file_path),
-                "mime_type": magic.from_file(file_path, mime=True),
-                "url": (http_host + host_file) if http_host else None,
-                "length": os.path.getsize(file_path),
-                "filename": os.path.basename(file_path),
-                "sha512": sha512(f.read()).hexdigest()
-            }
+        md = {
+            "globus": "globus://{}{}".format(host_endpoint, host_file),
+            "url": (http_host + host_file) if http_host else None,
+            "filename": os.path.basename(file_path)
+        }
+        md.update(fingerprint)
         files.append(md)
     return {
         "files": files
     }
 
 
+def _fingerprint_group(group, sizes=None):
+    """Fingerprint every file in a group with _fingerprint_file().
+    Large files are hashed in parallel (hashlib releases the GIL).
+
+    Arguments:
+    group (list of str): The paths to grouped files.
+    sizes (list of int): The sizes of the files, if already known from the walk
+            (see group_tree()). Default None, to stat the files.
+
+    Returns:
+    list of tuple: The fingerprint of each file, in group order.
+    """
+    if sizes is None:
+        sizes = [os.path.getsize(path) for path in group]
+    if len([size for size in sizes if size >= LARGE_FILE_SIZE]) > 1:
+        with ThreadPoolExecutor(max_workers=CONFIG["FILE_HASH_THREADS"]) as pool:
+            return list(pool.map(_fingerprint_file, group))
+    else:
+        return [_fingerprint_file(file_path) for file_path in group]
+
+
+def _fingerprint_file(file_path):
+    """Hash a file and detect its type, reading the file once in bounded blocks.
+    libmagic only needs the first block.
+
+    Arguments:
+    file_path (str): The path to the file.
+
+    Returns:
+    tuple: The results.
+        dict: The data_type, mime_type, length, and sha512 of the file.
+        bytes: The first FILE_HEADER_SIZE bytes of the file.
+    """
+    hasher = sha512()
+    buf = bytearray(FILE_BLOCK_SIZE)
+    view = memoryview(buf)
+    with open(file_path, "rb") as f:
+        length = os.fstat(f.fileno()).st_size
+        num_read = f.readinto(buf)
+        header = bytes(view[:min(num_read, FILE_HEADER_SIZE)])
+        if length:
+            first_block = bytes(view[:num_read])
+            data_type = magic.from_buffer(first_block)
+            mime_type = magic.from_buffer(first_block, mime=True)
+        else:
+            # Match libmagic's results for empty files on disk
+            data_type = "empty"
+            mime_type = "inode/x-empty"
+        while num_read:
+            hasher.update(view[:num_read])
+            num_read = f.readinto(buf)
+    return {
+        "data_type": data_type,
+        "mime_type": mime_type,
+        "length": length,
+        "sha512": hasher.hexdigest()
+    }, header
+
+
 def _extract_pandas(df, mapping):
-    """Extract a Pandas DataFrame."""
-    csv_len = len(df.index)
-    df_json = json.loads(df.to_json())
+    """Extract a Pandas DataFrame.
+    The mapping is resolved to columns once, then each mapped column is converted
+    to JSON values and masked for N/A values in one vectorized pass.
+    Records are assembled row-by-row from the converted columns.
+    """
+    columns = {str(col): col for col in df.columns}
+    # List of (MDF field setter, column values, column not-N/A mask)
+    plan = []
+    for column, setter in _compile_mapping(mapping, "column"):
+        if column not in columns:
+            continue
+        series = df[columns[column]]
+        # Same value conversion as DataFrame.to_json() (e.g. float precision, dates)
+        values = json.loads(series.to_json(orient="values"))
+        present = series.notna().to_numpy()
+        plan.append((setter, values, present))
 
     records = []
-    for index in range(csv_len):
-        new_map = {}
-        for path, value in _flatten_struct(mapping):
-            new_map[path] = value + "." + str(index)
-        records.extend(_extract_json(df_json, new_map))
+    for index in range(len(df.index)):
+        record = {}
+        for setter, values, present in plan:
+            value = values[index]
+            # Only add value if value exists and is not N/A
+            if present[index] and value is not None:
+                setter(record, value)
+        # Add record to list if exists
+        if record:
+            records.append(record)
     return records
 
 
+def _extract_excel(file_path, mapping, sheet_mappings, na_values):
+    """Extract an Excel file, sheet by sheet.
+    Workbooks openpyxl can read are streamed in read-only mode, and converted to records
+    EXCEL_BATCH_SIZE rows at a time, with the same parsing as pandas.read_excel().
+    Other formats (ex. .xls, .ods) are read whole with pandas.
+
+    Arguments:
+    file_path (str): The path to the file.
+    mapping (dict): The mapping for sheets not in sheet_mappings.
+    sheet_mappings (dict): The mappings of specific sheets, by sheet name.
+    na_values (list of str): Values to treat as N/A.
+
+    Yields:
+    dict: The records.
+    """
+    pd = _import_backend("pandas")
+    openpyxl = _import_backend("openpyxl")
+    try:
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    except Exception:
+        sheets = pd.read_excel(file_path, sheet_name=None, na_values=na_values)
+        for sheet_name, df in sheets.items():
+            sheet_mapping = sheet_mappings.get(sheet_name, mapping)
+            if sheet_mapping:
+                yield from _extract_pandas(df, sheet_mapping)
+        return
+
+    TextParser = _import_backend("pandas.io.parsers").TextParser
+    try:
+        for sheet in workbook.worksheets:
+            sheet_mapping = sheet_mappings.get(sheet.title, mapping)
+            if not sheet_mapping:
+                continue
+            # Read-only sheets can have the wrong dimensions recorded
+            sheet.reset_dimensions()
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            header = [_convert_excel_cell(value) for value in header]
+            while True:
+                batch = [[_convert_excel_cell(value) for value in row]
+                         for row in islice(rows, EXCEL_BATCH_SIZE)]
+                if not batch:
+                    break
+                df = TextParser([header] + batch, header=0, na_values=na_values).read()
+                yield from _extract_pandas(df, sheet_mapping)
+    finally:
+        workbook.close()
+
+
+def _convert_excel_cell(value):
+    """Convert an openpyxl cell value as pandas.read_excel() does."""
+    if value is None:
+        return ""
+    # Numbers are stored as floats
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
 def _extract_json(file_json, mapping, na_values=None):
     """Extract a JSON file."""
     # Handle lists of JSON documents as separate records
     if not isinstance(file_json, list):
         file_json = [file_json]
+    return list(_map_json_documents(file_json, mapping, na_values=na_values))
+
+
+def _map_json_documents(documents, mapping, na_values=None):
+    """Map JSON documents to records, one document at a time.
+
+    Arguments:
+    documents (iterable of dict): The documents.
+    mapping (dict): The mapping of mdf_fields: json_fields.
+    na_values (list): Values to treat as N/A. Default None.
+
+    Yields:
+    dict: The records, for documents with any mapped values.
+    """
     if na_values is None:
         na_values = []
     elif not isinstance(na_values, list):
         na_values = [na_values]
 
-    records = []
-    for data in file_json:
+    plan = _compile_mapping(mapping, "path")
+    for data in documents:
         record = {}
-        # Get (path, value) pairs from the key structure
-        # Loop over each
-        for mdf_path, json_path in _flatten_struct(mapping):
+        for getter, setter in plan:
             try:
-                value = _follow_path(data, json_path)
+                value = getter(data)
             except KeyError:
                 value = None
             # Only add value if value exists and is not N/A
             if value is not None and value not in na_values:
-                fields = mdf_path.split(".")
-                last_field = fields.pop()
-                current_field = record
-                # Create all missing fields
-                for field in fields:
-                    if current_field.get(field) is None:
-                        current_field[field] = {}
-                    current_field = current_field[field]
-                # Add value to end
-                current_field[last_field] = value
-        # Add record to list if exists
+                setter(record, value)
+        # Add record if exists
         if record:
-            records.append(record)
+            yield record
 
-    return records
+
+def _iter_json_documents(f):
+    """Read the documents in a JSON file incrementally.
+    A top-level array is decoded one element at a time, with only the current element
+    held in memory. Any other JSON document is read whole.
+
+    Arguments:
+    f (file): The file, open in text mode.
+
+    Yields:
+    The elements of the top-level array, or the document.
+
+    Raises:
+    ValueError: If the JSON is invalid.
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(JSON_READ_SIZE)
+    pos = _skip_json_whitespace(buffer, 0)
+    if not buffer.startswith("[", pos):
+        yield json.loads(buffer + f.read())
+        return
+    pos += 1
+    expect_element = True
+    after_comma = False
+    eof = False
+    while True:
+        pos = _skip_json_whitespace(buffer, pos)
+        if pos >= len(buffer) and not eof:
+            buffer, pos, eof = _refill_json_buffer(f, buffer, pos)
+            continue
+        if buffer.startswith("]", pos) and not after_comma:
+            if _skip_json_whitespace(buffer, pos + 1) < len(buffer) or f.read().strip():
+                raise ValueError("Extra data after top-level array")
+            return
+        if not expect_element:
+            if not buffer.startswith(",", pos):
+                raise ValueError("Expected ',' or ']' at position {}".format(pos))
+            pos += 1
+            expect_element = after_comma = True
+            continue
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+            # The element needs its following delimiter in the buffer,
+            # or it could be a truncated number
+            next_pos = _skip_json_whitespace(buffer, end)
+            complete = eof or (next_pos < len(buffer) and buffer[next_pos] in ",]")
+        except ValueError:
+            if eof:
+                raise
+            complete = False
+        if not complete:
+            buffer, pos, eof = _refill_json_buffer(f, buffer, pos)
+            continue
+        yield element
+        pos = end
+        expect_element = after_comma = False
+
+
+def _refill_json_buffer(f, buffer, pos):
+    """Drop the consumed part of the buffer, and read at least as much again,
+    so elements larger than JSON_READ_SIZE take a logarithmic number of attempts.
+
+    Returns:
+    tuple: The new buffer, the new position, and True if the file is exhausted.
+    """
+    buffer = buffer[pos:]
+    data = f.read(max(JSON_READ_SIZE, len(buffer)))
+    return buffer + data, 0, not data
+
+
+def _skip_json_whitespace(buffer, pos):
+    while pos < len(buffer) and buffer[pos] in JSON_WHITESPACE:
+        pos += 1
+    return pos
+
+
+def _iter_json_lines(f):
+    """Read the documents in a JSON Lines file, one line at a time.
+
+    Arguments:
+    f (file): The file, open in text mode.
+
+    Yields:
+    The document on each non-blank line.
+
+    Raises:
+    ValueError: If any line is invalid JSON.
+    """
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _iter_yaml_documents(f):
+    """Load the documents in a YAML stream lazily, one at a time.
+    Lists of documents are handled as separate documents, as in _extract_json(),
+    and empty documents are skipped.
+
+    Arguments:
+    f (file): The file.
+
+    Yields:
+    The documents.
+    """
+    for document in yaml.load_all(f, Loader=YAML_LOADER):
+        if isinstance(document, list):
+            yield from document
+        elif document is not None:
+            yield document
+
+
+def _iter_xml_items(file_path, item_path):
+    """Read the elements at a path in an XML file incrementally, converted to the same form
+    as xmltodict.parse() gives them. Each element is discarded once converted,
+    along with everything outside the elements, so memory use does not grow with the file.
+    Namespaced names use the prefix they are declared with, as in xmltodict.
+
+    Arguments:
+    file_path (str): The path to the file.
+    item_path (str): The dotted path of the elements, from the root element.
+
+    Yields:
+    dict: Each element with attributes or children. Elements with only text are skipped.
+    """
+    item_names = item_path.split(".")
+    item_depth = len(item_names)
+    # Namespace prefixes, by URI
+    prefixes = {}
+    # Names and elements of the open elements
+    path = []
+    parents = []
+    for event, elem in ElementTree.iterparse(file_path, events=("start-ns", "start", "end")):
+        if event == "start-ns":
+            prefix, uri = elem
+            prefixes[uri] = prefix
+            continue
+        if event == "start":
+            path.append(_xml_name(elem.tag, prefixes))
+            parents.append(elem)
+            continue
+        if len(path) >= item_depth and path[:item_depth] == item_names:
+            # Contents of an item are kept until the item is done
+            if len(path) > item_depth:
+                path.pop()
+                parents.pop()
+                continue
+            item = _xml_to_dict(elem, prefixes)
+            if isinstance(item, dict):
+                yield item
+        path.pop()
+        parents.pop()
+        elem.clear()
+        if parents:
+            parents[-1].remove(elem)
+
+
+def _xml_name(name, prefixes):
+    """Convert an ElementTree "{uri}name" to "prefix:name", as in xmltodict."""
+    if name.startswith("{"):
+        uri, name = name[1:].split("}", 1)
+        if prefixes.get(uri):
+            name = prefixes[uri] + ":" + name
+    return name
+
+
+def _xml_to_dict(elem, prefixes):
+    """Convert an ElementTree element the same way as xmltodict.parse(), with "@" attributes,
+    "#text" text, and lists for repeated children.
+
+    Returns:
+    dict: The element, or str or None for elements with only text or nothing.
+    """
+    item = {}
+    for key, value in elem.attrib.items():
+        item["@" + _xml_name(key, prefixes)] = value
+    text = [elem.text or ""]
+    for child in elem:
+        name = _xml_name(child.tag, prefixes)
+        value = _xml_to_dict(child, prefixes)
+        if name not in item:
+            item[name] = value
+        elif isinstance(item[name], list):
+            item[name].append(value)
+        else:
+            item[name] = [item[name], value]
+        text.append(child.tail or "")
+    text = "".join(text).strip() or None
+    if not item:
+        return text
+    if text:
+        item["#text"] = text
+    return item
 
 
 def _flatten_struct(struct, path=""):
@@ -777,12 +1864,76 @@ def _flatten_struct(struct, path=""):
             yield ((path+"."+key).strip(". "), val)
 
 
-def _follow_path(json_data, json_path):
-    """Get the value in the data pointed to by the path."""
-    value = json_data
-    for field in json_path.split("."):
-        value = value[field]
-    return value
+def _compile_mapping(mapping, source_type):
+    """Compile a mapping into a plan for mapping records, once per submission.
+    Plans are cached by each worker, keyed on the mapping's JSON, so the fields are only
+    flattened and split (and patterns compiled) the first time a mapping is seen.
+
+    Arguments:
+    mapping (dict): The mapping of mdf_fields: sources.
+    source_type (str): The type of the sources in the mapping:
+            "path": Dotted paths into JSON documents, compiled into getters,
+                    which raise KeyError when the path is missing.
+            "column": Column names, kept as they are.
+            "regex": Regular expressions, compiled.
+
+    Returns:
+    tuple of tuple: The (source, setter) pairs, in mapping order.
+            setter(record, value) adds the value to the record at the MDF field.
+    """
+    return _compile_mapping_json(json.dumps(mapping), source_type)
+
+
+@lru_cache(maxsize=MAPPING_CACHE_SIZE)
+def _compile_mapping_json(mapping_json, source_type):
+    """Compile a mapping from its JSON (see _compile_mapping())."""
+    compile_source = {
+        "path": lambda json_path: _make_getter(tuple(json_path.split("."))),
+        "column": lambda column: column,
+        "regex": re.compile
+    }[source_type]
+    return tuple((compile_source(source), _make_setter(tuple(mdf_path.split("."))))
+                 for mdf_path, source in _flatten_struct(json.loads(mapping_json)))
+
+
+def _make_getter(fields):
+    """Make a function getting the value at a path of fields in JSON data."""
+    if len(fields) == 1:
+        return itemgetter(fields[0])
+
+    def getter(json_data):
+        value = json_data
+        for field in fields:
+            value = value[field]
+        return value
+    return getter
+
+
+def _make_setter(fields):
+    """Make a function adding a value to a record at a path of fields,
+    creating all missing fields.
+    """
+    parents = fields[:-1]
+    last_field = fields[-1]
+    if not parents:
+        def setter(record, value):
+            record[last_field] = value
+    elif len(parents) == 1:
+        parent = parents[0]
+
+        def setter(record, value):
+            if record.get(parent) is None:
+                record[parent] = {}
+            record[parent][last_field] = value
+    else:
+        def setter(record, value):
+            current_field = record
+            for field in parents:
+                if current_field.get(field) is None:
+                    current_field[field] = {}
+                current_field = current_field[field]
+            current_field[last_field] = value
+    return setter
 
 
 def _translate_pif(pif):
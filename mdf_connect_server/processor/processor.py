@@ -2,7 +2,6 @@ from copy import deepcopy
 from datetime import datetime
 import json
 import logging
-import multiprocessing
 import os
 import signal
 from time import sleep
@@ -13,6 +12,8 @@ import requests
 
 from mdf_connect_server import CONFIG, utils
 from mdf_connect_server.processor import start_extractors
+from mdf_connect_server.processor.start_extractors import summarize_extractor_stats
+from mdf_connect_server.processor.extractor_pool import ExtractorPool, MP_CONTEXT
 
 
 # Set up root logger
@@ -58,7 +59,12 @@ def processor():
         pf.write(str(os.getpid()))
     utils.clean_start()
     active_processes = []
+    # Tokens of the drivers' extractor pool handles, keyed by driver process
+    pool_tokens = {}
     sig_handle = SignalHandler()
+    # Extractor workers are shared by all submissions
+    extractor_pool = ExtractorPool()
+    extractor_pool.start()
     while sig_handle.caught_signal is None:
         try:
             submissions = utils.retrieve_from_queue(wait_time=CONFIG["PROCESSOR_WAIT_TIME"])
@@ -67,10 +73,12 @@ def processor():
             if len(submissions["entries"]):
                 logger.debug("{} submissions retrieved".format(len(submissions["entries"])))
                 for sub in submissions["entries"]:
-                    driver = multiprocessing.Process(target=submission_driver,
-                                                     kwargs=sub, name=sub["source_id"])
+                    sub["extractor_pool"] = extractor_pool.open(sub["source_id"])
+                    driver = MP_CONTEXT.Process(target=submission_driver,
+                                                kwargs=sub, name=sub["source_id"])
                     driver.start()
                     active_processes.append(driver)
+                    pool_tokens[driver] = sub["extractor_pool"].token
                 utils.delete_from_queue(submissions["delete_info"])
                 logger.info("{} submissions started".format(len(submissions["entries"])))
         except Exception as e:
@@ -85,6 +93,10 @@ def processor():
                     continue
                 logger.info("Dead: {} (hibernating {})"
                             .format(dead_proc.name, dead_status["status"]["hibernating"]))
+                # The driver is gone either way, so its extraction is too
+                # (closed by token, as the source_id may already be resubmitted)
+                if dead_proc in pool_tokens:
+                    extractor_pool.close(pool_tokens.pop(dead_proc))
                 if dead_status["status"]["hibernating"] is True:
                     active_processes.remove(dead_proc)
                     logger.debug("{}: Hibernating".format(dead_proc.name))
@@ -112,11 +124,13 @@ def processor():
         else:
             logger.info("Unable to shut down process for {}: {}"
                         .format(proc.name, cancel_res.get("error", "No error provided")))
+    extractor_pool.shutdown()
     logger.info("Connect gracefully shut down")
     return
 
 
-def submission_driver(metadata, sub_conf, source_id, access_token, user_id):
+def submission_driver(metadata, sub_conf, source_id, access_token, user_id,
+                      extractor_pool=None):
     """The driver function for MOC.
     Modifies the status database as steps are completed.
 
@@ -126,6 +140,8 @@ def submission_driver(metadata, sub_conf, source_id, access_token, user_id):
     source_id (str): The source name of this submission.
     access_token (str): The Globus Auth access token for the submitting user.
     user_id (str): The Globus ID of the submitting user.
+    extractor_pool (ExtractorPoolHandle): The submission's handle on the processor's
+            extractor pool. Default None, to use a private pool.
     """
     # Setup
     utils.update_status(source_id, "sub_start", "P", except_on_fail=True)
@@ -310,7 +326,8 @@ def submission_driver(metadata, sub_conf, source_id, access_token, user_id):
         # Extract data
         utils.update_status(source_id, "extracting", "P", except_on_fail=True)
         try:
-            extract_res = start_extractors(local_path, extract_params)
+            extract_res = start_extractors(local_path, extract_params,
+                                           extractor_pool=extractor_pool)
             if not extract_res["success"]:
                 utils.update_status(source_id, "extracting", "F", text=extract_res["error"],
                                     except_on_fail=True)
@@ -318,13 +335,24 @@ def submission_driver(metadata, sub_conf, source_id, access_token, user_id):
             dataset = extract_res["dataset"]
             num_records = extract_res["num_records"]
             num_groups = extract_res["num_groups"]
+            skipped_groups = extract_res["skipped_groups"]
+            extractor_stats = extract_res["extractor_stats"]
             extensions = extract_res["extensions"]
         except Exception as e:
             utils.update_status(source_id, "extracting", "F", text=repr(e), except_on_fail=True)
             utils.complete_submission(source_id)
             return
         else:
-            utils.modify_status_entry(source_id, {"extensions": extensions})
+            ext_res = utils.modify_status_entry(source_id, {"extensions": extensions})
+            if not ext_res["success"]:
+                logger.error("{}: Unable to save extensions: {}"
+                             .format(source_id, ext_res["error"]))
+            # Counters are ints, which DynamoDB stores as they are
+            stats_res = utils.modify_status_entry(source_id,
+                                                  {"extractor_stats": extractor_stats})
+            if not stats_res["success"]:
+                logger.error("{}: Unable to save extractor stats: {}"
+                             .format(source_id, stats_res["error"]))
             # If nothing in dataset, panic
             if not dataset:
                 utils.update_status(source_id, "extracting", "F",
@@ -339,9 +367,17 @@ def submission_driver(metadata, sub_conf, source_id, access_token, user_id):
                                  .format(source_id, num_records))
                 utils.update_status(source_id, "extracting", "N", except_on_fail=True)
             else:
-                utils.update_status(source_id, "extracting", "M",
-                                    text=("{} metadata records extracted out of {} file groups"
-                                          .format(num_records, num_groups)), except_on_fail=True)
+                extract_text = ("{} metadata records extracted out of {} file groups"
+                                .format(num_records, num_groups))
+                if skipped_groups:
+                    reasons = sorted(set(group["reason"] for group in skipped_groups))
+                    extract_text += ("; {} groups could not be extracted ({})"
+                                     .format(len(skipped_groups), "; ".join(reasons)))
+                if extractor_stats:
+                    extract_text += ("; extractor time: {}"
+                                     .format(summarize_extractor_stats(extractor_stats)))
+                utils.update_status(source_id, "extracting", "M", text=extract_text,
+                                    except_on_fail=True)
             logger.debug("{}: {} entries extracted".format(source_id, num_records+1))
 
         # NOTE: Cancellation point
@@ -357,16 +393,11 @@ def submission_driver(metadata, sub_conf, source_id, access_token, user_id):
         if sub_conf.get("curation"):
             utils.update_status(source_id, "curation", "P", except_on_fail=True)
             # Create curation task in curation table
-            with open(feedstock_file) as f:
-                # Discard dataset entry
-                f.readline()
-                # Save first few records
-                # Append the json-loaded form of records
-                # The number of records should be at most the default number,
-                # and less if less are present
-                curation_records = []
-                [curation_records.append(json.loads(f.readline()))
-                 for i in range(min(CONFIG["NUM_CURATION_RECORDS"], num_records))]
+            # Save first few records (skipping the dataset entry, entry 0)
+            # The number of records should be at most the default number,
+            # and less if less are present
+            curation_records = list(utils.read_feedstock(feedstock_file, start=1,
+                                                         stop=1 + CONFIG["NUM_CURATION_RECORDS"]))
             curation_dataset = deepcopy(dataset)
             # Numbers can be extracted into Decimal by DynamoDB, which causes JSON errors
             curation_dataset["mdf"].pop("scroll_id", None)
@@ -518,7 +549,7 @@ def submission_driver(metadata, sub_conf, source_id, access_token, user_id):
             return
 
         utils.update_status(source_id, "ingest_search", "S", except_on_fail=True)
-        os.remove(feedstock_file)
+        utils.remove_feedstock(feedstock_file)
         service_res["mdf_search"] = "This dataset was ingested to MDF Search."
 
     # Move files to data_destinations
@@ -1,20 +1,21 @@
-from ctypes import c_bool
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
 import json
 import logging
-import multiprocessing
 import os
-from queue import Empty
+import re
 
 import mdf_toolbox
 
 from mdf_connect_server import CONFIG
-from mdf_connect_server.processor import run_extractors, Validator
+from mdf_connect_server.processor import ExtractorPool, Validator
+from mdf_connect_server.processor.extractors import estimate_group_cost
 
 
 logger = logging.getLogger(__name__)
 
 
-def start_extractors(root_path, extract_params):
+def start_extractors(root_path, extract_params, extractor_pool=None):
     """Extract files under the root path into feedstock.
 
     Arguments:
@@ -23,9 +24,11 @@ def start_extractors(root_path, extract_params):
         dataset (dict): The dataset associated with the files.
         extractor (dict): Extractor-specific parameters, keyed by extractor (ex. "json": {...}).
         service_data (str): The path to a directory to store integration data.
-        feedstock_file (str): Path to output feedstock to.
+        feedstock_file (str): Path to output feedstock to (see utils.FeedstockWriter).
         group_config (dict): Grouping configuration.
         validation_info (dict): Validator configuration. Default None.
+    extractor_pool (ExtractorPoolHandle): The submission's handle on the processor's
+            extractor pool. Default None, to start a private pool for this extraction.
 
     Returns:
     dict: The results.
@@ -34,10 +37,17 @@ def start_extractors(root_path, extract_params):
         dataset (dict): If success is True, the dataset entry.
         num_records (int): If success is True, the number of records extracted.
         num_groups (int): If success is True, the number of extracted groups.
+        skipped_groups (list of dict): If success is True, the groups that could not be
+                extracted (timed out, over the memory limit, or crashed the extractor),
+                as {"files": list of str, "reason": str}.
+        extractor_stats (dict): If success is True, the counters for each extractor run
+                (calls, successes, exceptions, time_ms, bytes_read, records).
         extensions (list of str): If success is True, all unique file extensions in the dataset.
     """
     source_id = extract_params.get("dataset", {}).get("mdf", {}).get("source_id", "unknown")
-    vald = Validator(schema_path=CONFIG["SCHEMA_PATH"])
+    # Records are streamed straight into the feedstock file
+    vald = Validator(schema_path=CONFIG["SCHEMA_PATH"],
+                     feedstock_file=extract_params["feedstock_file"])
 
     # Process dataset entry (to fail validation early if dataset entry is invalid)
     full_dataset = extract_params["dataset"]
@@ -67,146 +77,304 @@ def start_extractors(root_path, extract_params):
     if not ds_res["success"]:
         return ds_res
 
-    # Set up multiprocessing
-    input_queue = multiprocessing.Queue()
-    output_queue = multiprocessing.Queue()
-    input_complete = multiprocessing.Value(c_bool, False)
-
-    # Start up extractors
-    extractors = [multiprocessing.Process(target=run_extractors,
-                                          args=(input_queue, output_queue,
-                                                input_complete, extract_params))
-                  for i in range(CONFIG["NUM_EXTRACTORS"])]
-    [t.start() for t in extractors]
-    logger.debug("{}: Extractors started".format(source_id))
-
-    # Populate input queue
-    num_groups = 0
-    extensions = set()
-    for group_info in group_tree(root_path, extract_params["group_config"]):
-        input_queue.put(group_info)
-        num_groups += 1
-        for f in group_info["files"]:
-            filename, ext = os.path.splitext(f)
-            extensions.add(ext or filename)
-    # Mark that input is finished
-    input_complete.value = True
-    logger.debug("{}: Input complete".format(source_id))
-
-    # Create complete feedstock
-    while True:
+    # Use the processor's shared extractor pool, or start a private pool
+    private_pool = None
+    if extractor_pool is None:
+        private_pool = ExtractorPool()
+        private_pool.start()
+        extractor_pool = private_pool.open(source_id)
+    try:
+        extractor_pool.begin(extract_params)
+        logger.debug("{}: Extraction started".format(source_id))
+
+        # Queue groups for extraction, with their estimated cost
+        # (the pool dispatches each submission's most expensive groups first)
+        num_groups = 0
+        extensions = set()
         try:
-            record = output_queue.get(timeout=1)
-            rc_res = vald.add_record(json.loads(record))
-            # If one record fails, entire feedstock fails
-            # So if a failure occurs, terminate all extractors and return
-            if not rc_res["success"]:
-                logger.info("{}: Record error - terminating extractors".format(source_id))
-                # TODO: Use t.kill() (Py3.7-only)
-                [t.terminate() for t in extractors]
-                # [t.kill() for t in extractors]
-                [t.join() for t in extractors]
-                logger.debug("{}: Extractors terminated".format(source_id))
-
-                return rc_res
-
-        except Empty:
-            if any([t.is_alive() for t in extractors]):
-                [t.join(timeout=1) for t in extractors]
-            else:
-                logger.debug("{}: Extractors joined".format(source_id))
-                break
+            for group_info in group_tree(root_path, extract_params["group_config"]):
+                group_info["cost"] = estimate_group_cost(group_info, extract_params)
+                extractor_pool.add_group(group_info)
+                num_groups += 1
+                for f in group_info["files"]:
+                    filename, ext = os.path.splitext(f)
+                    extensions.add(ext or filename)
+        except BaseException:
+            extractor_pool.cancel()
+            raise
+        # Mark that input is finished
+        extractor_pool.end_input()
+        logger.debug("{}: Input complete".format(source_id))
 
-    # Output feedstock
-    os.makedirs(os.path.dirname(extract_params["feedstock_file"]), exist_ok=True)
-    with open(extract_params["feedstock_file"], 'w') as out:
-        feedstock_generator = vald.get_finished_dataset()
-        # First entry is dataset
-        dataset = next(feedstock_generator)
-        json.dump(dataset, out)
-        out.write("\n")
-        # Subsequent entries are records
+        # Create complete feedstock
+        # Records are validated by the extractors, and given scroll_ids here
+        rc_res = {"success": True}
         num_records = 0
-        for record in feedstock_generator:
-            json.dump(record, out)
-            out.write("\n")
+        for record in extractor_pool.results():
+            rc_res = vald.add_validated_record(record)
+            if not rc_res["success"]:
+                break
             num_records += 1
+        if extractor_pool.error:
+            rc_res = extractor_pool.error
+        # If one record fails, entire feedstock fails
+        # So if a failure occurs, cancel the remaining groups and return
+        if not rc_res["success"]:
+            logger.info("{}: Record error - cancelling extraction".format(source_id))
+            extractor_pool.cancel()
+            vald.discard_dataset()
+            return rc_res
+        for skipped in extractor_pool.skipped:
+            logger.warning("{}: Group skipped ({}): {}"
+                           .format(source_id, skipped["reason"], skipped["files"]))
+        stats = extractor_pool.stats
+        logger.info("{}: Dispatch plan skipped {} of {} extractor invocations"
+                    .format(source_id, stats.get("skipped", 0), stats.get("invocations", 0)))
+        logger.info("{}: Extractor time: {}"
+                    .format(source_id, summarize_extractor_stats(stats.get("extractors", {}))))
+        logger.info("{}: Extraction cache: {} hits, {} misses".format(
+                        source_id,
+                        sum(c["cache_hits"] for c in stats.get("extractors", {}).values()),
+                        sum(c["cache_misses"] for c in stats.get("extractors", {}).values())))
+        logger.debug("{}: Extraction finished".format(source_id))
+    except BaseException:
+        vald.discard_dataset()
+        raise
+    finally:
+        if private_pool is not None:
+            private_pool.shutdown()
+
+    # Finish feedstock
+    # The records are already written, only the dataset entry is needed
+    feedstock_generator = vald.get_finished_dataset()
+    dataset = next(feedstock_generator)
+    feedstock_generator.close()
 
     return {
         "success": True,
         "dataset": dataset,
         "num_records": num_records,
         "num_groups": num_groups,
+        "skipped_groups": extractor_pool.skipped,
+        "extractor_stats": stats.get("extractors", {}),
         "extensions": list(extensions)
     }
 
 
-def group_tree(root, config):
-    """Run group_files on files in tree appropriately."""
+def summarize_extractor_stats(extractor_stats, num_extractors=3):
+    """Summarize the extractors that took the most time.
+
+    Arguments:
+    extractor_stats (dict): The counters, keyed by extractor (see extract_group()).
+    num_extractors (int): The number of extractors to list. Default 3.
+
+    Returns:
+    str: The summary.
+    """
+    slowest = sorted(extractor_stats.items(), key=lambda item: item[1]["time_ms"], reverse=True)
+    return ", ".join("{} {:.1f}s ({} calls, {} failed, {} records)"
+                     .format(name, counters["time_ms"] / 1000, counters["calls"],
+                             counters["exceptions"], counters["records"])
+                     for name, counters in slowest[:num_extractors]) or "no extractors run"
+
+
+def group_tree(root, config, num_walkers=None):
+    """Walk the tree under the root and group the files found, yielding groups as they are made.
+    Subdirectories are scanned in parallel, so extraction can begin on the first directory
+    while the rest of the tree is still being walked.
+
+    Arguments:
+    root (str): The path to the root of the tree.
+    config (dict): The grouping configuration. Updated by any mdf.json files in the tree,
+            for the directory containing the mdf.json and all its subdirectories.
+    num_walkers (int): The number of directories to scan in parallel.
+            Default CONFIG["NUM_WALKERS"].
+
+    Yields:
+    dict: The group information.
+        files (list of str): The paths to the files in the group.
+        sizes (list of int): The sizes of the files, in bytes.
+        extractors (list of str): The extractors to use on the group.
+        params (dict): Extractor parameters for the group.
+    """
+    if root == "/dev/null":
+        return
+    if num_walkers is None:
+        num_walkers = CONFIG["NUM_WALKERS"]
+
+    with ThreadPoolExecutor(max_workers=num_walkers) as pool:
+        pending = {pool.submit(_scan_dir, root, config)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, dirs, dir_config = future.result()
+                # Queue subdirectories before grouping, to keep the walkers busy
+                for dir_path in dirs:
+                    pending.add(pool.submit(_scan_dir, dir_path, dir_config))
+                sizes = {file_path: file_stat.st_size for file_path, file_stat in files}
+                for group_info in group_files([f[0] for f in files], dir_config):
+                    group_info["sizes"] = [sizes[file_path] for file_path in group_info["files"]]
+                    yield group_info
+
+
+def _scan_dir(dir_path, config):
+    """Scan one directory, without descending into subdirectories.
+
+    Arguments:
+    dir_path (str): The path to the directory.
+    config (dict): The grouping configuration of the parent directory.
+
+    Returns:
+    tuple: The results.
+        list of tuple: The (path, os.stat_result) of each file in the directory.
+        list of str: The paths to the subdirectories.
+        dict: The grouping configuration for this directory.
+    """
     files = []
     dirs = []
-    if root == "/dev/null":
-        return []
-    for node in os.listdir(root):
-        node_path = os.path.join(root, node)
-        if node == "mdf.json":
-            with open(node_path) as f:
-                try:
-                    new_config = json.load(f)
-                    logger.debug("Config updating: \n{}".format(new_config))
-                except Exception as e:
-                    logger.warning("Error reading config file '{}': {}".format(node_path, str(e)))
-                else:
-                    config = mdf_toolbox.dict_merge(new_config, config)
-        elif os.path.isfile(node_path):
-            files.append(node_path)
-        elif os.path.isdir(node_path):
-            dirs.append(node_path)
-        else:
-            logger.debug("Ignoring non-file, non-dir node '{}'".format(node_path))
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry.name == "mdf.json":
+                with open(entry.path) as f:
+                    try:
+                        new_config = json.load(f)
+                        logger.debug("Config updating: \n{}".format(new_config))
+                    except Exception as e:
+                        logger.warning("Error reading config file '{}': {}"
+                                       .format(entry.path, str(e)))
+                    else:
+                        config = mdf_toolbox.dict_merge(new_config, config)
+            elif entry.is_file():
+                files.append((entry.path, entry.stat()))
+            elif entry.is_dir():
+                dirs.append(entry.path)
+            else:
+                logger.debug("Ignoring non-file, non-dir node '{}'".format(entry.path))
+    return files, dirs, config
+
+
+def group_files(files, config):
+    """Group the files in a single directory.
 
-    # Group the files
+    Arguments:
+    files (list of str): The paths to the files.
+    config (dict): The grouping configuration for the directory.
+
+    Returns:
+    list of dict: The groups, each containing the file list and extractor information.
+    """
     # list "groups" is list of dict, each dict contains actual file list + extractor info/config
     groups = []
     # Group by dir overrides other grouping
     if config.get("group_by_dir"):
-        groups.append({"files": files,
+        groups.append({"files": list(files),
                        "extractors": [],
                        "params": {}})
-    else:
-        for format_rules in config.get("known_formats", {}).values():
-            format_name_list = format_rules["files"]
-            format_groups = {}
-            # Check each file for rule matching
+        return groups
+
+    known_formats = list(config.get("known_formats", {}).values())
+    matcher = get_format_matcher(tuple(tuple(format_rules["files"])
+                                       for format_rules in known_formats))
+    # One dict of groups per format, keyed by pre/post pattern
+    format_groups = [{} for format_rules in known_formats]
+    ungrouped = []
+    for f in files:
+        fname = os.path.basename(f).lower().strip()
+        match = matcher.match(fname)
+        if match is None:
+            ungrouped.append(f)
+        else:
             # Match to appropriate group (with same pre/post pattern)
             #   eg a_[match]_b groups with a_[other match]_b but not c_[other match]_d
-            for f in files:
-                fname = os.path.basename(f).lower().strip()
-                for format_name in format_name_list:
-                    if format_name in fname:
-                        pre_post_pattern = fname.replace(format_name, "")
-                        if not format_groups.get(pre_post_pattern):
-                            format_groups[pre_post_pattern] = []
-                        format_groups[pre_post_pattern].append(f)
-                        break
-            # Remove grouped files from the file list and add groups to the group list
-            for g in format_groups.values():
-                for f in g:
-                    files.remove(f)
-                group_info = {
-                    "files": g,
-                    "extractors": format_rules["extractors"],
-                    "params": format_rules["params"]
-                }
-                groups.append(group_info)
-
-        # NOTE: Keep this grouping last!
-        # Default grouping: Each file is a group
-        groups.extend([{"files": [f],
-                        "extractors": [],
-                        "params": {}}
-                       for f in files])
-
-    [groups.extend(group_tree(d, config)) for d in dirs]
+            format_index, format_name = match
+            pre_post_pattern = fname.replace(format_name, "")
+            format_groups[format_index].setdefault(pre_post_pattern, []).append(f)
+
+    for format_rules, fmt_groups in zip(known_formats, format_groups):
+        for g in fmt_groups.values():
+            groups.append({
+                "files": g,
+                "extractors": format_rules["extractors"],
+                "params": format_rules["params"]
+            })
+    # NOTE: Keep this grouping last!
+    # Default grouping: Each file is a group
+    groups.extend([{"files": [f],
+                    "extractors": [],
+                    "params": {}}
+                   for f in ungrouped])
 
     return groups
+
+
+class FormatMatcher:
+    """Matches filenames against every known format's patterns in one pass.
+
+    A filename belongs to the first format (in configuration order) with any pattern
+    that is a substring of the filename, and within that format to the first matching pattern.
+    All patterns are compiled into one regular expression, which reports the longest pattern
+    starting at each position of the filename. Every shorter pattern starting at the same position
+    is a prefix of that pattern, so the best-ranked match among a pattern and its prefixes
+    is precomputed.
+    """
+    def __init__(self, format_patterns):
+        """Compile the patterns.
+
+        Arguments:
+        format_patterns (tuple of tuple of str): The filename patterns of each format,
+                in configuration order.
+        """
+        # Best (format index, pattern index) for each unique pattern
+        ranks = {}
+        for format_index, patterns in enumerate(format_patterns):
+            for pattern_index, pattern in enumerate(patterns):
+                ranks.setdefault(pattern, (format_index, pattern_index))
+        # Best-ranked pattern among each pattern and its prefixes
+        self.__best = {}
+        for pattern in ranks.keys():
+            prefixes = [p for p in ranks.keys() if pattern.startswith(p)]
+            best = min(prefixes, key=lambda p: ranks[p])
+            self.__best[pattern] = (ranks[best], best)
+        if ranks:
+            # Longest first, so the alternation finds the longest pattern at each position
+            alternation = "|".join(re.escape(p) for p in sorted(ranks.keys(), key=len,
+                                                                reverse=True))
+            self.__regex = re.compile("(?=({}))".format(alternation))
+        else:
+            self.__regex = None
+
+    def match(self, fname):
+        """Find the format a filename belongs to.
+
+        Arguments:
+        fname (str): The normalized (lowercase, stripped) filename.
+
+        Returns:
+        tuple: The (format index, matched pattern), or None if no format matches.
+        """
+        if self.__regex is None:
+            return None
+        best = None
+        for match in self.__regex.finditer(fname):
+            candidate = self.__best[match.group(1)]
+            if best is None or candidate[0] < best[0]:
+                best = candidate
+        if best is None:
+            return None
+        return best[0][0], best[1]
+
+
+@lru_cache(maxsize=128)
+def get_format_matcher(format_patterns):
+    """Fetch the FormatMatcher for a set of known formats.
+    Matchers are cached, so each distinct configuration (including mdf.json overrides)
+    is compiled only once.
+
+    Arguments:
+    format_patterns (tuple of tuple of str): The filename patterns of each format,
+            in configuration order.
+
+    Returns:
+    FormatMatcher: The matcher.
+    """
+    return FormatMatcher(format_patterns)
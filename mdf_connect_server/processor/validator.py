@@ -1,13 +1,57 @@
 from datetime import datetime
+from functools import lru_cache
 import json
-import os
+import math
+import re
 from tempfile import TemporaryFile
 
 import jsonschema
 
+from mdf_connect_server.feedstock import FeedstockWriter, read_feedstock
+from mdf_connect_server.schema_registry import validate_schema
+
+
+ELEMENT_SYMBOLS = frozenset([
+    "H", "He", "Li", "Be", "B", "C", "N", "O", "F", "Ne", "Na", "Mg", "Al", "Si", "P", "S",
+    "Cl", "Ar", "K", "Ca", "Sc", "Ti", "V", "Cr", "Mn", "Fe", "Co", "Ni", "Cu", "Zn", "Ga",
+    "Ge", "As", "Se", "Br", "Kr", "Rb", "Sr", "Y", "Zr", "Nb", "Mo", "Tc", "Ru", "Rh", "Pd",
+    "Ag", "Cd", "In", "Sn", "Sb", "Te", "I", "Xe", "Cs", "Ba", "La", "Ce", "Pr", "Nd", "Pm",
+    "Sm", "Eu", "Gd", "Tb", "Dy", "Ho", "Er", "Tm", "Yb", "Lu", "Hf", "Ta", "W", "Re", "Os",
+    "Ir", "Pt", "Au", "Hg", "Tl", "Pb", "Bi", "Po", "At", "Rn", "Fr", "Ra", "Ac", "Th", "Pa",
+    "U", "Np", "Pu", "Am", "Cm", "Bk", "Cf", "Es", "Fm", "Md", "No", "Lr", "Rf", "Db", "Sg",
+    "Bh", "Hs", "Mt", "Ds", "Rg", "Cn", "Nh", "Fl", "Mc", "Lv", "Ts", "Og"
+])
+# An element symbol starts with a capital letter, and anything else
+# (numbers, whitespace, punctuation, lowercase words like "and") is not an element
+ELEMENT_REGEX = re.compile("[A-Z][a-z]*")
+
+
+@lru_cache(maxsize=4096)
+def _parse_elements(composition):
+    """Find the elements in a composition.
+    Results are cached, as datasets repeat the same compositions across many records.
+
+    Arguments:
+    composition (str): The composition (chemical formula).
+
+    Returns:
+    tuple of str: The unique element symbols, sorted. None if any symbol is not in the
+            periodic table, as the composition is likely not a chemical formula.
+    """
+    symbols = set(ELEMENT_REGEX.findall(composition))
+    if not symbols.issubset(ELEMENT_SYMBOLS):
+        return None
+    return tuple(sorted(symbols))
+
 
 def _remove_nulls(data, skip=None):
-    """Remove all null/None/empty values from a dict or list, except those listed in skip."""
+    """Remove all null/None values from a dict or list, except those listed in skip.
+    Also rejects values that are not strict JSON (NaN and Infinity),
+    and turns tuples into lists, in the same pass.
+
+    Raises:
+    ValueError: If a float value is NaN or infinite.
+    """
     if isinstance(data, dict):
         new_dict = {}
         for key, val in data.items():
@@ -15,13 +59,15 @@ def _remove_nulls(data, skip=None):
             if new_val is not None or (skip is not None and key in skip):
                 new_dict[key] = new_val
         return new_dict
-    elif isinstance(data, list):
+    elif isinstance(data, (list, tuple)):
         new_list = []
         for val in data:
             new_val = _remove_nulls(val, skip=skip)
             if new_val is not None:
                 new_list.append(new_val)
         return new_list
+    elif isinstance(data, float) and not math.isfinite(data):
+        raise ValueError("Out of range float values are not JSON compliant: {}".format(data))
     # Could delete required but empty blocks - services, etc.
     # elif hasattr(data, "__len__") and len(data) <= 0:
     #    return None
@@ -29,6 +75,34 @@ def _remove_nulls(data, skip=None):
         return data
 
 
+def _normalize(md, skip=None):
+    """Normalize a dataset or record entry in one pass:
+    make all custom block values into strings, and remove null/None values
+    and reject NaN and Infinity everywhere else (see _remove_nulls()).
+
+    Arguments:
+    md (dict): The entry to normalize.
+    skip (list of str): The keys to keep null values for.
+
+    Returns:
+    dict: The normalized copy of the entry.
+
+    Raises:
+    ValueError: If a value outside the custom block is NaN or infinite.
+    """
+    new_md = {}
+    for key, val in md.items():
+        # BLOCK: custom
+        # Make all values into strings
+        if key == "custom" and val:
+            new_val = {custom_key: str(custom_val) for custom_key, custom_val in val.items()}
+        else:
+            new_val = _remove_nulls(val, skip=skip)
+        if new_val is not None or (skip is not None and key in skip):
+            new_md[key] = new_val
+    return new_md
+
+
 class Validator:
     """Validates MDF feedstock.
 
@@ -40,12 +114,18 @@ class Validator:
             (success check)
         gen = get_finished_dataset()
     """
-    def __init__(self, schema_path):
+    def __init__(self, schema_path, feedstock_file=None):
+        """Arguments:
+        schema_path (str): The path to the MDF schemas.
+        feedstock_file (str): If supplied, records are streamed into this feedstock file
+                as they are added, and get_finished_dataset() completes the file.
+                Default None, to hold records in a temporary file.
+        """
         self.__dataset = None  # Serves as initialized flag
         self.__tempfile = None
+        self.__feedstock_file = feedstock_file
         self.__scroll_id = None
         self.__ingest_date = datetime.utcnow().isoformat("T") + "Z"
-        self.__indexed_files = []
         self.__finished = None  # Flag - has user called get_finished_dataset() for this dataset?
         self.__schema_dir = schema_path
 
@@ -76,12 +156,6 @@ class Validator:
         self.__allowed_nulls = validation_info.get("allowed_nulls", None)
         self.__base_acl = validation_info.get("base_acl", None)
 
-        # Load schema
-        with open(os.path.join(self.__schema_dir, "dataset.json")) as schema_file:
-            schema = json.load(schema_file)
-        resolver = jsonschema.RefResolver(base_uri="file://{}/".format(self.__schema_dir),
-                                          referrer=schema)
-
 #        if not ds_md.get("dc") or not isinstance(ds_md["dc"], dict):
 #            ds_md["dc"] = {}
         if not ds_md.get("mdf") or not isinstance(ds_md["mdf"], dict):
@@ -126,30 +200,19 @@ class Validator:
         ds_md["data"] = ds_md.get("data", {})
         ds_md["data"]["total_size"] = 0
 
-        # BLOCK: custom
-        # Make all values into strings
-        if ds_md.get("custom"):
-            new_custom = {}
-            for key, val in ds_md["custom"].items():
-                new_custom[key] = str(val)
-            ds_md["custom"] = new_custom
-
-        # Require strict JSON
+        # Stringify custom values, require strict JSON, and remove null/None values
         try:
-            json.dumps(ds_md, allow_nan=False)
-        except (ValueError, json.JSONDecodeError) as e:
+            ds_md = _normalize(ds_md, self.__allowed_nulls)
+        except ValueError as e:
             return {
                 "success": False,
                 "error": "Invalid dataset JSON: {}".format(str(e)),
                 "details": repr(e)
             }
 
-        # Remove null/None values
-        ds_md = _remove_nulls(ds_md, self.__allowed_nulls)
-
         # Validate against schema
         try:
-            jsonschema.validate(ds_md, schema, resolver=resolver)
+            validate_schema(ds_md, "dataset", self.__schema_dir)
         except jsonschema.ValidationError as e:
             return {
                 "success": False,
@@ -209,8 +272,11 @@ class Validator:
                                 .format(self.__required_fields, missing))
                 }
 
-        # Create temporary file for records
-        self.__tempfile = TemporaryFile(mode="w+")
+        # Create feedstock or temporary file for records
+        if self.__feedstock_file:
+            self.__tempfile = FeedstockWriter(self.__feedstock_file)
+        else:
+            self.__tempfile = TemporaryFile(mode="w+")
 
         # Save dataset metadata
         # Also ensure metadata is JSON-serializable
@@ -221,8 +287,30 @@ class Validator:
             "success": True
             }
 
+    def start_records(self, ds_md, validation_info=None):
+        """Set up to validate records for a dataset already started with start_dataset(),
+        possibly by another Validator (ex. in another process).
+        This Validator can only validate_record(); the Validator that started the dataset
+        must add_validated_record() the results.
+
+        Arguments:
+        ds_md (dict): The dataset metadata, as modified by start_dataset().
+        validation_info (dict): The same additional validation configuration.
+        """
+        if validation_info is None:
+            validation_info = {}
+        self.__project_blocks = validation_info.get("project_blocks", None)
+        self.__required_fields = validation_info.get("required_fields", None)
+        self.__allowed_nulls = validation_info.get("allowed_nulls", None)
+        self.__base_acl = validation_info.get("base_acl", None)
+        self.__dataset = ds_md
+        self.__ingest_date = ds_md["mdf"]["ingest_date"]
+        # Provisional, the dataset's Validator assigns the real scroll_id
+        self.__scroll_id = 1
+        self.__finished = False
+
     def add_record(self, rc_md):
-        """Validate a record against the MDF schema.
+        """Validate a record against the MDF schema, and add it to the dataset.
 
         Arguments:
         rc_md (dict): The record metadata to validate.
@@ -233,6 +321,30 @@ class Validator:
               error (str): A short message about the error.
               details (str): The full jsonschema error message.
         """
+        val_res = self.validate_record(rc_md)
+        if not val_res["success"]:
+            # Invalid records still use up a scroll_id
+            if self.__dataset and not self.__finished:
+                self.__scroll_id += 1
+            return val_res
+        return self.add_validated_record(val_res["record"])
+
+    def validate_record(self, rc_md):
+        """Normalize a record and validate it against the MDF schema,
+        without adding it to the dataset.
+        The record is given a provisional scroll_id.
+
+        Arguments:
+        rc_md (dict): The record metadata to validate.
+
+        Returns:
+        dict: success (bool): True on success, False on failure
+            If success is True:
+              record (dict): The normalized record, for add_validated_record().
+            If success is False:
+              error (str): A short message about the error.
+              details (str): The full jsonschema error message.
+        """
         if self.__finished:
             return {
                 "success": False,
@@ -245,12 +357,6 @@ class Validator:
                 "error": "Dataset not started."
                 }
 
-        # Load schema
-        with open(os.path.join(self.__schema_dir, "record.json")) as schema_file:
-            schema = json.load(schema_file)
-        resolver = jsonschema.RefResolver(base_uri="file://{}/".format(self.__schema_dir),
-                                          referrer=schema)
-
         # Add any missing blocks
         if not rc_md.get("mdf"):
             rc_md["mdf"] = {}
@@ -269,9 +375,8 @@ class Validator:
         # source_name
         rc_md["mdf"]["source_name"] = self.__dataset["mdf"]["source_name"]
 
-        # scroll_id
+        # scroll_id (provisional, set again in add_validated_record())
         rc_md["mdf"]["scroll_id"] = self.__scroll_id
-        self.__scroll_id += 1
 
         # ingest_date
         rc_md["mdf"]["ingest_date"] = self.__ingest_date
@@ -290,68 +395,30 @@ class Validator:
         if self.__dataset["mdf"].get("organizations"):
             rc_md["mdf"]["organizations"] = self.__dataset["mdf"]["organizations"]
 
-        # BLOCK: files
-        # Add file data to dataset
-        if rc_md["files"]:
-            self.__indexed_files += rc_md["files"]
-            for f in rc_md["files"]:
-                self.__dataset["data"]["total_size"] += f.get("length", 0)
-
         # BLOCK: material
         # elements
         if rc_md["material"].get("composition"):
-            composition = rc_md["material"]["composition"].replace("and", "")
-            # Currently deprecated
-#                for element in DICT_OF_ALL_ELEMENTS.keys():
-#                    composition = re.sub("(?i)"+element,
-#                                         DICT_OF_ALL_ELEMENTS[element], composition)
-            str_of_elem = ""
-            for char in list(composition):
-                if char.isupper():  # Start of new element symbol
-                    str_of_elem += " " + char
-                elif char.islower():  # Continuation of symbol
-                    str_of_elem += char
-                # Anything else is not an element (numbers, whitespace, etc.)
-
-            # Split elements in string (on whitespace), make unique and JSON-serializable
-            list_of_elem = list(set(str_of_elem.split()))
-            # Ensure deterministic results
-            list_of_elem.sort()
-            # Currently deprecated
-            # If any "element" isn't in the periodic table,
-            # the composition is likely not a chemical formula and should not be processed
-#                if all([elem in DICT_OF_ALL_ELEMENTS.values() for elem in list_of_elem]):
-#                    record["elements"] = list_of_elem
-
-            rc_md["material"]["elements"] = list_of_elem
+            elements = _parse_elements(str(rc_md["material"]["composition"]))
+            # If the composition is not a chemical formula, it should not be processed
+            if elements is not None:
+                rc_md["material"]["elements"] = list(elements)
         elif rc_md["material"].get("elemental_proportions"):
-            rc_md["material"]["elements"] = [rc_md["material"]["elemental_proportions"].keys()]
-            rc_md["material"]["elements"].sort()
-
-        # BLOCK: custom
-        # Make all values into strings
-        if rc_md.get("custom"):
-            new_custom = {}
-            for key, val in rc_md["custom"].items():
-                new_custom[key] = str(val)
-            rc_md["custom"] = new_custom
+            # Ensure deterministic results
+            rc_md["material"]["elements"] = sorted(rc_md["material"]["elemental_proportions"])
 
-        # Require strict JSON
+        # Stringify custom values, require strict JSON, and remove null/None values
         try:
-            json.dumps(rc_md, allow_nan=False)
-        except (ValueError, json.JSONDecodeError) as e:
+            rc_md = _normalize(rc_md, self.__allowed_nulls)
+        except ValueError as e:
             return {
                 "success": False,
                 "error": "Invalid record JSON: {}".format(str(e)),
                 "details": repr(e)
                 }
 
-        # Remove null/None values
-        rc_md = _remove_nulls(rc_md, self.__allowed_nulls)
-
         # Validate against schema
         try:
-            jsonschema.validate(rc_md, schema, resolver=resolver)
+            validate_schema(rc_md, "record", self.__schema_dir)
         except jsonschema.ValidationError as e:
             return {
                 "success": False,
@@ -359,9 +426,52 @@ class Validator:
                 "details": str(e)
                 }
 
+        # Return results
+        return {
+            "success": True,
+            "record": rc_md
+            }
+
+    def add_validated_record(self, rc_md):
+        """Add a record from validate_record() to the dataset.
+        Assigns the record's scroll_id, in the order records are added.
+
+        Arguments:
+        rc_md (dict): The normalized record.
+
+        Returns:
+        dict: success (bool): True on success, False on failure
+            If success is False:
+              error (str): A short message about the error.
+        """
+        if self.__finished:
+            return {
+                "success": False,
+                "error": ("Dataset has been finished by calling get_finished_dataset(),"
+                          " and no more records may be entered.")
+                }
+        elif not self.__tempfile:
+            return {
+                "success": False,
+                "error": "Dataset not started."
+                }
+
+        # scroll_id
+        rc_md["mdf"]["scroll_id"] = self.__scroll_id
+        self.__scroll_id += 1
+
+        # BLOCK: files
+        # Add file data to dataset
+        if rc_md.get("files"):
+            for f in rc_md["files"]:
+                self.__dataset["data"]["total_size"] += f.get("length", 0)
+
         # Write out to file
-        json.dump(rc_md, self.__tempfile)
-        self.__tempfile.write("\n")
+        if self.__feedstock_file:
+            self.__tempfile.write(rc_md)
+        else:
+            json.dump(rc_md, self.__tempfile)
+            self.__tempfile.write("\n")
 
         # Return results
         return {
@@ -369,23 +479,40 @@ class Validator:
             }
 
     def get_finished_dataset(self):
-        """Retrieve finished dataset, in a generator."""
+        """Retrieve finished dataset, in a generator.
+        With a feedstock_file, the file is complete once the first entry (the dataset)
+        has been retrieved, and the records are read back from it.
+        """
         if self.__dataset is None:
             raise ValueError("Dataset not started")
         elif self.__finished:
             raise ValueError("Dataset already finished")
 
-        self.__indexed_files = []
         self.__finished = True
 
-        self.__tempfile.seek(0)
-        yield self.__dataset
-        for line in self.__tempfile:
-            yield json.loads(line)
-
-        self.__tempfile.close()
+        if self.__feedstock_file:
+            self.__tempfile.close(self.__dataset)
+            records = read_feedstock(self.__feedstock_file, start=1)
+        else:
+            self.__tempfile.seek(0)
+            records = (json.loads(line) for line in self.__tempfile)
+        try:
+            yield self.__dataset
+            yield from records
+        finally:
+            if not self.__feedstock_file:
+                self.__tempfile.close()
+            self.__dataset = None
+
+    def discard_dataset(self):
+        """Abandon the dataset, removing any records written out."""
+        if self.__tempfile and not self.__finished:
+            if self.__feedstock_file:
+                self.__tempfile.discard()
+            else:
+                self.__tempfile.close()
+        self.__finished = True
         self.__dataset = None
-        return
 
     def status(self):
         if self.__finished:
@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+
+import jsonschema
+# referencing replaces jsonschema.RefResolver from jsonschema 4.18
+try:
+    import referencing
+    import referencing.jsonschema
+except ImportError:
+    referencing = None
+
+from mdf_connect_server import CONFIG
+
+
+# Loaded schema documents, keyed by schema directory, then by document URI
+# Documents are never modified after loading, so they are safe to share between threads
+_SCHEMA_STORES = {}
+# referencing.Registry of each schema directory's documents, which is immutable
+_REGISTRIES = {}
+_STORE_LOCK = threading.Lock()
+# Compiled validators, keyed by (schema directory, schema name)
+# jsonschema.RefResolver keeps a mutable scope stack, so each thread gets its own validators
+_LOCAL = threading.local()
+
+
+def _schema_uri(schema_dir, schema_name):
+    """Create the URI a schema file is referenced by."""
+    return "file://{}/{}".format(schema_dir, schema_name)
+
+
+def _load_schema_store(schema_dir):
+    """Load every schema document in a directory, once per process.
+
+    Arguments:
+    schema_dir (str): The directory holding the schema files.
+
+    Returns:
+    dict: The schema documents, keyed by URI.
+    """
+    store = _SCHEMA_STORES.get(schema_dir)
+    if store is not None:
+        return store
+    with _STORE_LOCK:
+        store = _SCHEMA_STORES.get(schema_dir)
+        if store is None:
+            store = {}
+            for schema_name in os.listdir(schema_dir):
+                if not schema_name.endswith(".json"):
+                    continue
+                with open(os.path.join(schema_dir, schema_name)) as schema_file:
+                    store[_schema_uri(schema_dir, schema_name)] = json.load(schema_file)
+            _SCHEMA_STORES[schema_dir] = store
+    return store
+
+
+def _specification(schema):
+    """Find the referencing Specification for a schema, by the draft jsonschema validates it with.
+    """
+    dialect = jsonschema.validators.validator_for(schema).META_SCHEMA["$schema"]
+    return referencing.jsonschema.specification_with(dialect)
+
+
+def _load_registry(schema_dir):
+    """Build the referencing Registry of every schema document in a directory,
+    once per process.
+
+    Arguments:
+    schema_dir (str): The directory holding the schema files.
+
+    Returns:
+    referencing.Registry: The schema documents, by URI.
+    """
+    registry = _REGISTRIES.get(schema_dir)
+    if registry is None:
+        store = _load_schema_store(schema_dir)
+        registry = referencing.Registry().with_resources(
+            (uri, referencing.Resource(contents=schema, specification=_specification(schema)))
+            for uri, schema in store.items())
+        _REGISTRIES[schema_dir] = registry
+    return registry
+
+
+def get_validator(schema_name, schema_dir=None):
+    """Fetch the compiled validator for a schema.
+    The schema is loaded, checked, and has its references resolved only the first time
+    it is requested; subsequent calls return the same validator.
+
+    Arguments:
+    schema_name (str): The schema to fetch (ex. "record" or "record.json").
+    schema_dir (str): The directory holding the schema files. Default CONFIG["SCHEMA_PATH"].
+
+    Returns:
+    jsonschema.IValidator: The validator for the schema.
+    """
+    if schema_dir is None:
+        schema_dir = CONFIG["SCHEMA_PATH"]
+    schema_dir = os.path.abspath(schema_dir)
+    if not schema_name.endswith(".json"):
+        schema_name += ".json"
+
+    validators = getattr(_LOCAL, "validators", None)
+    if validators is None:
+        validators = _LOCAL.validators = {}
+    validator = validators.get((schema_dir, schema_name))
+    if validator is None:
+        store = _load_schema_store(schema_dir)
+        try:
+            schema = store[_schema_uri(schema_dir, schema_name)]
+        except KeyError:
+            raise ValueError("Schema '{}' not found in '{}'".format(schema_name, schema_dir))
+        validator_class = jsonschema.validators.validator_for(schema)
+        validator_class.check_schema(schema)
+        if referencing is not None:
+            # Relative references resolve against the schema's URI, given as its ID
+            old_drafts = (referencing.jsonschema.DRAFT3, referencing.jsonschema.DRAFT4)
+            id_key = "id" if _specification(schema) in old_drafts else "$id"
+            validator = validator_class(
+                dict(schema, **{id_key: _schema_uri(schema_dir, schema_name)}),
+                registry=_load_registry(schema_dir))
+        else:
+            resolver = jsonschema.RefResolver(base_uri="file://{}/".format(schema_dir),
+                                              referrer=schema, store=store)
+            validator = validator_class(schema, resolver=resolver)
+        validators[(schema_dir, schema_name)] = validator
+    return validator
+
+
+def validate_schema(instance, schema_name, schema_dir=None):
+    """Validate a document against a schema, using the compiled validator.
+    Drop-in replacement for jsonschema.validate().
+
+    Arguments:
+    instance (dict): The document to validate.
+    schema_name (str): The schema to validate against (ex. "record" or "record.json").
+    schema_dir (str): The directory holding the schema files. Default CONFIG["SCHEMA_PATH"].
+
+    Raises:
+    jsonschema.ValidationError: When the document is invalid.
+    """
+    error = jsonschema.exceptions.best_match(
+                get_validator(schema_name, schema_dir).iter_errors(instance))
+    if error is not None:
+        raise error
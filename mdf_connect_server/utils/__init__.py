@@ -3,6 +3,11 @@
 #       Also the * import, which is the least painful way to have all those imports
 from .search_ingester import (search_ingest, submit_ingests,
                               update_search_entries, update_search_subjects)
+# Feedstock and schemas live outside utils, so extractor workers can use them
+# without importing the submission dependencies
+from mdf_connect_server.schema_registry import get_validator, validate_schema
+from mdf_connect_server.feedstock import (FeedstockWriter, feedstock_shards, read_feedstock,
+                                         remove_feedstock)
 # TODO (XTH): Clean up utils imports
 from .utils import (clean_start, download_data, backup_data, lookup_http_host, get_dc_creds,
                     make_dc_doi, translate_dc_schema, datacite_mint_doi, datacite_update_doi,
@@ -8,6 +8,7 @@ from tempfile import NamedTemporaryFile
 import mdf_toolbox
 
 from mdf_connect_server import CONFIG
+from mdf_connect_server.feedstock import feedstock_shards, read_feedstock
 from .api_utils import perform_search_task, split_source_id
 
 
@@ -15,11 +16,13 @@ logger = logging.getLogger(__name__)
 
 
 def search_ingest(feedstock_file, index, delete_existing, source_id=None, batch_size=100,
-                  num_submitters=CONFIG["NUM_SUBMITTERS"]):
+                  num_submitters=CONFIG["NUM_SUBMITTERS"],
+                  num_populators=CONFIG["NUM_POPULATORS"]):
     """Ingests feedstock from file.
 
     Arguments:
-        feedstock_file (str): The feedstock file to ingest.
+        feedstock_file (str): The feedstock file to ingest, compressed with an index
+                or plain JSON Lines.
         index (str): The Search index to ingest into.
         delete_existing (bool): If True, will delete existing Search entries with the
                 given source_name before ingesting the new entries.
@@ -29,6 +32,9 @@ def search_ingest(feedstock_file, index, delete_existing, source_id=None, batch_
         batch_size (int): Max size of a single ingest operation. -1 for unlimited.
                 Default 100.
         num_submitters (int): The number of submission processes to create. Default NUM_SUBMITTERS.
+        num_populators (int): The number of processes to read the feedstock with, each reading
+                one shard of it. Plain JSON Lines feedstock is read by one process.
+                Default NUM_POPULATORS.
 
     Returns:
         dict:
@@ -77,23 +83,25 @@ def search_ingest(feedstock_file, index, delete_existing, source_id=None, batch_
                                           args=(ingest_queue, error_queue,
                                                 index, input_done, source_id))
                   for i in range(num_submitters)]
-    # Create queue populator
-    populator = multiprocessing.Process(target=populate_queue,
-                                        args=(ingest_queue, feedstock_file, batch_size, source_id))
+    # Create queue populators, one per shard of the feedstock
+    populators = [multiprocessing.Process(target=populate_queue,
+                                          args=(ingest_queue, feedstock_file, batch_size,
+                                                source_id, start, stop))
+                  for start, stop in feedstock_shards(feedstock_file, num_populators)]
     logger.debug("{}: Search ingestion starting".format(source_id))
     # Start processes
-    populator.start()
+    [p.start() for p in populators]
     [s.start() for s in submitters]
 
     # Start pulling off any errors
-    # Stop when populator is finished
+    # Stop when populators are finished
     errors = []
-    while populator.exitcode is None:
+    while any([p.exitcode is None for p in populators]):
         try:
             errors.append(json.loads(error_queue.get(timeout=5)))
         except Empty:
             pass
-    # Populator is finished, signal submitters
+    # Populators are finished, signal submitters
     input_done.value = True
 
     # Continue fetching errors until first Empty
@@ -121,33 +129,32 @@ def search_ingest(feedstock_file, index, delete_existing, source_id=None, batch_
     }
 
 
-def populate_queue(ingest_queue, feedstock_file, batch_size, source_id):
+def populate_queue(ingest_queue, feedstock_file, batch_size, source_id, start=0, stop=None):
     # Populate ingest queue
+    # From the entries in [start, stop), in either feedstock format
     batch = []
-    with open(feedstock_file) as feed_in:
-        for str_entry in feed_in:
-            entry = json.loads(str_entry)
-            # Add gmeta-formatted entry to batch
-            acl = entry["mdf"].pop("acl")
-            # Identifier is source_id for datasets, source_id + scroll_id for records
-            if entry["mdf"]["resource_type"] == "dataset":
-                iden = entry["mdf"]["source_id"]
-            else:
-                iden = entry["mdf"]["source_id"] + "." + str(entry["mdf"]["scroll_id"])
-            batch.append(mdf_toolbox.format_gmeta(entry, acl=acl, identifier=iden))
-
-            # If batch is appropriate size
-            if batch_size > 0 and len(batch) >= batch_size:
-                # Format batch into gmeta and put in queue
-                full_ingest = mdf_toolbox.format_gmeta(batch)
-                ingest_queue.put(json.dumps(full_ingest))
-                batch.clear()
-
-        # Ingest partial batch if needed
-        if batch:
+    for entry in read_feedstock(feedstock_file, start=start, stop=stop):
+        # Add gmeta-formatted entry to batch
+        acl = entry["mdf"].pop("acl")
+        # Identifier is source_id for datasets, source_id + scroll_id for records
+        if entry["mdf"]["resource_type"] == "dataset":
+            iden = entry["mdf"]["source_id"]
+        else:
+            iden = entry["mdf"]["source_id"] + "." + str(entry["mdf"]["scroll_id"])
+        batch.append(mdf_toolbox.format_gmeta(entry, acl=acl, identifier=iden))
+
+        # If batch is appropriate size
+        if batch_size > 0 and len(batch) >= batch_size:
+            # Format batch into gmeta and put in queue
             full_ingest = mdf_toolbox.format_gmeta(batch)
             ingest_queue.put(json.dumps(full_ingest))
             batch.clear()
+
+    # Ingest partial batch if needed
+    if batch:
+        full_ingest = mdf_toolbox.format_gmeta(batch)
+        ingest_queue.put(json.dumps(full_ingest))
+        batch.clear()
     logger.debug("{}: Input queue populated".format(source_id))
     return
 
@@ -18,10 +18,15 @@ import mdf_toolbox
 import requests
 
 from mdf_connect_server import CONFIG
+from mdf_connect_server.schema_registry import validate_schema
 
 
 logger = logging.getLogger(__name__)
 
+# PIF archive filenames from the pif extractor, with the number of PIFs in the archive
+# (see extractors.PIF_ARCHIVE_NAME)
+PIF_ARCHIVE_PATTERN = re.compile(r"^pifs_(\d+)_[0-9a-f]+\.json$")
+
 
 # SQS setup
 SQS_CLIENT = boto3.resource('sqs',
@@ -1301,12 +1306,19 @@ def citrine_upload(citrine_data, api_key, mdf_dataset, previous_id=None,
     failed = 0
     for path, _, files in os.walk(os.path.abspath(citrine_data)):
         for pif in files:
-            up_res = cit_client.upload(cit_ds_id, os.path.join(path, pif))
+            # Archives still being written
+            if pif.startswith(".") and pif.endswith(".tmp"):
+                continue
+            pif_path = os.path.join(path, pif)
+            # PIF archives from the pif extractor are lists of PIFs
+            archive_match = PIF_ARCHIVE_PATTERN.match(pif)
+            num_pifs = int(archive_match.group(1)) if archive_match else 1
+            up_res = cit_client.upload(cit_ds_id, pif_path)
             if up_res.successful():
-                success += 1
+                success += num_pifs
             else:
                 logger.warning("{}: Citrine upload failure: {}".format(source_id, str(up_res)))
-                failed += 1
+                failed += num_pifs
 
     cit_client.update_dataset(cit_ds_id, public=public)
 
@@ -1551,14 +1563,9 @@ def validate_status(status, new_status=False):
         error: If the status is not valid, the reason why. Only present when success is False.
         details: Optional further details about an error.
     """
-    # Load status schema
-    with open(os.path.join(CONFIG["SCHEMA_PATH"], "internal_status.json")) as schema_file:
-        schema = json.load(schema_file)
-    resolver = jsonschema.RefResolver(base_uri="file://{}/".format(CONFIG["SCHEMA_PATH"]),
-                                      referrer=schema)
     # Validate against status schema
     try:
-        jsonschema.validate(status, schema, resolver=resolver)
+        validate_schema(status, "internal_status")
     except jsonschema.ValidationError as e:
         return {
             "success": False,
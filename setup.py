@@ -21,6 +21,7 @@ setup(
         "jsonschema>=2.6.0",
         "mdf-toolbox>=0.5.0",
         "numpy>=1.16.0",
+        "openpyxl>=3.0.0",
         "pandas>=0.23.0",
         "pif-ingestor>=1.1.1",
         "Pillow>=5.1.0",
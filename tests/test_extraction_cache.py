@@ -0,0 +1,46 @@
+import os
+
+from mdf_connect_server.processor.extraction_cache import ExtractionCache
+import pytest  # noqa: F401
+
+
+def test_extraction_cache(tmpdir):
+    cache = ExtractionCache(tmpdir.join("cache").strpath, max_size=10 * 2**20)
+    key = cache.make_key("csv", 1, [("a.csv", "a" * 128)], {"mapping": {"custom.x": "x"}})
+    # Keys depend on every part
+    assert key == cache.make_key("csv", 1, [("a.csv", "a" * 128)], {"mapping": {"custom.x": "x"}})
+    assert key != cache.make_key("csv", 2, [("a.csv", "a" * 128)], {"mapping": {"custom.x": "x"}})
+    assert key != cache.make_key("json", 1, [("a.csv", "a" * 128)], {"mapping": {"custom.x": "x"}})
+    assert key != cache.make_key("csv", 1, [("a.txt", "a" * 128)], {"mapping": {"custom.x": "x"}})
+    assert key != cache.make_key("csv", 1, [("b.csv", "a" * 128)], {"mapping": {"custom.x": "x"}})
+    assert key != cache.make_key("csv", 1, [("a.csv", "b" * 128)], {"mapping": {"custom.x": "x"}})
+    assert key != cache.make_key("csv", 1, [("a.csv", "a" * 128)], {"mapping": {"custom.y": "x"}})
+
+    assert cache.get(key) == (False, None)
+    cache.put(key, [{"custom": {"x": "1"}}, {"custom": {"x": "2"}}])
+    assert cache.get(key) == (True, [{"custom": {"x": "1"}}, {"custom": {"x": "2"}}])
+    # Empty results are cached too
+    empty_key = cache.make_key("crystal_structure", 1, [("a.csv", "a" * 128)], None)
+    cache.put(empty_key, {})
+    assert cache.get(empty_key) == (True, {})
+    # Unserializable results are not
+    bad_key = cache.make_key("image", 1, [("image.png", "a" * 128)], None)
+    cache.put(bad_key, {"image": {"shape": object()}})
+    assert cache.get(bad_key) == (False, None)
+    assert cache.hits == 2
+    assert cache.misses == 2
+
+
+def test_extraction_cache_eviction(tmpdir):
+    cache = ExtractionCache(tmpdir.strpath, max_size=20000)
+    keys = [cache.make_key("json", 1, [(".json", str(i))], None) for i in range(20)]
+    for i, key in enumerate(keys):
+        # Incompressible, so entries are a known size
+        cache.put(key, {"custom": {"data": os.urandom(1000).hex()}})
+        # The first entry stays recently used
+        assert cache.get(keys[0])[0]
+    # Least recently used entries are evicted, down to 90% of the limit
+    assert cache.evict() <= 20000
+    assert cache.get(keys[0])[0]
+    assert cache.get(keys[-1])[0]
+    assert not cache.get(keys[1])[0]
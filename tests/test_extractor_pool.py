@@ -0,0 +1,315 @@
+import os
+import queue
+import threading
+from uuid import uuid4
+
+from mdf_connect_server import CONFIG
+from mdf_connect_server.processor import ExtractorPool, Validator
+import mdf_connect_server.processor.extractor_pool as extractor_pool
+import mdf_connect_server.processor.extractors as extractors
+import pytest  # noqa: F401
+
+
+def _params(source_id, root, mapping=None):
+    dataset = {
+        "dc": {
+            "creators": [{
+                "creatorName": "Footon, Bartholomew",
+                "familyName": "Footon",
+                "givenName": "Bartholomew"
+            }],
+            "publicationYear": "2018",
+            "publisher": "Materials Data Facility",
+            "resourceType": {
+                "resourceType": "Dataset",
+                "resourceTypeGeneral": "Dataset"
+            },
+            "titles": [{
+                "title": "Foo Bar Dataset"
+            }]
+        },
+        "mdf": {
+            "source_name": source_id.rsplit("_v", 1)[0],
+            "source_id": source_id,
+            "acl": ["public"]
+        }
+    }
+    # Workers validate records against the dataset as started by the parent
+    assert Validator(schema_path=CONFIG["SCHEMA_PATH"]).start_dataset(dataset)["success"]
+    return {
+        "dataset": dataset,
+        "extractors": {
+            "csv": {
+                "mapping": mapping or {
+                    "material.composition": "comp",
+                    "custom.x": "x"
+                }
+            },
+            "file": {
+                "globus_host": "globus://endpoint/data/",
+                "http_host": "https://example.com",
+                "local_path": root
+            }
+        }
+    }
+
+
+def _run_submission(handle, params, files, results):
+    handle.begin(params)
+    for f in files:
+        handle.add_group({"files": [f], "extractors": ["csv"], "params": {}})
+    handle.end_input()
+    results[handle.source_id] = list(handle.results())
+    return handle
+
+
+def test_extractor_pool(tmpdir):
+    root = tmpdir.strpath + "/"
+    files = []
+    for i in range(12):
+        path = tmpdir.join("{}.csv".format(i))
+        path.write("comp,x\nAl2O3,{}\nNaCl,{}\n".format(i, i))
+        files.append(path.strpath)
+
+    pool = ExtractorPool(num_workers=2)
+    pool.start()
+    try:
+        # Concurrent submissions each get exactly their own records
+        results = {}
+        submissions = [("big_v1", files), ("small_v1", files[:3])]
+        threads = [threading.Thread(target=_run_submission,
+                                    args=(pool.open(source_id), _params(source_id, root),
+                                          sub_files, results))
+                   for source_id, sub_files in submissions]
+        [t.start() for t in threads]
+        [t.join(timeout=60) for t in threads]
+        for source_id, sub_files in submissions:
+            records = results[source_id]
+            assert len(records) == 2 * len(sub_files)
+            # Validated and normalized by the workers
+            assert sorted(int(r["custom"]["x"]) for r in records) == \
+                sorted(list(range(len(sub_files))) * 2)
+            assert all(r["mdf"]["source_id"] == source_id for r in records)
+            assert all(r["material"]["elements"] in (["Al", "O"], ["Cl", "Na"])
+                       for r in records)
+            assert all(r["files"][0]["globus"].startswith("globus://endpoint/data/")
+                       for r in records)
+
+        # Invalid records are reported instead of any records from the group
+        handle = pool.open("invalid_v1")
+        handle.begin(_params("invalid_v1", root, mapping={"not_a_block.x": "x"}))
+        handle.add_group({"files": [files[0]], "extractors": ["csv"], "params": {}})
+        handle.end_input()
+        assert list(handle.results()) == []
+        assert handle.error["success"] is False
+        assert "Invalid record metadata" in handle.error["error"]
+        handle.cancel()
+
+        # Cancelled submissions do not block the pool
+        handle = pool.open("cancelled_v1")
+        handle.begin(_params("cancelled_v1", root))
+        for f in files:
+            handle.add_group({"files": [f], "extractors": ["csv"], "params": {}})
+        handle.cancel()
+        # Never extracted before (or cached)
+        new_file = tmpdir.join("new.csv")
+        new_file.write("comp,x\nAl2O3,{0}\nNaCl,{0}\n".format(uuid4().hex))
+        results = {}
+        handle = _run_submission(pool.open("after_v1"), _params("after_v1", root),
+                                 [new_file.strpath], results)
+        assert len(results["after_v1"]) == 2
+        # Counters
+        assert handle.stats["invocations"] == 1
+        assert handle.stats["skipped"] == 0
+        csv_stats = handle.stats["extractors"]["csv"]
+        assert csv_stats["calls"] == csv_stats["successes"] == 1
+        assert csv_stats["exceptions"] == 0
+        assert csv_stats["records"] == 2
+        assert csv_stats["bytes_read"] == os.path.getsize(new_file.strpath)
+        assert csv_stats["time_ms"] >= 0
+        assert csv_stats["cache_hits"] == 0
+        assert csv_stats["cache_misses"] == 1
+
+        # Identical files are extracted from the cache
+        copied_file = tmpdir.mkdir("copy").join("new.csv")
+        new_file.copy(copied_file)
+        handle = _run_submission(pool.open("again_v2"), _params("again_v2", root),
+                                 [copied_file.strpath], results)
+        assert [r["custom"] for r in results["again_v2"]] == \
+            [r["custom"] for r in results["after_v1"]]
+        assert results["again_v2"][0]["files"][0]["globus"].endswith("/copy/new.csv")
+        csv_stats = handle.stats["extractors"]["csv"]
+        assert csv_stats["cache_hits"] == 1
+        assert csv_stats["calls"] == csv_stats["cache_misses"] == 0
+        assert csv_stats["records"] == 2
+        # But not under other names, which some extractors read differently
+        renamed_file = tmpdir.join("renamed.csv")
+        new_file.copy(renamed_file)
+        handle = _run_submission(pool.open("renamed_v1"), _params("renamed_v1", root),
+                                 [renamed_file.strpath], results)
+        assert handle.stats["extractors"]["csv"]["cache_misses"] == 1
+
+        # Closing a submission does not close a resubmission with the same source_id
+        old_handle = pool.open("reopened_v1")
+        handle = pool.open("reopened_v1")
+        assert handle.token != old_handle.token
+        pool.close(old_handle.token)
+        _run_submission(handle, _params("reopened_v1", root), [copied_file.strpath], results)
+        assert len(results["reopened_v1"]) == 2
+    finally:
+        pool.shutdown()
+
+
+def test_extractor_pool_timeout(tmpdir, monkeypatch):
+    root = tmpdir.strpath + "/"
+    slow_file = tmpdir.join("slow.csv")
+    slow_file.write("comp,x\n" + "".join("Al2O3,{}\n".format(i) for i in range(200000)))
+    fast_file = tmpdir.join("fast.csv")
+    fast_file.write("comp,x\nNaCl,1\n")
+    monkeypatch.setattr(extractor_pool, "POOL_POLL_TIME", 0.05)
+    monkeypatch.setitem(CONFIG, "EXTRACTOR_TIMEOUTS", {"csv": 0})
+
+    pool = ExtractorPool(num_workers=1)
+    pool.start()
+    try:
+        handle = pool.open("timeout_v1")
+        handle.begin(_params("timeout_v1", root))
+        handle.add_group({"files": [slow_file.strpath], "extractors": ["csv"], "params": {}})
+        handle.end_input()
+        # The stuck group is skipped with a reason, not lost
+        assert list(handle.results()) == []
+        assert handle.skipped == [{
+            "files": [slow_file.strpath],
+            "reason": "Extractor 'csv' timed out after 0 seconds"
+        }]
+        assert handle.stats["extractors"]["csv"]["calls"] == 1
+        assert handle.stats["extractors"]["csv"]["exceptions"] == 1
+
+        # The worker was replaced
+        monkeypatch.setitem(CONFIG, "EXTRACTOR_TIMEOUTS", {})
+        results = {}
+        _run_submission(pool.open("after_v1"), _params("after_v1", root), [fast_file.strpath],
+                        results)
+        assert len(results["after_v1"]) == 1
+    finally:
+        pool.shutdown()
+
+
+def test_extractor_pool_timeout_records(tmpdir, monkeypatch):
+    root = tmpdir.strpath + "/"
+    # Many batches of records, streamed for longer than the timeout
+    lines_file = tmpdir.join("slow.jsonl")
+    lines_file.write("".join("{{\"comp\": \"NaCl\", \"x\": {}}}\n".format(i)
+                             for i in range(200000)))
+    params = _params("partial_v1", root)
+    params["extractors"]["json"] = {"mapping": {"material.composition": "comp", "custom.x": "x"}}
+    monkeypatch.setattr(extractor_pool, "POOL_POLL_TIME", 0.05)
+    monkeypatch.setitem(CONFIG, "EXTRACTOR_TIMEOUTS", {"json": 1})
+
+    pool = ExtractorPool(num_workers=1)
+    pool.start()
+    try:
+        handle = pool.open("partial_v1")
+        handle.begin(params)
+        handle.add_group({"files": [lines_file.strpath], "extractors": ["json"], "params": {}})
+        handle.end_input()
+        # Records of the skipped group already extracted are not sent
+        assert list(handle.results()) == []
+        assert handle.skipped == [{
+            "files": [lines_file.strpath],
+            "reason": "Extractor 'json' timed out after 1 seconds"
+        }]
+        assert handle.error is None
+    finally:
+        pool.shutdown()
+
+
+def test_extractor_pool_stopped(tmpdir, monkeypatch):
+    root = tmpdir.strpath + "/"
+    csv_file = tmpdir.join("data.csv")
+    csv_file.write("comp,x\nNaCl,1\n")
+    monkeypatch.setattr(extractor_pool, "POOL_POLL_TIME", 0.05)
+    monkeypatch.setattr(extractor_pool, "POOL_TIMEOUT", 0.5)
+
+    pool = ExtractorPool(num_workers=1)
+    pool.start()
+    handle = pool.open("stopped_v1")
+    pool.shutdown()
+    # The submission gives up instead of waiting forever
+    handle.begin(_params("stopped_v1", root))
+    handle.add_group({"files": [csv_file.strpath], "extractors": ["csv"], "params": {}})
+    handle.end_input()
+    assert list(handle.results()) == []
+    assert handle.error["success"] is False
+    assert handle.error["error"] == "The extractor pool stopped responding"
+
+
+def test_extractor_pool_scheduling(tmpdir, monkeypatch):
+    root = tmpdir.strpath + "/"
+    # Never extracted before (or cached), to keep the worker busy while groups are queued
+    slow_file = tmpdir.join("slow.csv")
+    slow_file.write("comp,x\n" + "".join("Al2O3,{}\n".format(uuid4().hex) for i in range(20000)))
+    files = {}
+    for name in ["cheap", "medium", "expensive"]:
+        path = tmpdir.join(name + ".csv")
+        path.write("comp,x\nNaCl,{}\n".format(name))
+        files[name] = path.strpath
+
+    def add_group(handle, file_path, time, memory=0):
+        handle.add_group({"files": [file_path], "extractors": ["csv"], "params": {},
+                          "cost": {"time": time, "memory": memory * 2**20}})
+
+    # Most expensive groups first
+    pool = ExtractorPool(num_workers=1)
+    pool.start()
+    try:
+        handle = pool.open("order_v1")
+        handle.begin(_params("order_v1", root))
+        add_group(handle, slow_file.strpath, 100)
+        add_group(handle, files["cheap"], 1)
+        add_group(handle, files["expensive"], 50)
+        add_group(handle, files["medium"], 10)
+        handle.end_input()
+        order = [r["custom"]["x"] for r in handle.results()][20000:]
+        assert order == ["expensive", "medium", "cheap"]
+    finally:
+        pool.shutdown()
+
+    # Large groups wait for memory, while smaller groups go ahead
+    monkeypatch.setitem(CONFIG, "EXTRACTOR_MEMORY_BUDGET", 100)
+    pool = ExtractorPool(num_workers=2)
+    pool.start()
+    try:
+        handle = pool.open("budget_v1")
+        handle.begin(_params("budget_v1", root))
+        add_group(handle, slow_file.strpath, 100, memory=80)
+        add_group(handle, files["expensive"], 50, memory=80)
+        add_group(handle, files["cheap"], 1)
+        handle.end_input()
+        order = [r["custom"]["x"] for r in handle.results()]
+        assert len(order) == 20002
+        assert order.index("cheap") < order.index("expensive") == 20001
+    finally:
+        pool.shutdown()
+
+
+def test_run_extractors_error(tmpdir, monkeypatch):
+    def extract_group(group_info, extract_params, stats=None, announce=None, cache=None):
+        yield {"material": {"composition": "NaCl"}}
+        # Not serializable
+        yield {"material": {"composition": "NaCl"}, "files": [{"filename": object()}]}
+    monkeypatch.setattr(extractors, "extract_group", extract_group)
+    monkeypatch.setitem(CONFIG, "EXTRACTION_CACHE_SIZE", 0)
+    task_queue = queue.Queue()
+    result_queue = queue.Queue()
+    task_queue.put(("params", "error_v1#0", _params("error_v1", tmpdir.strpath + "/")))
+    task_queue.put(("group", "error_v1#0", {"files": [], "extractors": [], "params": {}}))
+    task_queue.put(None)
+    extractors.run_extractors(0, task_queue, result_queue)
+    # Errors after extraction fail the submission instead of dropping the group's records
+    results = []
+    while not result_queue.empty():
+        results.append(result_queue.get())
+    assert [kind for kind, token, payload in results] == ["invalid", "done"]
+    assert results[0][2]["success"] is False
+    assert results[0][2]["error"] == "Unable to extract records"
@@ -1,9 +1,18 @@
+from hashlib import sha512
+import io
 import json
 import os
+import subprocess
+import sys
 
+import magic
+from mdf_connect_server.processor.extraction_cache import ExtractionCache
 import mdf_connect_server.processor.extractors as extractors
 import mdf_toolbox
-import pytest  # noqa: F401
+import openpyxl
+import pytest
+import xmltodict
+import yaml
 
 '''
 DATASET_PARAM = {
@@ -12,6 +21,13 @@ DATASET_PARAM = {
     }
 }
 '''
+# Maximum cold-start import time of the processor package, in seconds
+PROCESSOR_IMPORT_BUDGET = 5
+# Extractor libraries that must only be imported on first use
+LAZY_MODULES = ["ase", "bson", "hyperspy", "openpyxl", "pandas", "PIL", "pif_ingestor",
+                "pycalphad", "pymatgen", "pypif_sdk"]
+# Submission libraries that the extractor workers must not import
+SUBMISSION_MODULES = ["boto3", "botocore", "citrination_client"]
 BASE_PATH = os.path.join(os.path.dirname(__file__), "test_files")
 NO_DATA_FILE = os.path.join(BASE_PATH, "no_data.dat")
 NA_PATH = os.path.join(BASE_PATH, "does_not_exist.dat")
@@ -73,6 +89,23 @@ def test_crystal_structure():
     assert extractors.extract_crystal_structure([cif4_path]) == cif4_record
     assert extractors.extract_crystal_structure([NO_DATA_FILE]) == {}
     assert extractors.extract_crystal_structure([NA_PATH]) == {}
+    # First valid structure in the group
+    assert extractors.extract_crystal_structure([NO_DATA_FILE, cif4_path, cif1_path]) == \
+        cif4_record
+    # Symmetry tolerance
+    cs_params = {"extractors": {"crystal_structure": {"symprec": 0.1, "angle_tolerance": 10}}}
+    assert extractors.extract_crystal_structure([cif1_path], cs_params) == cif1_record
+    # Space groups are cached by structure and tolerance
+    extractors._space_group_cache.clear()
+    extractors.extract_crystal_structure([cif4_path])
+    extractors.extract_crystal_structure([cif4_path])
+    extractors.extract_crystal_structure([cif4_path], cs_params)
+    assert len(extractors._space_group_cache) == 2
+    # Readers are chosen by format
+    ase_formats = extractors._import_backend("ase.io.formats")
+    assert [reader for reader, file_format in extractors._choose_structure_readers(
+                cif1_path, ase_formats)] == ["ase", "pymatgen"]
+    assert extractors._choose_structure_readers(NO_DATA_FILE, ase_formats) == []
 
 
 def test_tdb():
@@ -144,12 +177,26 @@ def test_tdb():
     assert extractors.extract_tdb([NA_PATH]) == {}
 
 
-def test_pif():
-    # TODO
-    pass
+def test_pif(tmpdir, monkeypatch):
+    # PIFs are written to complete archives, named with their number of PIFs
+    monkeypatch.setattr(extractors, "PIF_ARCHIVE_SIZE", 3)
+    cit_path = tmpdir.strpath
+    pifs = [json.dumps({"category": "system", "uid": str(i)}) for i in range(5)]
+    extractors._archive_pifs(cit_path, pifs[:1])
+    extractors._archive_pifs(cit_path, [])
+    extractors._archive_pifs(cit_path, pifs[1:])
+    archives = {f.basename: f.read() for f in tmpdir.listdir()}
+    assert len(archives) == 3
+    assert sorted(len(json.loads(archive)) for archive in archives.values()) == [1, 1, 3]
+    assert all(name.startswith("pifs_{}_".format(len(json.loads(archive))))
+               for name, archive in archives.items())
+    # Each archive is a list of PIFs, as Citrine reads uploaded files
+    pif_loads = extractors._import_backend("pypif.pif").loads
+    assert sorted(pif.uid for archive in archives.values() for pif in pif_loads(archive)) == \
+        [str(i) for i in range(5)]
 
 
-def test_json(tmpdir):
+def test_json(tmpdir, monkeypatch):
     json_data = {
         "dict1": {
             "field1": "value1",
@@ -205,64 +252,224 @@ def test_json(tmpdir):
     }
 
     # Test with proper mappings
-    assert extractors.extract_json(group, params={
+    assert list(extractors.extract_json(group, params={
                                         "extractors": {
                                             "json": {
                                                 "mapping": mapping1,
                                                 "na_values": ["na"]
                                             }
                                         }
-                                     }) == [correct_record]
-    assert extractors.extract_json(group, params={
+                                        })) == [correct_record]
+    assert list(extractors.extract_json(group, params={
                                         "extractors": {
                                             "json": {
                                                 "mapping": mapping2,
                                                 "na_values": "na"
                                             }
                                         }
-                                     }) == [correct_record]
+                                        })) == [correct_record]
     # With na included
-    assert extractors.extract_json(group, params={
+    assert list(extractors.extract_json(group, params={
                                         "extractors": {
                                             "json": {
                                                 "mapping": mapping1
                                             }
                                         }
-                                     }) == [with_na_record]
+                                        })) == [with_na_record]
+
+    # Top-level arrays and JSON Lines, one record per document
+    json_params = {
+        "extractors": {
+            "json": {
+                "mapping": mapping1,
+                "na_values": ["na"]
+            }
+        }
+    }
+    array_file = tmpdir.join("array.json")
+    array_file.write(json.dumps([json_data, {"na_val": "na"}, json_data], indent=2))
+    assert list(extractors.extract_json([array_file.strpath], json_params)) == [correct_record] * 2
+    lines_file = tmpdir.join("records.jsonl")
+    lines_file.write("\n".join(json.dumps(data) for data in [json_data, {}, json_data]) + "\n\n")
+    assert list(extractors.extract_json([lines_file.strpath], json_params)) == [correct_record] * 2
+    # Read in pieces
+    monkeypatch.setattr(extractors, "JSON_READ_SIZE", 16)
+    assert list(extractors.extract_json([array_file.strpath], json_params)) == [correct_record] * 2
+    for text, documents in [("[1, 2.5e3, \"a]\", [], {}, null]", [1, 2500.0, "a]", [], {}, None]),
+                            (" [ ] ", []), ("{\"a\": [1]}", [{"a": [1]}])]:
+        assert list(extractors._iter_json_documents(io.StringIO(text))) == documents
+    for text in ["[1,]", "[1 2]", "[1", "[1] 2", ""]:
+        with pytest.raises(ValueError):
+            list(extractors._iter_json_documents(io.StringIO(text)))
+    # Invalid files give only the records read before the error
+    invalid_file = tmpdir.join("invalid.json")
+    invalid_file.write(json.dumps([json_data] * 5)[:-2])
+    assert list(extractors.extract_json([invalid_file.strpath, array_file.strpath],
+                                        json_params)) == [correct_record] * 6
 
     # Test failure modes
     assert extractors.extract_json(group, {}) == {}
-    assert extractors.extract_json([], params={
+    assert list(extractors.extract_json([], params={
                                     "extractors": {
                                         "json": {
                                             "mapping": mapping2
                                         }
                                     }
-                                  }) == []
-    assert extractors.extract_json([NO_DATA_FILE], params={
+                                  })) == []
+    assert list(extractors.extract_json([NO_DATA_FILE], params={
                                     "extractors": {
                                         "json": {
                                             "mapping": mapping2
                                         }
                                     }
-                                  }) == []
-    assert extractors.extract_json([NA_PATH], params={
+                                  })) == []
+    assert list(extractors.extract_json([NA_PATH], params={
                                     "extractors": {
                                         "json": {
                                             "mapping": mapping2
                                         }
                                     }
-                                  }) == []
+                                  })) == []
 
 
-def test_csv():
-    # TODO
-    pass
+def test_csv(tmpdir):
+    csv_data = ("name,value,flag,note\n"
+                "Al2O3,1.5,True,\n"
+                "NaCl,,False,good\n"
+                ",3,True,na\n")
+    csv_file = tmpdir.join("test.csv")
+    csv_file.write(csv_data)
+    group = [csv_file.strpath]
+    mapping1 = {
+        "material": {
+            "composition": "name"
+        },
+        "custom": {
+            "value": "value",
+            "flag": "flag",
+            "note": "note",
+            "missing": "not_a_column"
+        }
+    }
+    mapping2 = {
+        "material.composition": "name",
+        "custom.value": "value",
+        "custom.flag": "flag",
+        "custom.note": "note",
+        "custom.missing": "not_a_column"
+    }
+    correct_records = [{
+        "material": {
+            "composition": "Al2O3"
+        },
+        "custom": {
+            "value": 1.5,
+            "flag": True
+        }
+    }, {
+        "material": {
+            "composition": "NaCl"
+        },
+        "custom": {
+            "flag": False,
+            "note": "good"
+        }
+    }, {
+        "custom": {
+            "value": 3.0,
+            "flag": True,
+            "note": "na"
+        }
+    }]
 
+    # Test with proper mappings
+    assert extractors.extract_csv(group, params={
+                                        "extractors": {
+                                            "csv": {
+                                                "mapping": mapping1
+                                            }
+                                        }
+                                     }) == correct_records
+    assert extractors.extract_csv(group, params={
+                                        "extractors": {
+                                            "csv": {
+                                                "mapping": mapping2
+                                            }
+                                        }
+                                     }) == correct_records
+    # With additional N/A value
+    na_records = json.loads(json.dumps(correct_records))
+    na_records[2]["custom"].pop("note")
+    assert extractors.extract_csv(group, params={
+                                        "extractors": {
+                                            "csv": {
+                                                "mapping": mapping1,
+                                                "na_values": ["", " ", "na"]
+                                            }
+                                        }
+                                     }) == na_records
 
-def test_yaml():
-    # TODO
-    pass
+    # Test failure modes
+    assert extractors.extract_csv(group, {}) == {}
+    assert extractors.extract_csv([], params={
+                                    "extractors": {
+                                        "csv": {
+                                            "mapping": mapping2
+                                        }
+                                    }
+                                  }) == []
+    assert extractors.extract_csv([NA_PATH], params={
+                                    "extractors": {
+                                        "csv": {
+                                            "mapping": mapping2
+                                        }
+                                    }
+                                  }) == []
+
+
+def test_yaml(tmpdir, monkeypatch):
+    yaml_file = tmpdir.join("runs.yaml")
+    yaml_file.write("comp: Al2O3\nresults:\n  energy: -1.5\n  status: na\n"
+                    "---\n- comp: NaCl\n  results: {energy: 2}\n- comp: Fe\n"
+                    "---\n"
+                    "--- {results: {energy: 3}}\n")
+    params = {
+        "extractors": {
+            "yaml": {
+                "mapping": {
+                    "material.composition": "comp",
+                    "custom.energy": "results.energy",
+                    "custom.status": "results.status"
+                },
+                "na_values": ["na"]
+            }
+        }
+    }
+    # One record per document, skipping empty documents
+    correct = [{
+        "material": {"composition": "Al2O3"},
+        "custom": {"energy": -1.5}
+    }, {
+        "material": {"composition": "NaCl"},
+        "custom": {"energy": 2}
+    }, {
+        "material": {"composition": "Fe"}
+    }, {
+        "custom": {"energy": 3}
+    }]
+    assert list(extractors.extract_yaml([yaml_file.strpath], params)) == correct
+    # Same results with the Python loader
+    monkeypatch.setattr(extractors, "YAML_LOADER", yaml.SafeLoader)
+    assert list(extractors.extract_yaml([yaml_file.strpath], params)) == correct
+
+    # Test failure modes
+    invalid_file = tmpdir.join("invalid.yaml")
+    invalid_file.write("comp: Al2O3\n---\ncomp: [NaCl\n")
+    # Documents before the error are kept
+    assert list(extractors.extract_yaml([invalid_file.strpath, NA_PATH], params)) == [{
+        "material": {"composition": "Al2O3"}
+    }]
+    assert extractors.extract_yaml([yaml_file.strpath], {}) == {}
 
 
 def test_xml(tmpdir):
@@ -298,48 +505,142 @@ def test_xml(tmpdir):
     }
 
     # Test with proper mappings
-    assert extractors.extract_xml(group, params={
+    assert list(extractors.extract_xml(group, params={
+                                            "extractors": {
+                                                "xml": {
+                                                    "mapping": mapping1
+                                                }
+                                            }
+                                         })) == [correct_record]
+    assert list(extractors.extract_xml(group, params={
+                                            "extractors": {
+                                                "xml": {
+                                                    "mapping": mapping2
+                                                }
+                                            }
+                                         })) == [correct_record]
+    # Streamed, one record per repeated element
+    items_file = tmpdir.join("items.xml")
+    items_file.write('<?xml version="1.0"?>\n<export xmlns:v="urn:v"><header>1</header><items>'
+                     '<item id="1"><comp>Al2O3</comp><v:e unit="eV">-1.5</v:e></item>'
+                     '<item id="2"><comp>NaCl</comp><tag>a</tag><tag>b</tag></item>'
+                     '<item>text only</item><other><comp>Fe</comp></other></items></export>')
+    items_params = {
+        "extractors": {
+            "xml": {
+                "mapping": {
+                    "material.composition": "comp",
+                    "custom.id": "@id",
+                    "custom.energy": "v:e.#text",
+                    "custom.tags": "tag"
+                },
+                "item_path": "export.items.item"
+            }
+        }
+    }
+    assert list(extractors.extract_xml([items_file.strpath], items_params)) == [{
+        "material": {"composition": "Al2O3"},
+        "custom": {"id": "1", "energy": "-1.5"}
+    }, {
+        "material": {"composition": "NaCl"},
+        "custom": {"id": "2", "tags": ["a", "b"]}
+    }]
+    # Same elements as xmltodict
+    with open(items_file.strpath) as f:
+        parsed_items = xmltodict.parse(f.read())["export"]["items"]["item"]
+    assert list(extractors._iter_xml_items(items_file.strpath, "export.items.item")) == \
+        parsed_items[:2]
+    assert list(extractors.extract_xml([NO_DATA_FILE, items_file.strpath], items_params)) == \
+        list(extractors.extract_xml([items_file.strpath], items_params))
+    # Records are yielded as the elements are read, so a file broken after the first
+    # few thousand elements still gives the records before the error
+    broken_file = tmpdir.join("broken.xml")
+    broken_file.write('<export><items>'
+                      + "".join('<item id="{}"><comp>Fe</comp></item>'.format(i)
+                                for i in range(5000))
+                      + '<item><comp>NaCl</item>')
+    records = extractors.extract_xml([broken_file.strpath], items_params)
+    assert next(records) == {"material": {"composition": "Fe"}, "custom": {"id": "0"}}
+    assert len(list(records)) == 4999
+
+    # Test failure modes
+    assert extractors.extract_xml(group, {}) == {}
+    assert list(extractors.extract_xml([], params={
                                         "extractors": {
                                             "xml": {
-                                                "mapping": mapping1
+                                                "mapping": mapping2
                                             }
                                         }
-                                     }) == [correct_record]
-    assert extractors.extract_xml(group, params={
+                                      })) == []
+    assert list(extractors.extract_xml([NO_DATA_FILE], params={
                                         "extractors": {
                                             "xml": {
                                                 "mapping": mapping2
                                             }
                                         }
-                                     }) == [correct_record]
-    # Test failure modes
-    assert extractors.extract_xml(group, {}) == {}
-    assert extractors.extract_xml([], params={
-                                    "extractors": {
-                                        "xml": {
-                                            "mapping": mapping2
-                                        }
-                                    }
-                                  }) == []
-    assert extractors.extract_xml([NO_DATA_FILE], params={
-                                    "extractors": {
-                                        "xml": {
-                                            "mapping": mapping2
-                                        }
-                                    }
-                                  }) == []
-    assert extractors.extract_xml([NA_PATH], params={
-                                    "extractors": {
-                                        "xml": {
-                                            "mapping": mapping2
+                                      })) == []
+    assert list(extractors.extract_xml([NA_PATH], params={
+                                        "extractors": {
+                                            "xml": {
+                                                "mapping": mapping2
+                                            }
                                         }
-                                    }
-                                  }) == []
+                                      })) == []
 
 
-def test_excel():
-    # TODO
-    pass
+def test_excel(tmpdir, monkeypatch):
+    workbook = openpyxl.Workbook()
+    first = workbook.active
+    first.title = "first"
+    first.append(["comp", "energy", "label"])
+    first.append(["Al2O3", -1.5, "a"])
+    first.append(["NA", 2.0, " "])
+    first.append(["NaCl", 3, "c"])
+    second = workbook.create_sheet("second")
+    second.append(["formula", "energy"])
+    second.append(["Fe", 9])
+    excel_path = tmpdir.join("data.xlsx").strpath
+    workbook.save(excel_path)
+    mapping = {
+        "material.composition": "comp",
+        "custom.energy": "energy",
+        "custom.label": "label"
+    }
+    first_records = [{
+        "material": {"composition": "Al2O3"},
+        "custom": {"energy": -1.5, "label": "a"}
+    }, {
+        "custom": {"energy": 2}
+    }, {
+        "material": {"composition": "NaCl"},
+        "custom": {"energy": 3, "label": "c"}
+    }]
+    second_records = [{
+        "material": {"composition": "Fe"},
+        "custom": {"energy": 9}
+    }]
+
+    def extract(excel_params):
+        records = extractors.extract_excel([excel_path], params={"extractors": {
+                                                                    "excel": excel_params
+                                                                 }})
+        return records if isinstance(records, dict) else list(records)
+    # The mapping applies to every sheet
+    assert extract({"mapping": mapping}) == first_records + [{"custom": {"energy": 9}}]
+    # Per-sheet mappings
+    sheets = {"second": {"material.composition": "formula", "custom.energy": "energy"}}
+    assert extract({"mapping": mapping, "sheets": sheets}) == first_records + second_records
+    assert extract({"sheets": sheets}) == second_records
+    assert extract({"mapping": mapping, "sheets": {"first": None}}) == [{"custom": {"energy": 9}}]
+    # Read in batches of rows
+    monkeypatch.setattr(extractors, "EXCEL_BATCH_SIZE", 2)
+    assert extract({"mapping": mapping, "sheets": sheets}) == first_records + second_records
+    # Failures
+    assert extractors.extract_excel([excel_path], params={}) == {}
+    assert extract({"na_values": ["NA"]}) == {}
+    assert list(extractors.extract_excel([NO_DATA_FILE, NA_PATH], params={"extractors": {
+                                                                "excel": {"mapping": mapping}
+                                                             }})) == []
 
 
 def test_image():
@@ -352,6 +653,26 @@ def test_electron_microscopy():
     pass
 
 
+def test_em_shape():
+    class Signal:
+        class data:
+            shape = (10, 480, 640)
+    dm_tags = {"ImageList": {"TagGroup0": {"ImageData": {"Dimensions": {
+        "Data0": 640,
+        "Data1": 480,
+        "Data2": 10
+    }}}}}
+    # From the DigitalMicrograph tags, or the (lazy) data shape otherwise
+    assert extractors._get_em_shape(dm_tags, None) == [480, 640, 10]
+    assert extractors._get_em_shape({}, Signal) == [480, 640, 10]
+    Signal.data.shape = (2048,)
+    assert extractors._get_em_shape({}, Signal) == [2048]
+    # Unknown
+    Signal.data.shape = ()
+    assert extractors._get_em_shape({}, Signal) is None
+    assert extractors._get_em_shape({}, None) is None
+
+
 def test_filename():
     mapping = {
         "material.composition": "^.{2}",  # First two chars are always composition
@@ -400,6 +721,273 @@ def test_filename():
                                          }) == []
 
 
-def test_file_info():
-    # TODO
-    pass
+def test_compile_mapping():
+    mapping = {
+        "material": {
+            "composition": "formula"
+        },
+        "custom.energy": "results.energy.value",
+        "title": "name"
+    }
+    plan = extractors._compile_mapping(mapping, "path")
+    assert len(plan) == 3
+    # Cached by mapping, not by identity
+    assert extractors._compile_mapping(json.loads(json.dumps(mapping)), "path") is plan
+    assert extractors._compile_mapping(mapping, "column") is not plan
+
+    data = {
+        "formula": "NaCl",
+        "results": {
+            "energy": {
+                "value": -1.5
+            }
+        }
+    }
+    record = {}
+    for getter, setter in plan:
+        try:
+            setter(record, getter(data))
+        except KeyError:
+            pass
+    assert record == {
+        "material": {
+            "composition": "NaCl"
+        },
+        "custom": {
+            "energy": -1.5
+        }
+    }
+    # Deep output paths, with a None field replaced
+    setter = extractors._compile_mapping({"a.b.c.d": "x"}, "path")[0][1]
+    record = {"a": {"b": None}}
+    setter(record, 1)
+    assert record == {"a": {"b": {"c": {"d": 1}}}}
+
+    assert [column for column, setter in extractors._compile_mapping(mapping, "column")] == [
+        "formula", "results.energy.value", "name"]
+    pattern, setter = extractors._compile_mapping({"custom.ext": "\\..{3,4}$"}, "regex")[0]
+    assert pattern.search("data.txt").group() == ".txt"
+
+
+def test_plan_extractors(tmpdir):
+    text_file = tmpdir.join("data.txt")
+    text_file.write("Some text\n")
+    png_file = tmpdir.join("image.bin")
+    png_file.write_binary(b"\x89PNG\r\n\x1a\n" + os.urandom(64))
+    dm3_file = tmpdir.join("micrograph.dm3")
+    dm3_file.write_binary(os.urandom(64))
+    lines_file = tmpdir.join("records.ndjson")
+    lines_file.write("{\"comp\": \"NaCl\"}\n{\"comp\": \"Al2O3\"}\n")
+    mapping_params = {
+        "extractors": {
+            "json": {
+                "mapping": {"material.composition": "comp"}
+            },
+            "excel": {
+                "mapping": {"material.composition": "comp"}
+            }
+        }
+    }
+
+    def plan(path, extractor_names=None, params=None):
+        group = [path.strpath]
+        return extractors._plan_extractors(extractor_names or [], group,
+                                           extractors._fingerprint_group(group), params or {})
+    # Text files
+    assert plan(text_file) == ["crystal_structure", "pif"]
+    assert plan(text_file, params=mapping_params) == ["crystal_structure", "pif", "json"]
+    # JSON Lines
+    assert plan(lines_file, params=mapping_params) == ["json"]
+    # Magic bytes
+    assert plan(png_file) == ["image"]
+    # Extension
+    assert plan(dm3_file) == ["electron_microscopy"]
+    # Configured extractors are not filtered by signature, only by missing mappings
+    assert plan(dm3_file, ["tdb", "pif", "csv"]) == ["tdb", "pif"]
+    # Mappings in other parameters
+    assert plan(dm3_file, ["excel"]) == []
+    sheet_params = {"extractors": {"excel": {"sheets": {"a": {"custom.x": "x"}}}}}
+    assert plan(dm3_file, ["excel"], sheet_params) == ["excel"]
+    # Fingerprints unavailable
+    assert extractors._plan_extractors([], [text_file.strpath], None, {}) == \
+        [name for name in extractors.ALL_EXTRACTORS.keys()
+         if not extractors.EXTRACTOR_SIGNATURES[name].get("mapping")]
+
+
+def test_estimate_group_cost():
+    def estimate(files, sizes, extractor_names=None, params=None):
+        return extractors.estimate_group_cost({"files": files, "sizes": sizes,
+                                               "extractors": extractor_names or [],
+                                               "params": {}}, params)
+    mib = 2**20
+    em_cost = extractors.EXTRACTOR_COSTS["electron_microscopy"]
+    # Only the extractors expected to read the files
+    assert estimate(["micrograph.dm4"], [1024 * mib]) == {
+        "time": (extractors.FINGERPRINT_TIME_PER_MIB * 1024 + em_cost["time"]
+                 + em_cost["time_per_mib"] * 1024),
+        "memory": int(em_cost["memory_ratio"] * 1024 * mib)
+    }
+    # Configured extractors read every file
+    configured = estimate(["micrograph.dm4", "POSCAR"], [1024 * mib, mib],
+                          ["crystal_structure"])
+    assert configured["memory"] == \
+        extractors.EXTRACTOR_COSTS["crystal_structure"]["memory_ratio"] * 1024 * mib
+    # Mapped extractors only with a mapping
+    json_params = {"extractors": {"json": {"mapping": {"material.composition": "comp"}}}}
+    assert estimate(["data.json"], [mib], params=json_params)["time"] > \
+        estimate(["data.json"], [mib])["time"]
+    # Larger groups cost more, and groups without sizes cost the per-call time
+    assert estimate(["POSCAR"], [10 * mib])["time"] > estimate(["POSCAR"], [mib])["time"]
+    assert extractors.estimate_group_cost({"files": ["POSCAR"], "extractors": [],
+                                           "params": {}})["memory"] == 0
+
+
+def test_file_info(tmpdir, monkeypatch):
+    small_file = tmpdir.join("small.txt")
+    small_file.write("Some text\n")
+    # Spans several read blocks
+    big_file = tmpdir.join("big.dat")
+    big_file.write_binary(os.urandom(extractors.FILE_BLOCK_SIZE * 2 + 123))
+    empty_file = tmpdir.join("empty.txt")
+    empty_file.write("")
+    group = [small_file.strpath, big_file.strpath, empty_file.strpath]
+    params = {
+        "extractors": {
+            "file": {
+                "globus_host": "globus://abc123/published/",
+                "http_host": "https://example.com",
+                "local_path": tmpdir.strpath + "/"
+            }
+        }
+    }
+    correct = {
+        "files": [{
+            "globus": "globus://abc123/published/" + os.path.basename(path),
+            "url": "https://example.com/published/" + os.path.basename(path),
+            "filename": os.path.basename(path),
+            "data_type": magic.from_file(path),
+            "mime_type": magic.from_file(path, mime=True),
+            "length": os.path.getsize(path),
+            "sha512": sha512(open(path, "rb").read()).hexdigest()
+        } for path in group]
+    }
+    assert extractors._extract_file_info(group, params) == correct
+    # Hashed on thread pool
+    monkeypatch.setattr(extractors, "LARGE_FILE_SIZE", 1)
+    assert extractors._extract_file_info(group, params) == correct
+    # Sizes from the walk are not read again
+    sizes = [os.path.getsize(path) for path in group]
+    monkeypatch.setattr(os.path, "getsize", None)
+    assert extractors._fingerprint_group(group, sizes) == \
+        extractors._fingerprint_group(group, [0] * len(group))
+
+    # Failures
+    with pytest.raises(ValueError):
+        extractors._extract_file_info(group, {})
+
+
+def test_extract_group_stream(tmpdir, monkeypatch):
+    lines_file = tmpdir.join("records.jsonl")
+    lines_file.write("".join(json.dumps({"x": i}) + "\n" for i in range(5)))
+    group_info = {"files": [lines_file.strpath], "extractors": ["json"], "params": {}}
+    params = {
+        "extractors": {
+            "json": {
+                "mapping": {"custom.x": "x"}
+            },
+            "file": {
+                "globus_host": "globus://abc123/published/",
+                "http_host": "https://example.com",
+                "local_path": tmpdir.strpath + "/"
+            }
+        }
+    }
+    cache = ExtractionCache(tmpdir.join("cache").strpath, max_size=10 * 2**20)
+
+    # Records are extracted as they are read, with the extractor announced again
+    stats = {}
+    announced = []
+    records = extractors.extract_group(group_info, params, stats, announced.append, cache)
+    assert next(records)["custom"] == {"x": 0}
+    assert announced == ["json", "json"]
+    assert stats["extractors"]["json"]["records"] == 1
+    assert [record["custom"]["x"] for record in records] == [1, 2, 3, 4]
+    assert stats["extractors"]["json"]["records"] == 5
+    assert stats["extractors"]["json"]["cache_misses"] == 1
+    # Cached once read
+    stats = {}
+    assert len(list(extractors.extract_group(group_info, params, stats, cache=cache))) == 5
+    assert stats["extractors"]["json"]["cache_hits"] == 1
+
+    # Long streams are not cached
+    monkeypatch.setattr(extractors, "CACHE_STREAM_RECORDS", 2)
+    lines_file.write("".join(json.dumps({"x": i}) + "\n" for i in range(6)))
+    stats = {}
+    assert len(list(extractors.extract_group(group_info, params, stats, cache=cache))) == 6
+    stats = {}
+    assert len(list(extractors.extract_group(group_info, params, stats, cache=cache))) == 6
+    assert stats["extractors"]["json"]["cache_misses"] == 1
+
+    # Errors end the stream, keeping the records read, and are not cached
+    def broken_extractor(group, params=None):
+        yield {"custom": {"x": 0}}
+        yield {"custom": {"x": 1}}
+        raise ValueError("Broken file")
+    monkeypatch.setitem(extractors.ALL_EXTRACTORS, "json", broken_extractor)
+    monkeypatch.setattr(extractors, "CACHE_STREAM_RECORDS", 10)
+    for i in range(2):
+        stats = {}
+        records = list(extractors.extract_group(group_info, params, stats, cache=cache))
+        assert [record["custom"]["x"] for record in records] == [0, 1]
+        assert stats["extractors"]["json"]["exceptions"] == 1
+        assert stats["extractors"]["json"]["records"] == 2
+        assert stats["extractors"]["json"]["cache_misses"] == 1
+
+
+def test_batch_records():
+    records = [{"custom": {"i": i}, "files": [{"filename": "{}.csv".format(i)}]}
+               for i in range(25)]
+    batches = list(extractors.batch_records(records, batch_size=10))
+    assert len(batches) == 3
+    assert [len(json.loads(batch)) for batch in batches] == [10, 10, 5]
+    assert [rec for batch in batches for rec in json.loads(batch)] == records
+    # Compact
+    assert ", " not in batches[0] and ": " not in batches[0]
+    assert list(extractors.batch_records([], batch_size=10)) == []
+
+
+def test_import_time():
+    # Import the processor in a clean interpreter, with the import time report
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                           "import mdf_connect_server.processor"],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, env=os.environ.copy())
+    assert proc.returncode == 0, proc.stderr
+    # Report lines are "import time: self [us] | cumulative [us] | module"
+    import_times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_time, cumulative_time, module = line[len("import time:"):].split("|")
+        try:
+            import_times[module.strip()] = int(cumulative_time)
+        except ValueError:
+            # Header line
+            continue
+    assert [mod for mod in import_times.keys() if mod.split(".")[0] in LAZY_MODULES] == []
+    assert import_times["mdf_connect_server.processor"] < PROCESSOR_IMPORT_BUDGET * 1000000
+
+
+def test_worker_imports():
+    # The modules preloaded by the extractor workers, in a clean interpreter
+    proc = subprocess.run([sys.executable, "-c",
+                           "import json, sys\n"
+                           "import mdf_connect_server.processor.extractors\n"
+                           "import mdf_connect_server.processor.validator\n"
+                           "print(json.dumps(sorted(sys.modules)))"],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, env=os.environ.copy())
+    assert proc.returncode == 0, proc.stderr
+    modules = json.loads(proc.stdout)
+    assert [mod for mod in modules if mod.split(".")[0] in SUBMISSION_MODULES] == []
+    assert "mdf_connect_server.utils" not in modules
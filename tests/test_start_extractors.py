@@ -0,0 +1,150 @@
+import json
+import os
+import random
+
+from mdf_connect_server import CONFIG
+from mdf_connect_server.processor.start_extractors import (group_files, group_tree,
+                                                           summarize_extractor_stats)
+import pytest  # noqa: F401
+
+
+def _make_tree(tmpdir):
+    tree = {
+        "Al2O3.cif": "",
+        "data.csv": "a,b\n1,2\n",
+        "run1": {
+            "OUTCAR": "",
+            "POSCAR": "",
+            "notes.json": "{}",
+            "sub": {
+                "readme.txt": "text"
+            }
+        },
+        "by_dir": {
+            "mdf.json": json.dumps({"group_by_dir": True}),
+            "1.csv": "",
+            "2.csv": ""
+        }
+    }
+
+    def make(path, nodes):
+        for name, content in nodes.items():
+            if isinstance(content, dict):
+                make(path.mkdir(name), content)
+            else:
+                path.join(name).write(content)
+    make(tmpdir, tree)
+    return tmpdir.strpath
+
+
+def _normalize(groups):
+    return sorted((sorted(g["files"]), g["extractors"]) for g in groups)
+
+
+def test_group_tree(tmpdir):
+    root = _make_tree(tmpdir.mkdir("data"))
+    groups = list(group_tree(root, CONFIG["GROUPING_RULES"], num_walkers=2))
+
+    def path(*nodes):
+        return os.path.join(root, *nodes)
+    assert _normalize(groups) == _normalize([
+        {"files": [path("Al2O3.cif")], "extractors": ["crystal_structure", "pif"]},
+        {"files": [path("data.csv")], "extractors": ["csv", "pif"]},
+        {"files": [path("run1", "OUTCAR"), path("run1", "POSCAR")],
+         "extractors": ["pif", "crystal_structure"]},
+        {"files": [path("run1", "notes.json")], "extractors": ["json"]},
+        {"files": [path("run1", "sub", "readme.txt")], "extractors": []},
+        {"files": [path("by_dir", "1.csv"), path("by_dir", "2.csv")], "extractors": []}
+    ])
+
+    # File sizes are kept with each group
+    by_dir = [g for g in groups if g["files"][0].endswith(".csv") and len(g["files"]) == 2][0]
+    assert by_dir["sizes"] == [0, 0]
+    data = [g for g in groups if g["files"] == [path("data.csv")]][0]
+    assert data["sizes"] == [8]
+
+    # No data
+    assert list(group_tree("/dev/null", CONFIG["GROUPING_RULES"])) == []
+
+
+def _legacy_group_files(files, config):
+    """The original substring-scan grouping, as a reference for group_files()."""
+    files = list(files)
+    groups = []
+    if config.get("group_by_dir"):
+        return [{"files": files, "extractors": [], "params": {}}]
+    for format_rules in config.get("known_formats", {}).values():
+        format_groups = {}
+        for f in files:
+            fname = os.path.basename(f).lower().strip()
+            for format_name in format_rules["files"]:
+                if format_name in fname:
+                    pre_post_pattern = fname.replace(format_name, "")
+                    if not format_groups.get(pre_post_pattern):
+                        format_groups[pre_post_pattern] = []
+                    format_groups[pre_post_pattern].append(f)
+                    break
+        for g in format_groups.values():
+            for f in g:
+                files.remove(f)
+            groups.append({"files": g, "extractors": format_rules["extractors"],
+                           "params": format_rules["params"]})
+    groups.extend([{"files": [f], "extractors": [], "params": {}} for f in files])
+    return groups
+
+
+def test_group_files():
+    rng = random.Random(1234)
+    parts = ["", "a", "b_", "run1_", "x.", ".CSV", "OUTCAR", "outcar", "Poscar", "vasp_run.xml",
+             "wavecar", "wavcar", ".cif", ".json", ".csv", "kpoints", ".txt", " "]
+    files = set()
+    while len(files) < 2000:
+        name = "".join(rng.choice(parts) for i in range(rng.randint(1, 4)))
+        files.add(os.path.join("/data", name))
+    files = list(files)
+    # Exact same groups, in the same order
+    assert group_files(files, CONFIG["GROUPING_RULES"]) == \
+        _legacy_group_files(files, CONFIG["GROUPING_RULES"])
+
+    # Overlapping patterns and pattern priority
+    config = {
+        "known_formats": {
+            "first": {
+                "files": ["car", "outcar"],
+                "extractors": ["first"],
+                "params": {}
+            },
+            "second": {
+                "files": ["out", ""],
+                "extractors": ["second"],
+                "params": {}
+            }
+        }
+    }
+    files = ["/d/OUTCAR", "/d/outcar_1", "/d/out_1", "/d/other", "/d/acarb", "/d/bcar"]
+    assert group_files(files, config) == _legacy_group_files(files, config)
+    # No formats
+    assert group_files(files, {}) == _legacy_group_files(files, {})
+    # Group by dir
+    assert group_files(files, {"group_by_dir": True}) == [{
+        "files": files,
+        "extractors": [],
+        "params": {}
+    }]
+
+
+def test_summarize_extractor_stats():
+    def counters(calls, time_ms):
+        return {"calls": calls, "successes": calls, "exceptions": 1, "time_ms": time_ms,
+                "bytes_read": 100, "records": calls}
+    stats = {
+        "csv": counters(10, 1500),
+        "json": counters(3, 20),
+        "pif": counters(7, 32000),
+        "yaml": counters(1, 5)
+    }
+    assert summarize_extractor_stats(stats) == ("pif 32.0s (7 calls, 1 failed, 7 records), "
+                                                "csv 1.5s (10 calls, 1 failed, 10 records), "
+                                                "json 0.0s (3 calls, 1 failed, 3 records)")
+    assert summarize_extractor_stats(stats, num_extractors=1).startswith("pif")
+    assert summarize_extractor_stats({}) == "no extractors run"
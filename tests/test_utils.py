@@ -1,5 +1,10 @@
-from mdf_connect_server import utils
-import pytest  # noqa: F401
+import json
+import os
+import threading
+
+import jsonschema
+from mdf_connect_server import schema_registry, utils
+import pytest
 
 
 def test_make_source_id():
@@ -196,3 +201,125 @@ def test_lookup_http_host():
     assert utils.lookup_http_host("NotAnEndpoint") is None
     # None
     assert utils.lookup_http_host(None) is None
+
+
+def test_schema_registry(tmpdir, monkeypatch):
+    schema_dir = tmpdir.mkdir("schemas")
+    schema_dir.join("base.json").write(json.dumps({
+        "type": "object",
+        "properties": {
+            "count": {
+                "$ref": "defs.json#/definitions/count"
+            }
+        },
+        "required": ["count"]
+    }))
+    schema_dir.join("defs.json").write(json.dumps({
+        "definitions": {
+            "count": {
+                "type": "integer"
+            }
+        }
+    }))
+    # Validators are compiled once and reused
+    validator = utils.get_validator("base", schema_dir.strpath)
+    assert utils.get_validator("base.json", schema_dir.strpath) is validator
+    # References to other schema files are resolved
+    utils.validate_schema({"count": 1}, "base", schema_dir.strpath)
+    with pytest.raises(jsonschema.ValidationError):
+        utils.validate_schema({"count": "one"}, "base", schema_dir.strpath)
+    with pytest.raises(jsonschema.ValidationError):
+        utils.validate_schema({}, "base", schema_dir.strpath)
+    # Missing schema
+    with pytest.raises(ValueError):
+        utils.get_validator("missing", schema_dir.strpath)
+    # RefResolver, without referencing (before jsonschema 4.18)
+    monkeypatch.setattr(schema_registry, "referencing", None)
+    monkeypatch.setattr(schema_registry, "_LOCAL", threading.local())
+    utils.validate_schema({"count": 1}, "base", schema_dir.strpath)
+    with pytest.raises(jsonschema.ValidationError):
+        utils.validate_schema({"count": "one"}, "base", schema_dir.strpath)
+    # Default schemas
+    assert utils.get_validator("record") is utils.get_validator("record.json")
+
+
+def test_modify_status_entry(monkeypatch):
+    class FakeTable():
+        def __init__(self, item):
+            self.item = item
+
+        def get_item(self, Key, ConsistentRead):
+            return {"Item": self.item}
+
+        def put_item(self, Item):
+            self.item = Item
+
+    table = FakeTable({"source_id": "foo_v1", "pid": 1, "code": "SSPzzzzzz",
+                       "extensions": [], "updates": []})
+    monkeypatch.setattr(utils.utils, "old_get_dmo_table",
+                        lambda table_name: {"success": True, "table": table})
+    monkeypatch.setattr(utils.utils, "validate_status", lambda status: {"success": True})
+    # Extractor stats are stored with the status
+    extractor_stats = {
+        "json": {"calls": 2, "successes": 2, "exceptions": 0, "time_ms": 1500,
+                 "bytes_read": 2048, "records": 10, "cache_hits": 0, "cache_misses": 2}
+    }
+    res = utils.modify_status_entry("foo_v1", {"extractor_stats": extractor_stats})
+    assert res["success"]
+    assert table.item == {"source_id": "foo_v1", "pid": 1, "code": "SSPzzzzzz",
+                          "extensions": [], "updates": [], "extractor_stats": extractor_stats}
+    # Invalid statuses are not stored
+    monkeypatch.setattr(utils.utils, "validate_status",
+                        lambda status: {"success": False, "error": "Invalid status"})
+    assert not utils.modify_status_entry("foo_v1", {"code": "S"})["success"]
+    assert table.item["code"] == "SSPzzzzzz"
+
+
+def test_feedstock(tmpdir):
+    dataset = {"mdf": {"source_id": "foo_v1", "resource_type": "dataset", "scroll_id": 0}}
+    records = [{"mdf": {"source_id": "foo_v1", "resource_type": "record", "scroll_id": i},
+                "custom": {"name": "record {}".format(i)}}
+               for i in range(1, 26)]
+
+    # Framed, compressed feedstock
+    feedstock_file = tmpdir.join("foo_v1.json").strpath
+    writer = utils.FeedstockWriter(feedstock_file, block_size=10)
+    for record in records:
+        writer.write(record)
+    # Unfinished feedstock is not read
+    with pytest.raises(FileNotFoundError):
+        list(utils.read_feedstock(feedstock_file))
+    writer.close(dataset)
+    assert writer.num_records == 25
+    # Dataset first, then records
+    assert list(utils.read_feedstock(feedstock_file)) == [dataset] + records
+    # Seek to any entry
+    assert list(utils.read_feedstock(feedstock_file, start=1, stop=4)) == records[:3]
+    assert list(utils.read_feedstock(feedstock_file, start=12, stop=22)) == records[11:21]
+    assert list(utils.read_feedstock(feedstock_file, start=25)) == records[24:]
+    assert list(utils.read_feedstock(feedstock_file, start=1, stop=100)) == records
+    # Shards are on block boundaries, and cover every entry once
+    assert utils.feedstock_shards(feedstock_file, 2) == [(0, 11), (11, None)]
+    assert utils.feedstock_shards(feedstock_file, 10) == [(0, 11), (11, 21), (21, None)]
+    assert [entry for start, stop in utils.feedstock_shards(feedstock_file, 3)
+            for entry in utils.read_feedstock(feedstock_file, start, stop)] == [dataset] + records
+    # The index is required
+    os.rename(feedstock_file + ".idx", feedstock_file + ".old")
+    with pytest.raises(ValueError):
+        list(utils.read_feedstock(feedstock_file))
+    os.rename(feedstock_file + ".old", feedstock_file + ".idx")
+    utils.remove_feedstock(feedstock_file)
+    assert tmpdir.listdir() == []
+
+    # Discarded feedstock leaves nothing behind
+    writer = utils.FeedstockWriter(feedstock_file)
+    writer.write(records[0])
+    writer.discard()
+    assert tmpdir.listdir() == []
+
+    # Plain JSON Lines feedstock
+    legacy_file = tmpdir.join("legacy.json")
+    legacy_file.write("".join(json.dumps(entry) + "\n" for entry in [dataset] + records))
+    assert list(utils.read_feedstock(legacy_file.strpath)) == [dataset] + records
+    assert list(utils.read_feedstock(legacy_file.strpath, start=1, stop=4)) == records[:3]
+    assert utils.feedstock_shards(legacy_file.strpath, 3) == [(0, None)]
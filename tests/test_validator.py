@@ -1,5 +1,6 @@
-from mdf_connect_server import CONFIG
+from mdf_connect_server import CONFIG, utils
 from mdf_connect_server.processor import Validator
+import mdf_connect_server.processor.validator as validator
 import pytest
 
 
@@ -346,3 +347,181 @@ def test_validator():
     bad_res = val.start_dataset(bad_dataset)
     assert bad_res["success"] is False
     assert "Invalid dataset metadata" in bad_res["error"]
+
+
+def test_validator_split():
+    dataset = {
+        "dc": {
+            'creators': [{
+                'creatorName': 'Footon, Bartholomew',
+                'familyName': 'Footon',
+                'givenName': 'Bartholomew'
+            }],
+            'publicationYear': '2018',
+            'publisher': 'Materials Data Facility',
+            'resourceType': {
+                'resourceType': 'Dataset',
+                'resourceTypeGeneral': 'Dataset'
+            },
+            'titles': [{
+                'title': 'Foo Bar Dataset'
+            }]
+        },
+        "mdf": {
+            "source_name": "foo_bar_dataset",
+            "source_id": "foo_bar_dataset_v1",
+            "acl": ["public"]
+        }
+    }
+    parent = Validator(schema_path=CONFIG["SCHEMA_PATH"])
+    assert parent.start_dataset(dataset)["success"]
+    # Records are validated elsewhere (ex. extractor workers)
+    worker = Validator(schema_path=CONFIG["SCHEMA_PATH"])
+    worker.start_records(dataset)
+    results = [worker.validate_record({
+                    "files": {
+                        "data_type": "example",
+                        "filename": "{}.txt".format(i),
+                        "length": 10 * i
+                    },
+                    "material": {"composition": "NaCl"},
+                    "custom": {"i": i}
+               }) for i in range(1, 4)]
+    assert all(res["success"] for res in results)
+    record = results[0]["record"]
+    assert record["mdf"]["source_id"] == "foo_bar_dataset_v1"
+    assert record["mdf"]["ingest_date"] == dataset["mdf"]["ingest_date"]
+    assert record["material"]["elements"] == ["Cl", "Na"]
+    assert record["custom"] == {"i": "1"}
+    # Workers cannot add records
+    assert worker.add_validated_record(record)["success"] is False
+
+    # The parent adds them in its own order
+    for res in reversed(results):
+        assert parent.add_validated_record(res["record"])["success"]
+    finished = list(parent.get_finished_dataset())
+    assert finished[0]["data"]["total_size"] == 60
+    assert [rec["mdf"]["scroll_id"] for rec in finished[1:]] == [1, 2, 3]
+    assert [rec["custom"]["i"] for rec in finished[1:]] == ["3", "2", "1"]
+
+    bad_res = worker.validate_record({"not_a_block": {}})
+    assert bad_res["success"] is False
+    assert "Invalid record metadata" in bad_res["error"]
+
+
+def test_normalize():
+    record = {
+        "mdf": {
+            "acl": ["public"],
+            "organizations": None
+        },
+        "files": ({"filename": "foo.txt", "url": None, "length": None},),
+        "material": {
+            "composition": "NaCl",
+            "elements": ["Cl", None, "Na"]
+        },
+        "custom": {
+            "energy": float("nan"),
+            "note": None,
+            "converged": True
+        }
+    }
+    assert validator._normalize(record, skip=["url"]) == {
+        "mdf": {
+            "acl": ["public"]
+        },
+        "files": [{"filename": "foo.txt", "url": None}],
+        "material": {
+            "composition": "NaCl",
+            "elements": ["Cl", "Na"]
+        },
+        "custom": {
+            "energy": "nan",
+            "note": "None",
+            "converged": "True"
+        }
+    }
+    # Not modified in place
+    assert record["mdf"]["organizations"] is None
+    # NaN and Infinity are only allowed as custom values
+    with pytest.raises(ValueError):
+        validator._normalize({"material": {"energy": [1.0, float("nan")]}})
+    with pytest.raises(ValueError):
+        validator._normalize({"dft": {"cutoff_energy": float("inf")}})
+
+
+def test_validator_feedstock(tmpdir):
+    dataset = {
+        "dc": {
+            'creators': [{
+                'creatorName': 'Footon, Bartholomew',
+                'familyName': 'Footon',
+                'givenName': 'Bartholomew'
+            }],
+            'publicationYear': '2018',
+            'publisher': 'Materials Data Facility',
+            'resourceType': {
+                'resourceType': 'Dataset',
+                'resourceTypeGeneral': 'Dataset'
+            },
+            'titles': [{
+                'title': 'Foo Bar Dataset'
+            }]
+        },
+        "mdf": {
+            "source_name": "foo_bar_dataset",
+            "source_id": "foo_bar_dataset_v1",
+            "acl": ["public"]
+        }
+    }
+    # Records are streamed straight into the feedstock file
+    feedstock_file = tmpdir.join("feedstock", "foo_bar_dataset_v1.json").strpath
+    vald = Validator(schema_path=CONFIG["SCHEMA_PATH"], feedstock_file=feedstock_file)
+    assert vald.start_dataset(dataset)["success"]
+    for i in range(1, 4):
+        assert vald.add_record({
+            "files": {
+                "data_type": "example",
+                "filename": "{}.txt".format(i),
+                "length": 10 * i
+            },
+            "custom": {"i": i}
+        })["success"]
+    finished = list(vald.get_finished_dataset())
+    assert finished[0]["data"]["total_size"] == 60
+    assert [rec["mdf"]["scroll_id"] for rec in finished[1:]] == [1, 2, 3]
+    assert list(utils.read_feedstock(feedstock_file)) == finished
+
+    # Discarded datasets leave no feedstock
+    utils.remove_feedstock(feedstock_file)
+    vald = Validator(schema_path=CONFIG["SCHEMA_PATH"], feedstock_file=feedstock_file)
+    assert vald.start_dataset(dataset)["success"]
+    assert vald.add_record({"custom": {"i": 1}})["success"]
+    vald.discard_dataset()
+    assert tmpdir.join("feedstock").listdir() == []
+
+
+def test_parse_elements():
+    assert validator._parse_elements("Al2O3") == ("Al", "O")
+    assert validator._parse_elements("Nd2Fe14B") == ("B", "Fe", "Nd")
+    assert validator._parse_elements("NaCl and KCl") == ("Cl", "K", "Na")
+    assert validator._parse_elements("(Fe0.8Ni0.2)3-C") == ("C", "Fe", "Ni")
+    assert validator._parse_elements("FFO2") == ("F", "O")
+    assert validator._parse_elements("") == ()
+    # Not chemical formulas
+    assert validator._parse_elements("Aluminum oxide") is None
+    assert validator._parse_elements("Sample X") is None
+    # Cached per composition
+    assert validator._parse_elements("Nd2Fe14B") is validator._parse_elements("Nd2Fe14B")
+
+    vald = Validator(schema_path=CONFIG["SCHEMA_PATH"])
+    vald.start_records({"mdf": {"source_id": "foo_v1", "source_name": "foo", "version": 1,
+                                "acl": ["public"], "ingest_date": "2018-01-01T00:00:00Z"}})
+    res = vald.validate_record({"material": {"composition": "Nd2Fe14B"}})
+    assert res["record"]["material"]["elements"] == ["B", "Fe", "Nd"]
+    res = vald.validate_record({"material": {"composition": "Mystery alloy"}})
+    assert "elements" not in res["record"]["material"]
+    # Elements are added before validation
+    record = {"material": {"elemental_proportions": {"O": 0.6, "Al": 0.4}}}
+    vald.validate_record(record)
+    assert record["material"]["elements"] == ["Al", "O"]